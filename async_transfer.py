@@ -0,0 +1,448 @@
+import os
+import json
+import base64
+import time
+import uuid
+import asyncio
+import functools
+import tempfile
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from crypto_engine import encrypt_file, StreamDecryptor, KeyRetired
+from drive_manager import get_client, HTTP_TIMEOUT, SIDECAR_PROPERTY
+from upload_engine import (CHUNK_ALIGN, UPLOAD_CHUNK_SIZE, MAX_RETRIES,
+                           RETRY_STATUSES, TransientError, backoff_delay,
+                           _confirmed_offset)
+from catalog import Catalog, CONTAINER_FORMAT, file_digest
+from metrics import timed, count
+import batch
+
+try:
+    import aiohttp
+except ImportError:     # the threaded engine in batch.py still works
+    aiohttp = None
+
+# asyncio counterpart of batch.encrypt_upload_many/download_decrypt_many
+# for batches of many small objects: one event loop keeps hundreds of
+# Drive requests in flight over aiohttp instead of a thread per
+# transfer. Crypto and disk work run on a thread pool. Every request
+# holds a global semaphore slot and a token from its host's rate
+# limiter. A 429, or a 403 rateLimitExceeded, slows that host down
+# instead of failing the transfer.
+CONCURRENCY = 64            # Drive requests in flight, all hosts together
+TRANSFERS = 32              # files between first read and final result
+HOST_RATE = 100.0           # requests/s per host to start from (and cap)
+HOST_BURST = CONCURRENCY
+MIN_HOST_RATE = 1.0
+RATE_STEP = 0.5             # added back per successful request
+MULTIPART_LIMIT = 5 * 1024 * 1024   # larger objects use a resumable session
+READ_CHUNK = 1024 * 1024            # download bytes per trip to the pool
+CRYPTO_WORKERS = os.cpu_count() or 1
+_RATE_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+
+def _rate_limited(status, body):
+    return status == 429 or (status == 403 and
+                             any(r in body for r in _RATE_REASONS))
+
+def _retry_after(headers, attempt):
+    # seconds the server asked for, else exponential backoff
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return backoff_delay(attempt)
+
+class HostLimiter:
+    # token bucket for one host. Throttling halves the rate and pauses
+    # the host for the requested delay; each success adds RATE_STEP back,
+    # up to the starting rate. The rate outlives an event loop (a client
+    # reused by another asyncio.run keeps what it learned); the lock is
+    # made afresh for each loop, since an asyncio.Lock belongs to one.
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        self.ceiling = self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._loop = None
+        self._lock = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttled(self, delay):
+        self.rate = max(MIN_HOST_RATE, self.rate / 2)
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        count("async.throttled")
+
+    def succeeded(self):
+        self.rate = min(self.ceiling, self.rate + RATE_STEP)
+
+class AsyncDriveClient:
+    # Drive REST calls over one aiohttp session. Credentials, and their
+    # refresh ahead of expiry, come from the synchronous DriveClient.
+    def __init__(self, drive=None, root_url=None, concurrency=CONCURRENCY,
+                 host_rate=HOST_RATE, chunk_size=UPLOAD_CHUNK_SIZE,
+                 timeout=HTTP_TIMEOUT):
+        if aiohttp is None:
+            raise RuntimeError("The async engine needs the 'aiohttp' package.")
+        self.drive = drive or get_client()
+        self.root_url = root_url or self.drive.root_url
+        self.chunk_size = max(CHUNK_ALIGN, chunk_size // CHUNK_ALIGN * CHUNK_ALIGN)
+        self.host_rate = host_rate
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._semaphore = None
+        self._hosts = {}
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _open_session(self):
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None,
+                                              sock_read=self._timeout),
+                connector=aiohttp.TCPConnector(limit=self._concurrency))
+        return self._session
+
+    async def _auth_headers(self):
+        creds = await asyncio.get_running_loop().run_in_executor(
+            None, self.drive.credentials)
+        headers = {}
+        creds.apply(headers)
+        return headers
+
+    @asynccontextmanager
+    async def _call(self, method, url, data=None, headers=None,
+                    max_retries=MAX_RETRIES):
+        # yields the response once it has a usable status (a 416 too,
+        # for download_to to judge); rate limits, 5xx and connection
+        # errors are retried with backoff, up to max_retries times, then
+        # raise TransientError
+        session = self._open_session()
+        limiter = self._hosts.setdefault(urlparse(url).netloc,
+                                         HostLimiter(self.host_rate))
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            throttled = False
+            async with self._semaphore:
+                all_headers = dict(await self._auth_headers(), **(headers or {}))
+                try:
+                    resp = await session.request(method, url, data=data,
+                                                 headers=all_headers,
+                                                 allow_redirects=False)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    resp, error = None, e
+                if resp is not None:
+                    if resp.status < 400 or resp.status == 416:
+                        limiter.succeeded()
+                        try:
+                            yield resp
+                        finally:
+                            resp.release()
+                        return
+                    body = await resp.read()
+                    resp.release()
+                    error = f"HTTP {resp.status}"
+                    if _rate_limited(resp.status, body):
+                        limiter.throttled(_retry_after(resp.headers, attempt))
+                        throttled = True
+                    elif resp.status not in RETRY_STATUSES:
+                        raise RuntimeError(f"Drive request failed: HTTP "
+                                           f"{resp.status} {body[:200]!r}")
+            if attempt >= max_retries:
+                raise TransientError(str(error))
+            count("async.retries")
+            if not throttled:       # a throttled host already paused itself
+                await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    # ── uploads ───────────────────────────────────────────────────────────────
+    async def upload_bytes(self, data, name):
+        # one multipart/related request, CRLF line endings as RFC 2046
+        # asks for
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Type: application/json; charset=UTF-8"
+                f"\r\n\r\n{json.dumps({'name': name})}\r\n--{boundary}\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode()
+        body += data + f"\r\n--{boundary}--\r\n".encode()
+        url = f"{self.root_url}upload/drive/v3/files?uploadType=multipart&fields=id"
+        with timed("upload", len(data)):
+            async with self._call("POST", url, body, {
+                    "Content-Type": f'multipart/related; boundary="{boundary}"'}) as resp:
+                file_id = (await resp.json(content_type=None))["id"]
+        count("bytes.up", len(data))
+        return file_id
+
+    async def upload_file(self, path, name=None):
+        loop = asyncio.get_running_loop()
+        name = name or os.path.basename(path)
+        size = os.path.getsize(path)
+        if size <= MULTIPART_LIMIT:
+            data = await loop.run_in_executor(None, _read_file, path)
+            return await self.upload_bytes(data, name)
+
+        url = f"{self.root_url}upload/drive/v3/files?uploadType=resumable&fields=id"
+        with timed("upload", size):
+            async with self._call("POST", url, json.dumps({"name": name}).encode(), {
+                    "Content-Type": "application/json; charset=UTF-8",
+                    "X-Upload-Content-Type": "application/octet-stream",
+                    "X-Upload-Content-Length": str(size)}) as resp:
+                session_url = resp.headers["Location"]
+            offset, attempt = 0, 0
+            while True:
+                chunk = await loop.run_in_executor(None, _read_file, path,
+                                                   offset, self.chunk_size)
+                last = offset + len(chunk) - 1
+                try:
+                    # not retried as is: the server may have kept part
+                    # of the chunk, so a retry starts with its offset
+                    async with self._call("PUT", session_url, chunk, {
+                            "Content-Range": f"bytes {offset}-{last}/{size}"},
+                            max_retries=0) as resp:
+                        confirmed, file_id = await self._session_state(resp, size)
+                    attempt = 0
+                except TransientError:
+                    if attempt >= MAX_RETRIES:
+                        raise
+                    count("upload.retries")
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+                    async with self._call("PUT", session_url, b"", {
+                            "Content-Range": f"bytes */{size}"}) as resp:
+                        confirmed, file_id = await self._session_state(resp, size)
+                count("bytes.up", confirmed - offset)
+                offset = confirmed
+                if file_id:
+                    return file_id
+
+    @staticmethod
+    async def _session_state(resp, size):
+        # (confirmed offset, file ID once the upload is complete)
+        if resp.status in (200, 201):
+            return size, (await resp.json(content_type=None))["id"]
+        if resp.status != 308:
+            raise RuntimeError(f"Upload failed: HTTP {resp.status}")
+        return _confirmed_offset(resp.headers), None
+
+    # ── downloads ─────────────────────────────────────────────────────────────
+    async def download_to(self, file_id, write):
+        # awaits write(chunk) for the whole object, in order; a dropped
+        # connection resumes with a Range request where it stopped
+        url = f"{self.root_url}drive/v3/files/{file_id}?alt=media"
+        received, attempt = 0, 0
+        with timed("download") as span:
+            while True:
+                headers = {"Range": f"bytes={received}-"} if received else None
+                try:
+                    async with self._call("GET", url, headers=headers) as resp:
+                        if resp.status == 416:
+                            # the resume starts past the end: the connection
+                            # dropped after the last byte had arrived. The
+                            # body is an error document, not media.
+                            _check_size(file_id, resp.headers, received)
+                            break
+                        skip = received if resp.status == 200 else 0
+                        pending = bytearray()
+                        async for chunk in resp.content.iter_chunked(READ_CHUNK):
+                            if skip:
+                                # the server ignored Range: drop what we have
+                                cut = min(skip, len(chunk))
+                                chunk, skip = chunk[cut:], skip - cut
+                            pending += chunk
+                            if len(pending) >= READ_CHUNK:
+                                await write(bytes(pending))
+                                received += len(pending)
+                                pending.clear()
+                        if pending:
+                            await write(bytes(pending))
+                            received += len(pending)
+                    break
+                except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError,
+                        asyncio.TimeoutError):
+                    if attempt >= MAX_RETRIES:
+                        raise
+                    count("download.retries")
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+            span.bytes = received
+        count("bytes.down", received)
+        return received
+
+    async def wrapped_key(self, file_id):
+        url = f"{self.root_url}drive/v3/files/{file_id}?fields=appProperties"
+        async with self._call("GET", url) as resp:
+            meta = await resp.json(content_type=None)
+        value = (meta.get("appProperties") or {}).get(SIDECAR_PROPERTY)
+        return base64.b64decode(value) if value else None
+
+def _check_size(file_id, headers, received):
+    # a 416 gives the object's size as "bytes */<size>"
+    size = headers.get("Content-Range", "").rpartition("/")[2]
+    if size.isdigit() and int(size) != received:
+        raise RuntimeError(f"Drive file {file_id} changed during download "
+                           f"({received} of {size} bytes received).")
+
+def _read_file(path, offset=0, size=-1):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+# ── batch API ─────────────────────────────────────────────────────────────────
+async def _upload_one(client, item, password, key_cache, catalog, compress,
+                      pool):
+    loop = asyncio.get_running_loop()
+    fd, tmp = tempfile.mkstemp(suffix=".cvault")
+    os.close(fd)
+    try:
+        t0 = time.perf_counter()
+        item["sha256"] = await loop.run_in_executor(pool, file_digest,
+                                                    item["path"])
+        stats = await loop.run_in_executor(pool, functools.partial(
+            encrypt_file, item["path"], tmp, password, key_cache=key_cache,
+            compress=compress))
+        item["crypto_s"] = time.perf_counter() - t0
+        item["bytes"], item["stored"], item["codec"] = (
+            stats["bytes"], stats["stored"], stats["codec"])
+        t0 = time.perf_counter()
+        item["file_id"] = await client.upload_file(tmp, item["name"])
+        item["transfer_s"] = time.perf_counter() - t0
+        await loop.run_in_executor(None, functools.partial(
+            catalog.add_local, item["name"], item["file_id"], item["path"],
+            sha256=item["sha256"], format=CONTAINER_FORMAT))
+    except Exception as e:
+        item["error"] = str(e)
+    finally:
+        os.remove(tmp)
+
+async def _download_one(client, item, output_dir, password, key_cache, pool):
+    loop = asyncio.get_running_loop()
+    wrapped = None
+    try:
+        item["path"] = batch._inside(output_dir, item["name"])
+        os.makedirs(os.path.dirname(item["path"]) or ".", exist_ok=True)
+        t0 = time.perf_counter()
+        while True:
+            out = open(item["path"], "wb")
+            decryptor = StreamDecryptor(out, password, key_cache, wrapped)
+            try:
+                async def write(chunk):
+                    await loop.run_in_executor(pool, decryptor.update, chunk)
+
+                await client.download_to(item["file_id"], write)
+                await loop.run_in_executor(pool, decryptor.finalize)
+                break
+            except KeyRetired:
+                if wrapped is not None:
+                    raise
+                # header names a retired vault key: use the Drive sidecar
+                wrapped = await client.wrapped_key(item["file_id"])
+                if wrapped is None:
+                    raise
+            finally:
+                out.close()
+        item["transfer_s"] = time.perf_counter() - t0
+        item["bytes"] = os.path.getsize(item["path"])
+    except Exception as e:
+        item["error"] = str(e)
+        if item.get("path") and os.path.exists(item["path"]):
+            os.remove(item["path"])   # never leave a partial file behind
+
+async def _run(items, work, client, on_result, transfers):
+    # work(item) for every item with at most `transfers` files in flight;
+    # results come back in input order. The session belongs to this event
+    # loop, so it is closed at the end either way (and reopened on reuse).
+    client = client or AsyncDriveClient()
+    slots = asyncio.Semaphore(transfers)
+
+    async def one(item):
+        async with slots:
+            await work(client, item)
+        if on_result:
+            on_result(item)
+        return item
+
+    try:
+        return list(await asyncio.gather(*(one(item) for item in items)))
+    finally:
+        await client.close()
+
+async def async_upload_many(files, password, key_cache=None, client=None,
+                            catalog=None, compress=None, on_result=None,
+                            transfers=TRANSFERS, workers=CRYPTO_WORKERS):
+    # files: iterable of (local path, name on Drive); like
+    # batch.encrypt_upload_many, every upload is recorded in the catalog
+    catalog = catalog if catalog is not None else Catalog()
+    pool = ThreadPoolExecutor(workers)
+    items = [{"path": path, "name": name} for path, name in files]
+    try:
+        return await _run(items, lambda client, item: _upload_one(
+            client, item, password, key_cache, catalog, compress, pool),
+            client, on_result, transfers)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+async def async_download_many(entries, output_dir, password, key_cache=None,
+                              client=None, on_result=None,
+                              transfers=TRANSFERS, workers=CRYPTO_WORKERS,
+                              catalog=None):
+    # entries: (Drive file id, path relative to output_dir). Pack members
+    # ("<pack id>#<n>") go through batch.download_members on the pool,
+    # ahead of the rest; results still come back in input order.
+    entries = list(entries)
+    order = {entry: i for i, entry in enumerate(entries)}
+    members = [(fid, name) for fid, name in entries if "#" in fid]
+    items = [{"file_id": fid, "name": name} for fid, name in entries
+             if "#" not in fid]
+    results = []
+    if members:
+        results += await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(batch.download_members, members,
+                                    output_dir, password, key_cache,
+                                    on_result=on_result, catalog=catalog))
+    pool = ThreadPoolExecutor(workers)
+    try:
+        results += await _run(items, lambda client, item: _download_one(
+            client, item, output_dir, password, key_cache, pool),
+            client, on_result, transfers)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return sorted(results, key=lambda r: order[r["file_id"], r["name"]])
+
+# ── blocking entry points for the CLI and the GUI's worker threads ────────────
+def available():
+    return aiohttp is not None
+
+def upload_many(files, password, **kw):
+    return asyncio.run(async_upload_many(files, password, **kw))
+
+def download_many(entries, output_dir, password, **kw):
+    return asyncio.run(async_download_many(entries, output_dir, password, **kw))
@@ -0,0 +1,454 @@
+import io
+import os
+import hashlib
+import queue
+import tempfile
+import threading
+import time
+from crypto_engine import (encrypt_file, encrypt_stream, rekey_file,
+                           sidecar_key, read_header, ordered_map, KeyCache, KeyRetired, MAGIC, MAGIC_V2,
+                           HEADER_PROBE)
+from drive_manager import get_client, upload_file, BATCH_SIZE
+from transfer import download_decrypt
+from catalog import Catalog, CONTAINER_FORMAT, file_digest
+from pack import PackReader, read_index, read_members
+
+# Batch mode runs crypto and Drive transfer as two overlapping stages.
+# The first stage may get at most QUEUE_SIZE files ahead of the second,
+# which bounds the disk used by pending temp files.
+QUEUE_SIZE = 4
+TRANSFERS = 4
+# ciphertext waiting for upload lives here under a name derived from the
+# source file, so a crashed run can find it again and resume the upload
+STAGING_DIR = os.path.join(tempfile.gettempdir(), "cvault-staging")
+_DONE = object()
+
+# ── inputs ────────────────────────────────────────────────────────────────────
+def collect_files(source):
+    # a directory is walked recursively; any other file is a manifest
+    # listing one path per line
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                yield path, os.path.relpath(path, source)
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    for path in _manifest_lines(source):
+        full = path if os.path.isabs(path) else os.path.join(base, path)
+        yield full, path
+
+def read_download_manifest(path):
+    # "file_id<TAB>relative/output/path" per line, as written by
+    # write_upload_manifest
+    for line in _manifest_lines(path):
+        parts = line.split("\t", 1) if "\t" in line else line.split(None, 1)
+        if len(parts) != 2:
+            raise ValueError(f"Bad manifest line: {line!r}")
+        yield parts[0].strip(), parts[1].strip()
+
+def write_upload_manifest(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in results:
+            if r.get("file_id") and "members" in r:
+                # pack members are addressed as "<pack id>#<n>"
+                for i, m in enumerate(r["members"]):
+                    f.write(f"{r['file_id']}#{i}\t{m['name']}\n")
+            elif r.get("file_id"):
+                f.write(f"{r['file_id']}\t{r['name']}\n")
+
+def _manifest_lines(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+def _inside(root, name):
+    # manifest entries must not write outside the output directory
+    root = os.path.abspath(root)
+    path = os.path.abspath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Refusing to write outside {root}: {name}")
+    return path
+
+def staged_path(path):
+    st = os.stat(path)
+    ident = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    name = hashlib.sha256(ident.encode()).hexdigest()[:32] + ".cvault"
+    return os.path.join(STAGING_DIR, name)
+
+def _remove(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+# ── pipeline ──────────────────────────────────────────────────────────────────
+def _run_pipeline(items, first, second, on_result=None, first_workers=1,
+                  second_workers=1, queue_size=QUEUE_SIZE):
+    # first(item) and second(item) each run on their own pool of threads;
+    # each stage records its own errors on the item
+    handoff = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    lock = threading.Lock()
+    items = iter(items)
+    producers_left = [first_workers]
+    results = []
+    failure = []
+
+    def producer():
+        try:
+            while not stop.is_set():
+                with lock:
+                    item = next(items, _DONE)
+                if item is _DONE:
+                    break
+                try:
+                    first(item)
+                except Exception as e:
+                    item["error"] = str(e)
+                handoff.put(item)
+        except Exception as e:
+            # the input itself broke (unreadable manifest, walk error, ...)
+            failure.append(e)
+            stop.set()
+        finally:
+            with lock:
+                producers_left[0] -= 1
+                last = producers_left[0] == 0
+            if last:
+                handoff.put(_DONE)
+
+    def consumer():
+        while True:
+            item = handoff.get()
+            if item is _DONE:
+                handoff.put(_DONE)   # let the other consumers see it too
+                return
+            try:
+                if stop.is_set():
+                    continue
+                if "error" not in item:
+                    try:
+                        second(item)
+                    except Exception as e:
+                        item["error"] = str(e)
+                with lock:
+                    results.append(item)
+                    if on_result:
+                        on_result(item)
+            except Exception as e:
+                failure.append(e)
+                stop.set()
+            finally:
+                _remove(item.pop("tmp", None))
+
+    threads = [threading.Thread(target=producer, daemon=True)
+               for _ in range(first_workers)]
+    threads += [threading.Thread(target=consumer, daemon=True)
+                for _ in range(second_workers)]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.2)
+    finally:
+        # on Ctrl-C: stop feeding, let in-flight items finish, clean up
+        stop.set()
+        for t in threads:
+            t.join()
+    if failure:
+        raise failure[0]
+    return results
+
+def encrypt_upload_many(files, password, jobs=1, key_cache=None,
+                        client=None, on_result=None, transfers=TRANSFERS,
+                        catalog=None, compress=None):
+    # files: iterable of (local path, name to store on Drive); every
+    # upload is recorded in the catalog. compress: see encrypt_file
+    client = client or get_client()
+    catalog = catalog if catalog is not None else Catalog()
+
+    def encrypt(item):
+        item["bytes"] = os.path.getsize(item["path"])
+        item["sha256"] = file_digest(item["path"])
+        item["tmp"] = staged_path(item["path"])
+        if client.journal.has_session(item["tmp"]):
+            # interrupted earlier: upload the same ciphertext from where it
+            # stopped instead of re-encrypting
+            item["resumed"] = True
+            return
+        t0 = time.perf_counter()
+        stats = encrypt_file(item["path"], item["tmp"], password,
+                             workers=jobs, key_cache=key_cache,
+                             compress=compress)
+        item["stored"], item["codec"] = stats["stored"], stats["codec"]
+        item["crypto_s"] = time.perf_counter() - t0
+
+    def upload(item):
+        t0 = time.perf_counter()
+        try:
+            item["file_id"] = upload_file(item["tmp"], item["name"],
+                                          client=client, verbose=False)
+        except Exception:
+            if client.journal.has_session(item["tmp"]):
+                item.pop("tmp")    # keep it for the next run to resume
+            raise
+        item["transfer_s"] = time.perf_counter() - t0
+        catalog.add_local(item["name"], item["file_id"], item["path"],
+                          sha256=item["sha256"], format=CONTAINER_FORMAT)
+
+    items = ({"path": path, "name": name} for path, name in files)
+    return _run_pipeline(items, encrypt, upload, on_result,
+                         second_workers=transfers)
+
+def encrypt_upload_packs(packs, password, jobs=1, key_cache=None,
+                         client=None, on_result=None, transfers=TRANSFERS,
+                         catalog=None):
+    # packs: lists of (local path, name), as split by pack.plan. Each list
+    # becomes one encrypted object on Drive; the catalog records the pack
+    # and a row per member with its offset inside it. Results are per
+    # pack, with the members (and any unreadable files) listed on them.
+    client = client or get_client()
+    catalog = catalog if catalog is not None else Catalog()
+
+    def build(item):
+        reader = PackReader(item.pop("files"))
+        item["members"], item["errors"] = reader.members, reader.errors
+        fd, item["tmp"] = tempfile.mkstemp(suffix=".cvault")
+        t0 = time.perf_counter()
+        with os.fdopen(fd, "wb") as out:
+            for block in encrypt_stream(reader, password, workers=jobs,
+                                        key_cache=key_cache):
+                out.write(block)
+        item["crypto_s"] = time.perf_counter() - t0
+        item["bytes"] = reader.offset
+        if not item["members"]:
+            raise ValueError("no readable files")
+
+    def upload(item):
+        t0 = time.perf_counter()
+        item["file_id"] = upload_file(item["tmp"], item["name"],
+                                      client=client, verbose=False)
+        item["transfer_s"] = time.perf_counter() - t0
+        catalog.add_pack(item["file_id"], item["name"],
+                         os.path.getsize(item["tmp"]), item["members"])
+
+    items = ({"name": f"pack-{os.urandom(8).hex()}", "files": files}
+             for files in packs)
+    return _run_pipeline(items, build, upload, on_result,
+                         second_workers=transfers)
+
+def _resolve_members(entries, password, key_cache, client, catalog):
+    # "<pack id>#<n>" manifest entries -> pack member rows, from the
+    # catalog or, failing that, from each pack's own index
+    indexes = {}
+    for file_id, name in entries:
+        member = catalog.get(file_id) if catalog else None
+        if member is None:
+            pack_id, _, n = file_id.rpartition("#")
+            if pack_id not in indexes:
+                indexes[pack_id] = read_index(pack_id, password, client,
+                                              key_cache)
+            member = indexes[pack_id][int(n)]
+        yield dict(member, name=name, drive_id=file_id)
+
+def download_members(entries, output_dir, password, key_cache=None,
+                     client=None, on_result=None, catalog=None):
+    # entries: (member id, relative output path); members of one pack
+    # share its header read, and neighbours come down in one range
+    client = client or get_client()
+    results = []
+    members = list(_resolve_members(entries, password, key_cache, client,
+                                    catalog))
+    t0 = time.perf_counter()
+    try:
+        for m, data in read_members(members, password, client, key_cache):
+            r = {"file_id": m["drive_id"], "name": m["name"]}
+            try:
+                r["path"] = _inside(output_dir, m["name"])
+                os.makedirs(os.path.dirname(r["path"]) or ".", exist_ok=True)
+                with open(r["path"], "wb") as f:
+                    f.write(data)
+                r["bytes"] = len(data)
+            except OSError as e:
+                r["error"] = str(e)
+            now = time.perf_counter()
+            r["transfer_s"], t0 = now - t0, now
+            results.append(r)
+            if on_result:
+                on_result(r)
+    except Exception as e:
+        # a pack that can't be read fails every member still pending
+        done = {r["file_id"] for r in results}
+        for m in members:
+            if m["drive_id"] not in done:
+                r = {"file_id": m["drive_id"], "name": m["name"],
+                     "error": str(e)}
+                results.append(r)
+                if on_result:
+                    on_result(r)
+    return results
+
+def download_decrypt_many(entries, output_dir, password, key_cache=None,
+                          client=None, on_result=None, transfers=TRANSFERS,
+                          catalog=None):
+    # entries: iterable of (Drive file id, output path relative to output_dir)
+    # each download decrypts as it streams, so there's no temp file; the
+    # second stage only has to account for the result. Pack members are
+    # fetched first, grouped by pack.
+    client = client or get_client()
+    entries = list(entries)
+    members = [(fid, name) for fid, name in entries if "#" in fid]
+    entries = [(fid, name) for fid, name in entries if "#" not in fid]
+    results = []
+    if members:
+        results += download_members(members, output_dir, password, key_cache,
+                                    client, on_result, catalog)
+
+    def fetch(item):
+        item["path"] = _inside(output_dir, item["name"])
+        os.makedirs(os.path.dirname(item["path"]) or ".", exist_ok=True)
+        t0 = time.perf_counter()
+        download_decrypt(item["file_id"], item["path"], password,
+                         client=client, key_cache=key_cache)
+        item["transfer_s"] = time.perf_counter() - t0
+
+    def finish(item):
+        item["bytes"] = os.path.getsize(item["path"])
+
+    items = ({"file_id": fid, "name": name} for fid, name in entries)
+    return results + _run_pipeline(items, fetch, finish, on_result,
+                                   first_workers=transfers)
+
+def rekey_many(files, password, params=None, key_cache=None, on_result=None):
+    # files: iterable of (local path, display name); rewrites the header
+    # of every vault container under `params` (default: the vault's
+    # current KDF). Anything that isn't a container is skipped.
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    results = []
+    for path, name in files:
+        r = {"path": path, "name": name}
+        try:
+            with open(path, "rb") as f:
+                magic = f.read(len(MAGIC_V2))
+            if magic not in (MAGIC, MAGIC_V2):
+                r["skipped"] = True
+            else:
+                r["rekeyed"] = rekey_file(path, password, params, key_cache)
+        except Exception as e:
+            r["error"] = str(e)
+        results.append(r)
+        if on_result:
+            on_result(r)
+    return results
+
+def rewrap_many(entries, password, key_cache=None, client=None,
+                transfers=TRANSFERS, on_result=None):
+    # entries: iterable of (Drive file id, name). Each object's content key
+    # is re-wrapped under the current vault KEK into its Drive sidecar:
+    # one ranged read of the header per object, then batched metadata
+    # updates. Payloads are never downloaded or re-uploaded.
+    client = client or get_client()
+    key_cache = key_cache if key_cache is not None else KeyCache()
+
+    def rewrap(entry):
+        r = {"file_id": entry[0], "name": entry[1]}
+        try:
+            head, _ = client.fetch_range(r["file_id"], 0, HEADER_PROBE - 1)
+            if head[:len(MAGIC_V2)] != MAGIC_V2:
+                r["skipped"] = True     # CVLT1: keyed by its password alone
+                return r
+            records = read_header(io.BytesIO(head[len(MAGIC_V2):]))
+            try:
+                wrapped = sidecar_key(records, password, key_cache)
+            except KeyRetired:
+                wrapped = client.wrapped_key(r["file_id"])
+                if wrapped is None:
+                    raise
+                wrapped = sidecar_key(records, password, key_cache, wrapped)
+            if wrapped is None:
+                r["skipped"] = True
+            else:
+                r["wrapped"] = wrapped
+        except Exception as e:
+            r["error"] = str(e)
+        return r
+
+    results = []
+    pending = []
+
+    def flush():
+        errors = client.set_wrapped_keys({r["file_id"]: r.pop("wrapped")
+                                          for r in pending})
+        for r in pending:
+            if r["file_id"] in errors:
+                r["error"] = str(errors[r["file_id"]])
+            else:
+                r["rewrapped"] = True
+            if on_result:
+                on_result(r)
+        pending.clear()
+
+    for r in ordered_map(rewrap, entries, transfers):
+        results.append(r)
+        if "wrapped" in r:
+            pending.append(r)
+            if len(pending) >= BATCH_SIZE:
+                flush()
+        elif on_result:
+            on_result(r)
+    if pending:
+        flush()
+    return results
+
+# ── reporting ─────────────────────────────────────────────────────────────────
+def _rate(nbytes, seconds):
+    return nbytes / (1024 * 1024) / seconds if seconds > 0 else 0.0
+
+def format_result(r):
+    if "error" in r:
+        return f"  ✖ {r['name']}: {r['error']}"
+    crypto, transfer = r.get("crypto_s", 0.0), r.get("transfer_s", 0.0)
+    name = r["name"]
+    if "members" in r:
+        name += f" ({len(r['members'])} files)"
+    line = (f"  ✔ {name}  {r.get('bytes', 0):,} B  "
+            f"crypto {crypto:.2f}s ({_rate(r.get('bytes', 0), crypto):.1f} MB/s)  "
+            f"transfer {transfer:.2f}s ({_rate(r.get('bytes', 0), transfer):.1f} MB/s)")
+    if r.get("codec"):
+        line += f"  {format_compression(r['bytes'], r['stored'], r['codec'])}"
+    for e in r.get("errors", ()):
+        line += f"\n  ✖ {e['name']}: {e['error']}"
+    return line
+
+def format_compression(nbytes, stored, codec):
+    ratio = nbytes / stored if stored else 0.0
+    return f"{codec} {ratio:.1f}x, saved {nbytes - stored:,} B"
+
+def summarize(results, elapsed):
+    ok = [r for r in results if "error" not in r]
+    total = sum(r.get("bytes", 0) for r in ok)
+    # a pack counts as its members, and its unreadable files as failures
+    files = sum(len(r["members"]) if "members" in r else 1 for r in ok)
+    failed = (len(results) - len(ok)
+              + sum(len(r.get("errors", ())) for r in ok))
+    lines = [
+        f"Files:      {files} ok, {failed} failed",
+        f"Bytes:      {total:,}",
+        f"Wall time:  {elapsed:.2f}s",
+        f"Throughput: {_rate(total, elapsed):.1f} MB/s, "
+        f"{files / elapsed if elapsed > 0 else 0.0:.1f} files/s",
+        f"Stage time: crypto {sum(r.get('crypto_s', 0.0) for r in ok):.2f}s, "
+        f"transfer {sum(r.get('transfer_s', 0.0) for r in ok):.2f}s",
+    ]
+    compressed = [r for r in ok if r.get("codec")]
+    if compressed:
+        nbytes = sum(r["bytes"] for r in compressed)
+        stored = sum(r["stored"] for r in compressed)
+        lines.append(f"Compressed: {len(compressed)} files, "
+                     f"{format_compression(nbytes, stored, 'overall')}")
+    return "\n".join(lines)
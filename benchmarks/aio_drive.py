@@ -0,0 +1,226 @@
+# aiohttp stand-in for the Drive v3 endpoints the async engine uses, with
+# a server-side rate limit that answers 429 / 403 rateLimitExceeded the
+# way Drive does. Runs its own event loop on a background thread, so
+# both the threaded and the async engine can be pointed at it.
+#   python -m benchmarks.aio_drive [port] [rate]
+import json
+import random
+import threading
+import time
+import uuid
+import asyncio
+
+from aiohttp import web
+from googleapiclient.discovery_cache import get_static_doc
+
+from benchmarks.fake_drive import list_files, parse_multipart
+
+_RATE_LIMITED = {"error": {"code": 403, "message": "Rate Limit Exceeded",
+                           "errors": [{"reason": "rateLimitExceeded"}]}}
+_TOO_MANY = {"error": {"code": 429, "message": "Too Many Requests"}}
+_BAD_RANGE = {"error": {"code": 416,
+                        "message": "Request range not satisfiable"}}
+
+class AioDrive:
+    def __init__(self, port=0, latency=0.0, rate=0.0, burst=None,
+                 retry_after=None, lost_rate=0.0, cut_downloads=0):
+        # latency:     added to every request
+        # rate:        requests/s the server accepts (0 = unlimited); the
+        #              excess gets a 429 or a 403 rateLimitExceeded
+        # retry_after: seconds sent in Retry-After on 429s (None = omit)
+        # lost_rate:   fraction of upload chunks that are stored but
+        #              answered with a 503, as if the response were lost
+        # cut_downloads: media downloads whose connection drops once the
+        #              last byte is out, before the response is complete
+        self.port = port
+        self.latency = latency
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.retry_after = retry_after
+        self.lost_rate = lost_rate
+        self.lost = 0
+        self.cut_downloads = cut_downloads
+        self.files = {}
+        self.sessions = {}
+        self.requests = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/"
+
+    # ── lifecycle ─────────────────────────────────────────────────────────
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(),
+                                         self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application(middlewares=[self._middleware],
+                              client_max_size=1024 ** 3)
+        app.router.add_get("/discovery/v1/apis/{api}/{version}/rest",
+                           self._discovery)
+        app.router.add_post("/upload/drive/v3/files", self._upload)
+        app.router.add_put("/upload/drive/v3/files", self._put)
+        app.router.add_get("/drive/v3/files", self._list)
+        app.router.add_get("/drive/v3/files/{id}", self._get)
+        app.router.add_delete("/drive/v3/files/{id}", self._delete)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    # ── plumbing ──────────────────────────────────────────────────────────
+    def _admit(self):
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if not request.path.startswith("/discovery/") and not self._admit():
+                self.throttled += 1
+                await request.read()
+                if random.random() < 0.5:
+                    return web.json_response(_RATE_LIMITED, status=403)
+                headers = ({"Retry-After": str(self.retry_after)}
+                           if self.retry_after is not None else None)
+                return web.json_response(_TOO_MANY, status=429, headers=headers)
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+
+    def _add(self, meta, data):
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = dict(meta, id=file_id, data=bytes(data))
+        return file_id
+
+    # ── handlers ──────────────────────────────────────────────────────────
+    async def _discovery(self, request):
+        doc = json.loads(get_static_doc("drive", "v3"))
+        doc["rootUrl"] = self.url
+        doc["baseUrl"] = self.url + doc["servicePath"]
+        return web.json_response(doc)
+
+    async def _upload(self, request):
+        kind = request.query.get("uploadType")
+        body = await request.read()
+        if kind == "multipart":
+            meta, data = parse_multipart(request.headers["Content-Type"], body)
+            return web.json_response({"id": self._add(meta, data)})
+        if kind == "resumable":
+            session = uuid.uuid4().hex
+            self.sessions[session] = {"meta": json.loads(body or b"{}"),
+                                      "data": bytearray()}
+            location = f"{self.url}upload/drive/v3/files?uploadType=resumable&upload_id={session}"
+            return web.Response(headers={"Location": location})
+        return web.json_response({"id": self._add({}, body)})
+
+    async def _put(self, request):
+        session = self.sessions.get(request.query.get("upload_id"))
+        body = await request.read()
+        if session is None:
+            return web.json_response({"error": {"code": 404}}, status=404)
+        data = session["data"]
+        span, _, total = request.headers.get("Content-Range", "").partition("/")
+        if span.startswith("bytes ") and span != "bytes *":
+            start = int(span[6:].split("-")[0])
+            if start != len(data):
+                return web.json_response({"error": {"code": 400}}, status=400)
+            data.extend(body)
+            if body and self.lost_rate and random.random() < self.lost_rate:
+                self.lost += 1
+                return web.json_response({"error": {"code": 503}}, status=503)
+        if total != "*" and len(data) >= int(total):
+            self.sessions.pop(request.query["upload_id"])
+            return web.json_response({"id": self._add(session["meta"], data)})
+        headers = {"Range": f"bytes=0-{len(data) - 1}"} if data else {}
+        return web.Response(status=308, headers=headers)
+
+    async def _list(self, request):
+        return web.json_response(list_files(self.files, request.query.get("q")))
+
+    async def _get(self, request):
+        entry = self.files.get(request.match_info["id"])
+        if entry is None:
+            return web.json_response({"error": {"code": 404}}, status=404)
+        if request.query.get("alt") != "media":
+            meta = {k: v for k, v in entry.items() if k != "data"}
+            meta["size"] = str(len(entry["data"]))
+            return web.json_response(meta)
+        data = entry["data"]
+        rng = request.headers.get("Range")
+        if not rng and self.cut_downloads:
+            self.cut_downloads -= 1
+            resp = web.StreamResponse(headers={
+                "Content-Type": "application/octet-stream"})
+            resp.content_length = len(data) + 1
+            await resp.prepare(request)
+            await resp.write(data)
+            request.transport.close()
+            return resp
+        if not rng:
+            return web.Response(body=data, content_type="application/octet-stream")
+        start, _, end = rng.split("=", 1)[1].partition("-")
+        start = int(start)
+        end = min(int(end) if end else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            return web.json_response(_BAD_RANGE, status=416, headers={
+                "Content-Range": f"bytes */{len(data)}"})
+        return web.Response(status=206, body=data[start:end + 1],
+                            content_type="application/octet-stream",
+                            headers={"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+    async def _delete(self, request):
+        if self.files.pop(request.match_info["id"], None) is None:
+            return web.json_response({"error": {"code": 404}}, status=404)
+        return web.Response(status=204)
+
+if __name__ == "__main__":
+    import sys
+    stub = AioDrive(int(sys.argv[1]) if len(sys.argv) > 1 else 8766,
+                    rate=float(sys.argv[2]) if len(sys.argv) > 2 else 0.0).start()
+    print(f"aiohttp Drive stub listening on {stub.url}")
+    try:
+        stub._thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
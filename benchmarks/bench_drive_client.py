@@ -0,0 +1,42 @@
+# Per-operation latency of a fresh Drive service per call (what
+# upload_file/download_file used to do) vs. one shared DriveClient.
+#   python -m benchmarks.bench_drive_client [ops] [connect_delay_ms]
+import os
+import sys
+import tempfile
+import time
+
+from google.auth.credentials import AnonymousCredentials
+
+from drive_manager import DriveClient
+from benchmarks.fake_drive import FakeDrive
+
+def _round_trips(make_client, ops, src, dst):
+    start = time.perf_counter()
+    for _ in range(ops):
+        client = make_client()
+        file_id = client.upload_file(src, "bench.cvault")
+        client.download_file(file_id, dst)
+    return (time.perf_counter() - start) / ops
+
+def run(ops=50, connect_delay_ms=20):
+    with FakeDrive(connect_delay=connect_delay_ms / 1000) as fake, \
+            tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src.bin")
+        dst = os.path.join(tmp, "dst.bin")
+        with open(src, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+
+        def fresh():
+            return DriveClient(AnonymousCredentials(), fake.url)
+
+        shared = fresh()
+        print(f"{'mode':>10} {'ms/op':>8} {'connections':>12}")
+        for name, factory in (("per-call", fresh), ("shared", lambda: shared)):
+            before = fake.connections
+            per_op = _round_trips(factory, ops, src, dst)
+            print(f"{name:>10} {per_op * 1000:>8.1f} {fake.connections - before:>12}")
+        shared.close()
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:]])
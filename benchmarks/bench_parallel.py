@@ -0,0 +1,45 @@
+# Scaling curve for the parallel segment engine.
+#   python -m benchmarks.bench_parallel [size_mb] [max_workers]
+import os
+import sys
+import tempfile
+import time
+
+import crypto_engine
+from crypto_engine import encrypt_file, decrypt_file
+
+def run(size_mb=256, max_workers=None):
+    max_workers = max_workers or os.cpu_count() or 1
+    # the KDF is a fixed cost per file and would hide the AES scaling
+    crypto_engine.ITERATIONS = 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "plain.bin")
+        enc = os.path.join(tmp, "plain.cvault")
+        dec = os.path.join(tmp, "plain.out")
+        with open(src, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        print(f"{'workers':>8} {'encrypt MB/s':>14} {'decrypt MB/s':>14} {'speedup':>8}")
+        base = None
+        workers = 1
+        while True:
+            t0 = time.perf_counter()
+            encrypt_file(src, enc, "bench", workers=workers)
+            t1 = time.perf_counter()
+            decrypt_file(enc, dec, "bench", workers=workers)
+            t2 = time.perf_counter()
+
+            enc_rate = size_mb / (t1 - t0)
+            dec_rate = size_mb / (t2 - t1)
+            base = base or enc_rate
+            print(f"{workers:>8} {enc_rate:>14.1f} {dec_rate:>14.1f} {enc_rate / base:>7.2f}x")
+
+            if workers >= max_workers:
+                break
+            workers = min(workers * 2, max_workers)
+
+if __name__ == "__main__":
+    argv = [int(a) for a in sys.argv[1:]]
+    run(*argv)
@@ -0,0 +1,51 @@
+# Single-stream vs. parallel ranged download + decrypt against the fake
+# Drive server, with a per-connection bandwidth cap standing in for a
+# long fat network link.
+#   python -m benchmarks.bench_ranged_download [size_mb] [mb_per_s_per_conn] [max_connections]
+import os
+import sys
+import tempfile
+import time
+
+from google.auth.credentials import AnonymousCredentials
+
+import crypto_engine
+from crypto_engine import encrypt_file
+from drive_manager import DriveClient
+from transfer import download_decrypt, parallel_download_decrypt
+from upload_engine import UploadJournal
+from benchmarks.fake_drive import FakeDrive
+
+def run(size_mb=64, mb_per_s=16, max_connections=8):
+    crypto_engine.ITERATIONS = 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "plain.bin")
+        enc = os.path.join(tmp, "plain.cvault")
+        dst = os.path.join(tmp, "restored.bin")
+        with open(src, "wb") as f:
+            f.write(os.urandom(size_mb * 1024 * 1024))
+        encrypt_file(src, enc, "bench")
+
+        with FakeDrive() as fake:
+            client = DriveClient(AnonymousCredentials(), fake.url,
+                                 journal=UploadJournal(os.path.join(tmp, "j.json")))
+            file_id = client.upload_file(enc)
+            fake.bandwidth = mb_per_s * 1024 * 1024
+
+            print(f"{'connections':>12} {'seconds':>8} {'MB/s':>8}")
+            t0 = time.perf_counter()
+            download_decrypt(file_id, dst, "bench", client=client)
+            elapsed = time.perf_counter() - t0
+            print(f"{'stream':>12} {elapsed:>8.2f} {size_mb / elapsed:>8.1f}")
+
+            n = 1
+            while n <= max_connections:
+                t0 = time.perf_counter()
+                parallel_download_decrypt(file_id, dst, "bench",
+                                          connections=n, client=client)
+                elapsed = time.perf_counter() - t0
+                print(f"{n:>12} {elapsed:>8.2f} {size_mb / elapsed:>8.1f}")
+                n *= 2
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:]])
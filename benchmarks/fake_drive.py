@@ -0,0 +1,344 @@
+# In-memory stand-in for the parts of the Drive v3 REST API CipherVault
+# uses, so transfers can be measured locally without a Google account.
+#   python -m benchmarks.fake_drive [port]
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from googleapiclient.discovery_cache import get_static_doc
+
+_MEDIA_PATH = re.compile(r"^/drive/v3/files/([^/]+)$")
+_LIST_PATH = "/drive/v3/files"
+_PROPERTY_QUERY = re.compile(r"appProperties has \{ key='([^']*)' and value='([^']*)' \}")
+_BATCH_PATH = "/batch/drive/v3"
+
+class FakeDrive:
+    def __init__(self, port=0, latency=0.0, connect_delay=0.0, error_rate=0.0,
+                 bandwidth=0, timeout_rate=0.0, stall=1.0):
+        # latency: added to every request
+        # connect_delay: added once per new TCP connection, standing in for
+        #                the TLS handshake a real client pays
+        # error_rate: fraction of media reads/writes answered with a 503
+        # bandwidth: per-connection rate cap in bytes/s, applied to request
+        #            and response bodies alike (0 = none)
+        # timeout_rate: fraction of upload chunks that are stored but never
+        #               answered: the server stalls for `stall` seconds and
+        #               drops the connection, like a response lost in transit
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.connect_delay = connect_delay
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.stall = stall
+        self.errors = 0
+        self.timeouts = 0
+        self.received = 0   # upload body bytes taken in
+        self.files = {}
+        self.sessions = {}
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(self))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add(self, name, data, **meta):
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = dict(meta, id=file_id, name=name, data=data)
+        return file_id
+
+    def inject_error(self):
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return True
+        return False
+
+    def inject_timeout(self):
+        if self.timeout_rate and random.random() < self.timeout_rate:
+            with self.lock:
+                self.timeouts += 1
+            return True
+        return False
+
+    def discovery_doc(self):
+        doc = json.loads(get_static_doc("drive", "v3"))
+        doc["rootUrl"] = self.url
+        doc["baseUrl"] = self.url + doc["servicePath"]
+        return json.dumps(doc).encode()
+
+def list_files(files, q):
+    # files.list: only the "appProperties has { key=... and value=... }"
+    # clauses of `q` are understood
+    wanted = _PROPERTY_QUERY.findall(q or "")
+    return {"files": [
+        {"id": e["id"], "name": e.get("name"),
+         "appProperties": e.get("appProperties") or {}}
+        for e in list(files.values())
+        if all((e.get("appProperties") or {}).get(k) == v for k, v in wanted)]}
+
+def _metadata(entry):
+    meta = {k: v for k, v in entry.items() if k != "data"}
+    meta["size"] = str(len(entry["data"]))
+    return meta
+
+def parse_multipart(content_type, body):
+    # (metadata, media) of a multipart/related upload. Split by hand: the
+    # email parser drops a trailing CR from binary parts. The Python
+    # client writes bare LF line endings, RFC 2046 asks for CRLF; the
+    # line break before a delimiter belongs to the delimiter.
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    parts = re.split(rb"\r?\n--" + re.escape(boundary), b"\n" + body)[1:3]
+    meta, data = (re.split(rb"\r?\n\r?\n", p, 1)[1] for p in parts)
+    return json.loads(meta), data
+
+def _update(drive, file_id, changes):
+    # metadata PATCH; nested dicts (appProperties) are merged
+    entry = drive.files.get(file_id)
+    if entry is None:
+        return None
+    with drive.lock:
+        for key, value in changes.items():
+            if isinstance(value, dict) and isinstance(entry.get(key), dict):
+                entry[key].update(value)
+            else:
+                entry[key] = value
+    return entry
+
+def _batch(drive, content_type, body):
+    # multipart/mixed of embedded HTTP requests, answered in kind; only
+    # metadata reads and updates are supported inside a batch
+    boundary = content_type.split("boundary=", 1)[1].strip('"')
+    text = body.decode().replace("\r\n", "\n")
+    out = []
+    for part in text.split("--" + boundary)[1:]:
+        if part.startswith("--"):
+            break
+        head, _, inner = part.strip("\n").partition("\n\n")
+        head = re.sub(r"\n[ \t]+", " ", head)     # unfold long headers
+        content_id = next((line.split(":", 1)[1].strip()
+                           for line in head.split("\n")
+                           if line.lower().startswith("content-id:")), "<x>")
+        request_line, _, rest = inner.partition("\n")
+        method, target = request_line.split(" ")[:2]
+        payload = rest.partition("\n\n")[2].strip()
+        m = _MEDIA_PATH.match(urlparse(target).path)
+        entry = None
+        if m and method == "PATCH":
+            entry = _update(drive, m.group(1), json.loads(payload or "{}"))
+        elif m and method == "GET":
+            entry = drive.files.get(m.group(1))
+        status, result = ((200, _metadata(entry)) if entry is not None else
+                          (404, {"error": {"code": 404, "message": "File not found"}}))
+        out.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                   f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                   f"HTTP/1.1 {status} {'OK' if status == 200 else 'Not Found'}\r\n"
+                   f"Content-Type: application/json\r\n\r\n"
+                   f"{json.dumps(result)}\r\n")
+    out.append(f"--{boundary}--\r\n")
+    return "".join(out).encode(), f"multipart/mixed; boundary={boundary}"
+
+def _make_handler(drive):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # headers and body go out in separate writes; without this,
+            # Nagle + delayed ACK adds ~40 ms to every keep-alive request
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with drive.lock:
+                drive.connections += 1
+            if drive.connect_delay:
+                time.sleep(drive.connect_delay)
+
+        def log_message(self, *args):
+            pass
+
+        # ── plumbing ──────────────────────────────────────────────────────
+        def _begin(self):
+            with drive.lock:
+                drive.requests += 1
+            if drive.latency:
+                time.sleep(drive.latency)
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self._read(length) if length else b""
+            return url.path, {k: v[0] for k, v in parse_qs(url.query).items()}, body
+
+        def _read(self, length):
+            if not drive.bandwidth:
+                return self.rfile.read(length)
+            step = max(1, drive.bandwidth // 50)
+            parts = []
+            while length > 0:
+                part = self.rfile.read(min(step, length))
+                if not part:
+                    break
+                parts.append(part)
+                length -= len(part)
+                time.sleep(len(part) / drive.bandwidth)
+            return b"".join(parts)
+
+        def _send(self, status, body=b"", headers=None, content_type="application/json"):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if not drive.bandwidth:
+                self.wfile.write(body)
+                return
+            step = max(1, drive.bandwidth // 50)
+            for pos in range(0, len(body), step):
+                self.wfile.write(body[pos:pos + step])
+                time.sleep(len(body[pos:pos + step]) / drive.bandwidth)
+
+        def _unavailable(self):
+            self._send(503, {"error": {"code": 503, "message": "Backend Error"}})
+
+        def _not_found(self):
+            self._send(404, {"error": {"code": 404, "message": "File not found"}})
+
+        # ── verbs ─────────────────────────────────────────────────────────
+        def do_GET(self):
+            path, query, _ = self._begin()
+            if path.startswith("/discovery/"):
+                return self._send(200, drive.discovery_doc())
+            if path == _LIST_PATH:
+                return self._send(200, list_files(drive.files, query.get("q")))
+            m = _MEDIA_PATH.match(path)
+            entry = drive.files.get(m.group(1)) if m else None
+            if entry is None:
+                return self._not_found()
+            if query.get("alt") != "media":
+                return self._send(200, _metadata(entry))
+            if drive.inject_error():
+                return self._unavailable()
+
+            data = entry["data"]
+            rng = self.headers.get("Range")
+            if not rng:
+                return self._send(200, data, content_type="application/octet-stream")
+            start, _, end = rng.split("=", 1)[1].partition("-")
+            start = int(start)
+            end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                return self._send(416, headers={"Content-Range": f"bytes */{len(data)}"})
+            self._send(206, data[start:end + 1],
+                       headers={"Content-Range": f"bytes {start}-{end}/{len(data)}"},
+                       content_type="application/octet-stream")
+
+        def do_POST(self):
+            path, query, body = self._begin()
+            if path == _BATCH_PATH:
+                data, content_type = _batch(drive, self.headers["Content-Type"], body)
+                return self._send(200, data, content_type=content_type)
+            kind = query.get("uploadType")
+            if path == "/drive/v3/files" or kind == "media":
+                meta = json.loads(body or b"{}") if kind != "media" else {}
+                data = body if kind == "media" else b""
+                file_id = drive.add(meta.pop("name", "untitled"), data, **meta)
+                return self._send(200, {"id": file_id})
+            if kind == "multipart":
+                meta, data = parse_multipart(self.headers["Content-Type"], body)
+                file_id = drive.add(meta.pop("name", "untitled"), data, **meta)
+                return self._send(200, {"id": file_id})
+            if kind == "resumable":
+                session = uuid.uuid4().hex
+                with drive.lock:
+                    drive.sessions[session] = {"meta": json.loads(body or b"{}"),
+                                               "data": bytearray()}
+                location = f"{drive.url}upload/drive/v3/files?uploadType=resumable&upload_id={session}"
+                return self._send(200, headers={"Location": location})
+            self._not_found()
+
+        def do_PUT(self):
+            path, query, body = self._begin()
+            session = drive.sessions.get(query.get("upload_id"))
+            if session is None:
+                return self._not_found()
+            if body and drive.inject_error():
+                return self._unavailable()
+            with drive.lock:
+                drive.received += len(body)
+            data = session["data"]
+            crange = self.headers.get("Content-Range", "")
+            m = re.match(r"bytes (\*|(\d+)-(\d+))/(\*|\d+)", crange)
+            if m and m.group(2) is not None:
+                start = int(m.group(2))
+                if start != len(data):
+                    return self._send(400, {"error": {"code": 400, "message": "bad offset"}})
+                data.extend(body)
+            elif not m:
+                data.extend(body)
+            if body and drive.inject_timeout():
+                time.sleep(drive.stall)
+                self.close_connection = True
+                return
+            total = m.group(4) if m else str(len(data))
+            if total != "*" and len(data) >= int(total):
+                meta = dict(session["meta"])
+                file_id = drive.add(meta.pop("name", "untitled"), bytes(data), **meta)
+                drive.sessions.pop(query["upload_id"], None)
+                return self._send(200, {"id": file_id})
+            headers = {"Range": f"bytes=0-{len(data) - 1}"} if data else {}
+            self._send(308, headers=headers)
+
+        def do_PATCH(self):
+            path, _, body = self._begin()
+            m = _MEDIA_PATH.match(path)
+            entry = _update(drive, m.group(1), json.loads(body or b"{}")) if m else None
+            if entry is None:
+                return self._not_found()
+            self._send(200, _metadata(entry))
+
+        def do_DELETE(self):
+            path, _, _ = self._begin()
+            m = _MEDIA_PATH.match(path)
+            with drive.lock:
+                entry = drive.files.pop(m.group(1), None) if m else None
+            if entry is None:
+                return self._not_found()
+            self._send(204)
+
+    return Handler
+
+if __name__ == "__main__":
+    import sys
+    fake = FakeDrive(int(sys.argv[1]) if len(sys.argv) > 1 else 8765).start()
+    print(f"fake Drive listening on {fake.url}")
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,28 @@
+# Benchmarks encrypt in vault mode, which creates a keyring, salt and KDF
+# file. vault_sandbox() points all three at a temporary directory and
+# works from there, so a run never reads the user's vault or leaves
+# one sealed under the benchmark password behind.
+import os
+import tempfile
+from contextlib import contextmanager
+
+import crypto_engine
+
+_VAULT_FILES = {"VAULT_KEY_FILE": "vault_key.json",
+                "VAULT_SALT_FILE": "vault_salt.bin",
+                "VAULT_KDF_FILE": "vault_kdf.json"}
+
+@contextmanager
+def vault_sandbox():
+    saved = {name: getattr(crypto_engine, name) for name in _VAULT_FILES}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="cvault-bench-") as tmp:
+        for name, filename in _VAULT_FILES.items():
+            setattr(crypto_engine, name, os.path.join(tmp, filename))
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+            for name, value in saved.items():
+                setattr(crypto_engine, name, value)
@@ -0,0 +1,371 @@
+# Reproducible benchmark suite: KDF cost, vault unlock, encrypt/decrypt
+# throughput from 1 KB to several GB, small-file batches and end-to-end
+# transfers against the fake Drive server. Every case runs in a fresh
+# interpreter, inside a throwaway vault directory, so its peak RSS is its
+# own and no keyring is left behind. Results are written as JSON that a
+# later run can be compared against.
+#   python -m benchmarks.suite [--profile quick|full] [--out results.json]
+#                              [--compare baseline.json] [--tolerance 0.10]
+#                              [--latency-ms 20] [--bandwidth-mb 50]
+#   python -m benchmarks.suite --compare baseline.json --current results.json
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MB = 1024 * 1024
+SEED = 1234
+
+PROFILES = {
+    "quick": {
+        "kdf": [10_000, 100_000, 200_000],
+        "vault": 3,
+        "sizes": [1024, 64 * 1024, MB, 16 * MB, 64 * MB],
+        "small_files": (200, 4096),
+        "e2e_sizes": [16 * MB],
+        "batch": (50, 64 * 1024),
+        "repeat": 3,
+    },
+    "full": {
+        "kdf": [10_000, 100_000, 200_000, 600_000],
+        "vault": 5,
+        "sizes": [1024, 64 * 1024, MB, 16 * MB, 256 * MB, 1024 * MB, 4096 * MB],
+        "small_files": (2000, 4096),
+        "e2e_sizes": [16 * MB, 256 * MB],
+        "batch": (200, 64 * 1024),
+        "repeat": 5,
+    },
+}
+
+# ── helpers (run inside the case process) ─────────────────────────────────────
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+def _write_random(path, size, seed=SEED):
+    rng = random.Random(seed)
+    with open(path, "wb") as f:
+        left = size
+        while left:
+            block = rng.randbytes(min(MB, left))
+            f.write(block)
+            left -= len(block)
+
+def _timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+def _label(size):
+    for unit, scale in (("GB", 1024 * MB), ("MB", MB), ("KB", 1024)):
+        if size >= scale and size % scale == 0:
+            return f"{size // scale}{unit}"
+    return f"{size}B"
+
+def _result(name, metric, value, higher_is_better, **params):
+    return {"name": name, "metric": metric, "value": value,
+            "higher_is_better": higher_is_better, "params": params}
+
+def _unlocked(key_cache):
+    # throughput cases run at the production KDF cost; the session
+    # unlock happens before the clock starts (see case_vault for its
+    # cost), so anything still in the numbers is paid per file
+    key_cache.vault_keys("bench")
+    return key_cache
+
+def _fake_client(tmp, latency, bandwidth):
+    from google.auth.credentials import AnonymousCredentials
+    from drive_manager import DriveClient
+    from upload_engine import UploadJournal
+    from benchmarks.fake_drive import FakeDrive
+    fake = FakeDrive(latency=latency, bandwidth=bandwidth).start()
+    client = DriveClient(AnonymousCredentials(), fake.url,
+                         journal=UploadJournal(os.path.join(tmp, "journal.json")))
+    return fake, client
+
+# ── cases ─────────────────────────────────────────────────────────────────────
+def case_kdf(iterations, repeat):
+    import crypto_engine
+    crypto_engine.ITERATIONS = iterations
+    salt = bytes(crypto_engine.SALT_SIZE)
+    seconds = _timed(lambda: crypto_engine.derive_key("bench", salt), repeat)
+    return [_result(f"kdf/{iterations}", "seconds", seconds, False,
+                    iterations=iterations)]
+
+def case_vault(repeat):
+    # what a session pays once: creating the keyring on first use, and
+    # unlocking it with a cold key cache, at the vault's KDF parameters
+    import crypto_engine
+    from crypto_engine import KeyCache
+
+    def create():
+        os.remove(crypto_engine.VAULT_KEY_FILE)
+        KeyCache().vault_keys("bench")
+
+    KeyCache().vault_keys("bench")
+    create_s = _timed(create, repeat)
+    unlock_s = _timed(lambda: KeyCache().vault_keys("bench"), repeat)
+    params = crypto_engine.load_kdf_params()
+    return [_result("vault/create", "seconds", create_s, False, **params),
+            _result("vault/unlock", "seconds", unlock_s, False, **params)]
+
+def case_crypto(size, repeat, workers):
+    from crypto_engine import encrypt_file, decrypt_file, KeyCache
+    key_cache = _unlocked(KeyCache())
+    with tempfile.TemporaryDirectory() as tmp:
+        src, enc, dec = (os.path.join(tmp, n) for n in ("plain", "enc", "dec"))
+        _write_random(src, size)
+        enc_s = _timed(lambda: encrypt_file(src, enc, "bench", workers=workers,
+                                            key_cache=key_cache), repeat)
+        dec_s = _timed(lambda: decrypt_file(enc, dec, "bench", workers=workers,
+                                            key_cache=key_cache), repeat)
+    return [_result(f"encrypt/{_label(size)}", "mb_per_s", size / MB / enc_s,
+                    True, size=size, workers=workers),
+            _result(f"decrypt/{_label(size)}", "mb_per_s", size / MB / dec_s,
+                    True, size=size, workers=workers)]
+
+def case_small_files(count, size, repeat):
+    from crypto_engine import encrypt_file, decrypt_file, KeyCache
+    key_cache = _unlocked(KeyCache())
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"f{i}") for i in range(count)]
+        for i, path in enumerate(paths):
+            _write_random(path, size, SEED + i)
+
+        def encrypt_all():
+            for path in paths:
+                encrypt_file(path, path + ".enc", "bench", key_cache=key_cache)
+
+        def decrypt_all():
+            for path in paths:
+                decrypt_file(path + ".enc", path + ".dec", "bench",
+                             key_cache=key_cache)
+
+        enc_s = _timed(encrypt_all, repeat)
+        dec_s = _timed(decrypt_all, repeat)
+    label = f"{count}x{_label(size)}"
+    return [_result(f"small_encrypt/{label}", "files_per_s", count / enc_s,
+                    True, count=count, size=size),
+            _result(f"small_decrypt/{label}", "files_per_s", count / dec_s,
+                    True, count=count, size=size)]
+
+def case_e2e(size, repeat, latency, bandwidth):
+    from crypto_engine import encrypt_file, KeyCache
+    from transfer import download_decrypt
+    key_cache = _unlocked(KeyCache())
+    with tempfile.TemporaryDirectory() as tmp:
+        src, enc, dst = (os.path.join(tmp, n) for n in ("plain", "enc", "out"))
+        _write_random(src, size)
+        fake, client = _fake_client(tmp, latency, bandwidth)
+        file_ids = []
+        try:
+            def upload():
+                encrypt_file(src, enc, "bench", key_cache=key_cache)
+                file_ids.append(client.upload_file(enc))
+
+            up_s = _timed(upload, repeat)
+            down_s = _timed(lambda: download_decrypt(file_ids[-1], dst, "bench",
+                                                     client=client,
+                                                     key_cache=key_cache),
+                            repeat)
+        finally:
+            client.close()
+            fake.stop()
+    params = dict(size=size, latency=latency, bandwidth=bandwidth)
+    return [_result(f"e2e_upload/{_label(size)}", "mb_per_s", size / MB / up_s,
+                    True, **params),
+            _result(f"e2e_download/{_label(size)}", "mb_per_s",
+                    size / MB / down_s, True, **params)]
+
+def case_batch(count, size, repeat, latency, bandwidth):
+    import batch
+    from catalog import Catalog
+    from crypto_engine import KeyCache
+    key_cache = _unlocked(KeyCache())
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src")
+        os.mkdir(src)
+        for i in range(count):
+            _write_random(os.path.join(src, f"f{i}"), size, SEED + i)
+        fake, client = _fake_client(tmp, latency, bandwidth)
+        catalog = Catalog(os.path.join(tmp, "vault.db"))
+        try:
+            def run():
+                results = batch.encrypt_upload_many(
+                    batch.collect_files(src), "bench", key_cache=key_cache,
+                    client=client, catalog=catalog)
+                failed = [r for r in results if "error" in r]
+                if failed:
+                    raise RuntimeError(failed[0]["error"])
+
+            seconds = _timed(run, repeat)
+        finally:
+            catalog.close()
+            client.close()
+            fake.stop()
+    return [_result(f"batch_upload/{count}x{_label(size)}", "files_per_s",
+                    count / seconds, True, count=count, size=size,
+                    latency=latency, bandwidth=bandwidth)]
+
+CASES = {
+    "kdf": case_kdf,
+    "vault": case_vault,
+    "crypto": case_crypto,
+    "small_files": case_small_files,
+    "e2e": case_e2e,
+    "batch": case_batch,
+}
+
+def run_case(spec):
+    # entry point inside the child process; every case gets a vault of
+    # its own in a temporary directory
+    from benchmarks.sandbox import vault_sandbox
+    base_rss = _peak_rss_mb()
+    with vault_sandbox():
+        results = CASES[spec["case"]](**spec["args"])
+    peak = _peak_rss_mb()
+    for r in results:
+        r["peak_rss_mb"] = round(peak, 1)
+        r["base_rss_mb"] = round(base_rss, 1)
+    return results
+
+# ── driver ────────────────────────────────────────────────────────────────────
+def plan(profile, latency, bandwidth, workers):
+    p = PROFILES[profile]
+    repeat = p["repeat"]
+    specs = [{"case": "kdf", "args": {"iterations": n, "repeat": repeat}}
+             for n in p["kdf"]]
+    specs.append({"case": "vault", "args": {"repeat": p["vault"]}})
+    for size in p["sizes"]:
+        # big files get fewer repeats; they're long enough to be stable
+        reps = repeat if size <= 64 * MB else 1
+        specs.append({"case": "crypto", "args": {"size": size, "repeat": reps,
+                                                 "workers": workers}})
+    count, size = p["small_files"]
+    specs.append({"case": "small_files",
+                  "args": {"count": count, "size": size, "repeat": repeat}})
+    for size in p["e2e_sizes"]:
+        specs.append({"case": "e2e", "args": {
+            "size": size, "repeat": repeat if size <= 64 * MB else 1,
+            "latency": latency, "bandwidth": bandwidth}})
+    count, size = p["batch"]
+    specs.append({"case": "batch", "args": {
+        "count": count, "size": size, "repeat": 1,
+        "latency": latency, "bandwidth": bandwidth}})
+    return specs
+
+def run_suite(profile="quick", latency=0.02, bandwidth=50 * MB, workers=None):
+    workers = workers or os.cpu_count() or 1
+    results = []
+    for spec in plan(profile, latency, bandwidth, workers):
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.suite", "--case", json.dumps(spec)],
+            capture_output=True, text=True)
+        if proc.returncode:
+            raise RuntimeError(f"{spec['case']} failed:\n{proc.stderr}")
+        for r in json.loads(proc.stdout.strip().splitlines()[-1]):
+            print(f"  {r['name']:<28} {r['value']:>12.3f} {r['metric']:<12}"
+                  f" peak {r['peak_rss_mb']:>8.1f} MB", flush=True)
+            results.append(r)
+    return {"meta": _meta(profile, latency, bandwidth, workers),
+            "results": results}
+
+def _meta(profile, latency, bandwidth, workers):
+    import cryptography
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                             capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    return {"profile": profile, "timestamp": time.time(), "git": rev,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "workers": workers,
+            "cryptography": cryptography.__version__, "seed": SEED,
+            "latency": latency, "bandwidth": bandwidth}
+
+def compare(baseline, current, tolerance=0.10, rss_tolerance=0.20):
+    # returns the list of regressions and prints a side-by-side table
+    base = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    print(f"{'benchmark':<28} {'baseline':>12} {'current':>12} {'change':>8}"
+          f" {'peak MB':>16}")
+    for r in current["results"]:
+        b = base.get(r["name"])
+        if b is None:
+            print(f"{r['name']:<28} {'-':>12} {r['value']:>12.3f}      new")
+            continue
+        change = (r["value"] - b["value"]) / b["value"] if b["value"] else 0.0
+        worse = -change if r["higher_is_better"] else change
+        rss_change = ((r["peak_rss_mb"] - b["peak_rss_mb"]) / b["peak_rss_mb"]
+                      if b.get("peak_rss_mb") else 0.0)
+        flags = []
+        if worse > tolerance:
+            flags.append("SLOWER")
+        if rss_change > rss_tolerance:
+            flags.append("MEMORY")
+        if flags:
+            regressions.append((r["name"], flags))
+        print(f"{r['name']:<28} {b['value']:>12.3f} {r['value']:>12.3f}"
+              f" {change:>+7.1%} {b.get('peak_rss_mb', 0):>7.1f}→{r['peak_rss_mb']:<7.1f}"
+              f" {' '.join(flags)}")
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    ap.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", metavar="BASELINE",
+                    help="compare against an earlier results file")
+    ap.add_argument("--current", help="compare this results file instead of running")
+    ap.add_argument("--tolerance", type=float, default=0.10,
+                    help="allowed throughput/latency regression (fraction)")
+    ap.add_argument("--rss-tolerance", type=float, default=0.20,
+                    help="allowed peak RSS growth (fraction)")
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--bandwidth-mb", type=float, default=50.0,
+                    help="fake Drive per-connection MB/s, 0 for unlimited")
+    ap.add_argument("--workers", type=int)
+    ap.add_argument("--case", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        print(f"Running {args.profile} profile…")
+        current = run_suite(args.profile, args.latency_ms / 1000,
+                            int(args.bandwidth_mb * MB), args.workers)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(current, f, indent=2)
+            print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(baseline, current, args.tolerance,
+                              args.rss_tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
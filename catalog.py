@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from crypto_engine import MAGIC_V2
+
+# Local record of everything this vault has put on Drive. SQLite in WAL
+# mode lets the GUI and CLI write at the same time, each upload is one
+# INSERT instead of a rewrite of the whole index, and lookups by name,
+# content hash or date go through indexes.
+CATALOG_FILE = "vault.db"
+LEGACY_INDEX = "vault_index.json"        # {filename: file_id}, before the catalog
+LEGACY_CHUNK_INDEX = "chunk_index.jsonl"
+SCHEMA_VERSION = 4
+CONTAINER_FORMAT = MAGIC_V2.decode()     # what encrypt_file writes
+PACK_FORMAT = "cvault-pack-1"            # a pack object of small files
+MEMBER_FORMAT = "cvault-pack-member"     # one file inside a pack
+BUSY_TIMEOUT = 10.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id        INTEGER PRIMARY KEY,
+    name      TEXT NOT NULL,
+    path      TEXT,
+    size      INTEGER,
+    mtime     REAL,
+    sha256    TEXT,
+    drive_id  TEXT NOT NULL UNIQUE,
+    format    TEXT,
+    created   REAL NOT NULL,
+    updated   REAL NOT NULL,
+    pack      TEXT,           -- pack members: the pack's drive_id
+    pack_offset INTEGER,      --   and where they sit in its plaintext
+    pack_length INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_name    ON files(name);
+CREATE INDEX IF NOT EXISTS files_sha256  ON files(sha256);
+CREATE INDEX IF NOT EXISTS files_created ON files(created);
+
+CREATE TABLE IF NOT EXISTS packs (
+    drive_id  TEXT PRIMARY KEY,
+    name      TEXT NOT NULL,
+    size      INTEGER,
+    members   INTEGER,
+    created   REAL NOT NULL
+) WITHOUT ROWID;
+
+-- what `sync` last uploaded from each local path; a file whose size,
+-- mtime and inode still match is not even read
+CREATE TABLE IF NOT EXISTS sync_state (
+    path      TEXT PRIMARY KEY,
+    size      INTEGER NOT NULL,
+    mtime_ns  INTEGER NOT NULL,
+    inode     INTEGER NOT NULL,
+    sha256    TEXT NOT NULL,
+    drive_id  TEXT NOT NULL,
+    synced    REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS chunks (
+    id        TEXT PRIMARY KEY,
+    drive_id  TEXT NOT NULL,
+    size      INTEGER
+) WITHOUT ROWID;
+"""
+
+# substring search over names; the trigram tokenizer needs SQLite 3.34+
+_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS files_search USING fts5(
+    name, content='files', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS files_search_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_search (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_search_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_search (files_search, rowid, name)
+    VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_search_au AFTER UPDATE OF name ON files BEGIN
+    INSERT INTO files_search (files_search, rowid, name)
+    VALUES ('delete', old.id, old.name);
+    INSERT INTO files_search (rowid, name) VALUES (new.id, new.name);
+END;
+"""
+_PACK_COLUMNS = (("pack", "TEXT"), ("pack_offset", "INTEGER"),
+                 ("pack_length", "INTEGER"))
+_ORDER = " ORDER BY files.created DESC, files.id DESC"
+
+def file_digest(path, bufsize=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(bufsize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class Catalog:
+    # one connection per Catalog, shared by the threads of a process
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                                   check_same_thread=False,
+                                   isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        try:
+            self._db.executescript(_SEARCH_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError:
+            self._fts = False     # search falls back to a LIKE scan
+        # a second process opening the catalog waits here instead of
+        # importing the legacy index again
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                self._migrate()
+            if version < 2 and self._fts:
+                self._db.execute("INSERT INTO files_search (files_search)"
+                                 " VALUES ('rebuild')")
+            if version < 3:
+                have = {r["name"] for r in
+                        self._db.execute("PRAGMA table_info(files)")}
+                for column, kind in _PACK_COLUMNS:
+                    if column not in have:
+                        self._db.execute(
+                            f"ALTER TABLE files ADD COLUMN {column} {kind}")
+                self._db.execute("CREATE INDEX IF NOT EXISTS files_pack"
+                                 " ON files(pack)")
+            if version < SCHEMA_VERSION:
+                self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ── one-time import of the JSON indexes ───────────────────────────────────
+    def _migrate(self):
+        base = os.path.dirname(os.path.abspath(self.path))
+        legacy = os.path.join(base, LEGACY_INDEX)
+        if os.path.exists(legacy):
+            with open(legacy) as f:
+                entries = json.load(f)
+            now = time.time()
+            self._db.executemany(
+                "INSERT OR IGNORE INTO files (name, drive_id, created, updated)"
+                " VALUES (?, ?, ?, ?)",
+                [(name, fid, now, now) for name, fid in entries.items()])
+            os.replace(legacy, legacy + ".migrated")
+
+        chunks = os.path.join(base, LEGACY_CHUNK_INDEX)
+        if os.path.exists(chunks):
+            with open(chunks) as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            self._db.executemany(
+                "INSERT OR IGNORE INTO chunks (id, drive_id, size) VALUES (?, ?, ?)",
+                [(r["id"], r["file_id"], r.get("size")) for r in rows])
+            os.replace(chunks, chunks + ".migrated")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, params)]
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    # ── files ─────────────────────────────────────────────────────────────────
+    def add(self, name, drive_id, path=None, size=None, mtime=None,
+            sha256=None, format=None):
+        now = time.time()
+        if path is not None:
+            path = os.path.abspath(path)
+        cur = self._write(
+            "INSERT INTO files (name, path, size, mtime, sha256, drive_id,"
+            " format, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(drive_id) DO UPDATE SET name=excluded.name,"
+            " path=excluded.path, size=excluded.size, mtime=excluded.mtime,"
+            " sha256=excluded.sha256, format=excluded.format,"
+            " updated=excluded.updated",
+            (name, path, size, mtime, sha256, drive_id, format, now, now))
+        return cur.lastrowid
+
+    def add_local(self, name, drive_id, path, sha256=None, format=None):
+        # records a file that was just uploaded from `path`
+        st = os.stat(path)
+        return self.add(name, drive_id, path=path, size=st.st_size,
+                        mtime=st.st_mtime, sha256=sha256 or file_digest(path),
+                        format=format)
+
+    def remove(self, drive_id):
+        return self._write("DELETE FROM files WHERE drive_id = ?",
+                           (drive_id,)).rowcount
+
+    def get(self, drive_id):
+        rows = self._query("SELECT * FROM files WHERE drive_id = ?", (drive_id,))
+        return rows[0] if rows else None
+
+    def by_name(self, name):
+        return self._query("SELECT * FROM files WHERE name = ?"
+                           " ORDER BY created DESC", (name,))
+
+    def by_hash(self, sha256):
+        return self._query("SELECT * FROM files WHERE sha256 = ?"
+                           " ORDER BY created DESC", (sha256,))
+
+    def between(self, since, until=None):
+        return self._query("SELECT * FROM files WHERE created >= ? AND created < ?"
+                           " ORDER BY created DESC",
+                           (since, until if until is not None else float("inf")))
+
+    def files(self, limit=-1, offset=0):
+        return self._query("SELECT * FROM files" + _ORDER + " LIMIT ? OFFSET ?",
+                           (limit, offset))
+
+    def rows(self, ids):
+        found = []
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            found += self._query("SELECT * FROM files WHERE id IN (%s)"
+                                 % ",".join("?" * len(batch)), batch)
+        return found
+
+    def search(self, text, limit=-1):
+        # case-insensitive substring match on names, newest first
+        text = text.strip()
+        if self._fts and len(text) >= 3:
+            return self._query(
+                "SELECT files.* FROM files_search"
+                " JOIN files ON files.id = files_search.rowid"
+                " WHERE files_search MATCH ?" + _ORDER + " LIMIT ?",
+                ('"%s"' % text.replace('"', '""'), limit))
+        # trigrams can't match fewer than three characters
+        pattern = "%" + (text.replace("\\", "\\\\").replace("%", "\\%")
+                         .replace("_", "\\_")) + "%"
+        return self._query("SELECT * FROM files WHERE name LIKE ? ESCAPE '\\'"
+                           + _ORDER + " LIMIT ?", (pattern, limit))
+
+    def versions(self):
+        # {row id: updated} for every file, for cheap change detection
+        with self._lock:
+            return dict(self._db.execute("SELECT id, updated FROM files"))
+
+    def data_version(self):
+        # changes whenever another connection commits to the catalog
+        with self._lock:
+            return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) AS n FROM files")[0]["n"]
+
+    # ── packs ─────────────────────────────────────────────────────────────────
+    def add_pack(self, drive_id, name, size, members):
+        # members: dicts with name, path, offset, length, sha256, mtime;
+        # each becomes a files row whose drive_id is "<pack id>#<n>"
+        now = time.time()
+        rows = [(m["name"], m.get("path") and os.path.abspath(m["path"]),
+                 m["length"], m.get("mtime"), m.get("sha256"),
+                 f"{drive_id}#{i}", MEMBER_FORMAT, now, now, drive_id,
+                 m["offset"], m["length"]) for i, m in enumerate(members)]
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute(
+                "INSERT OR REPLACE INTO packs (drive_id, name, size, members,"
+                " created) VALUES (?, ?, ?, ?, ?)",
+                (drive_id, name, size, len(members), now))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO files (name, path, size, mtime, sha256,"
+                " drive_id, format, created, updated, pack, pack_offset,"
+                " pack_length) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+
+    def pack(self, drive_id):
+        rows = self._query("SELECT * FROM packs WHERE drive_id = ?", (drive_id,))
+        return rows[0] if rows else None
+
+    def packs(self):
+        return self._query("SELECT * FROM packs ORDER BY created DESC")
+
+    def members(self, pack_id):
+        return self._query("SELECT * FROM files WHERE pack = ?"
+                           " ORDER BY pack_offset", (pack_id,))
+
+    # ── sync state ────────────────────────────────────────────────────────────
+    def sync_states(self, root):
+        # {absolute path: row} for everything synced from under root
+        root = os.path.join(os.path.abspath(root), "")
+        # [root, root + U+10FFFF) covers every path with that prefix
+        rows = self._query("SELECT * FROM sync_state WHERE path >= ?"
+                           " AND path < ?", (root, root + "\U0010ffff"))
+        return {r["path"]: r for r in rows}
+
+    def set_sync_states(self, rows):
+        # rows: dicts with path, size, mtime_ns, inode, sha256, drive_id
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO sync_state (path, size, mtime_ns,"
+                " inode, sha256, drive_id, synced) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(os.path.abspath(r["path"]), r["size"], r["mtime_ns"],
+                  r["inode"], r["sha256"], r["drive_id"], now) for r in rows])
+
+    def remove_sync_states(self, paths):
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany("DELETE FROM sync_state WHERE path = ?",
+                                 [(os.path.abspath(p),) for p in paths])
+
+    # ── dedup chunks ──────────────────────────────────────────────────────────
+    def chunk(self, chunk_id):
+        rows = self._query("SELECT drive_id FROM chunks WHERE id = ?", (chunk_id,))
+        return rows[0]["drive_id"] if rows else None
+
+    def add_chunk(self, chunk_id, drive_id, size):
+        self._write("INSERT OR REPLACE INTO chunks (id, drive_id, size)"
+                    " VALUES (?, ?, ?)", (chunk_id, drive_id, size))
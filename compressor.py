@@ -0,0 +1,228 @@
+import os
+import zlib
+import struct
+import time
+from metrics import count
+
+try:
+    import zstandard
+except ImportError:     # zlib only
+    zstandard = None
+
+# Optional compression ahead of encryption. The whole plaintext is
+# compressed as one stream and the compressed bytes are what gets cut
+# into segments, so the container layout is unchanged. The codec and
+# level go into the header and decryption inflates transparently.
+# Files are sampled first: JPEG, ZIP, video and the like are stored as
+# they are, since compressing them costs time and saves nothing.
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {"zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+MODES = ("auto", "zlib", "zstd", "none")
+LEVELS = {CODEC_ZLIB: (1, 6), CODEC_ZSTD: (1, 3)}   # (fast, default)
+READ_SIZE = 256 * 1024
+OUTPUT_SIZE = 256 * 1024    # largest piece of inflated data held at once
+SAMPLE_SIZE = 64 * 1024
+SAMPLES = 4             # spread over the file: start, middle, ..., end
+SKIP_RATIO = 0.9        # samples must shrink below this to be worth it
+GOOD_RATIO = 0.5        # below this, the default level pays for itself
+
+_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard else ())
+_STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi", ".mp3", ".m4a",
+    ".aac", ".ogg", ".opus", ".flac", ".zip", ".gz", ".tgz", ".bz2",
+    ".xz", ".zst", ".7z", ".rar", ".jar", ".apk", ".docx", ".xlsx",
+    ".pptx", ".odt", ".epub", ".cvault",
+}
+_STORED_MAGIC = (
+    b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"PK\x03\x04", b"\x1f\x8b",
+    b"BZh", b"\xfd7zXZ", b"(\xb5/\xfd", b"7z\xbc\xaf", b"Rar!", b"OggS",
+    b"fLaC", b"ID3", b"\x1aE\xdf\xa3", b"CVLT",
+)
+
+def default_codec():
+    return CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+def codec_name(codec):
+    return next((n for n, c in CODECS.items() if c == codec), str(codec))
+
+def pack_compression(codec, level):
+    return struct.pack(">BB", codec, level)
+
+def unpack_compression(raw):
+    if len(raw) != 2:
+        raise ValueError("Invalid file format.")
+    codec, level = struct.unpack(">BB", raw)
+    if codec == CODEC_ZSTD and zstandard is None:
+        raise ValueError("This file is zstd-compressed; install 'zstandard' "
+                         "to open it.")
+    if codec not in LEVELS:
+        raise ValueError(f"Unknown compression codec {codec}.")
+    return codec, level
+
+def _stored_format(path, head):
+    if os.path.splitext(path)[1].lower() in _STORED_EXTENSIONS:
+        return True
+    # MP4/MOV/HEIF: "ftyp" box right after the size
+    return head.startswith(_STORED_MAGIC) or head[4:8] == b"ftyp"
+
+def choose(path, mode="auto"):
+    # (codec, level) to compress `path` with, or None to store it as is.
+    # mode "auto" uses zstd when available; "zlib"/"zstd" pin the codec
+    # but already-compressed data is still skipped.
+    if mode in (None, "none"):
+        return None
+    if mode not in MODES:
+        raise ValueError(f"Unknown compression mode {mode!r}.")
+    codec = default_codec() if mode == "auto" else CODECS[mode]
+    if codec == CODEC_ZSTD and zstandard is None:
+        raise ValueError("zstd needs the 'zstandard' package.")
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(SAMPLE_SIZE)
+        if not head or _stored_format(path, head):
+            return None
+        raw = stored = 0
+        step = max(size - SAMPLE_SIZE, 0) // max(SAMPLES - 1, 1)
+        for i in range(SAMPLES):
+            f.seek(i * step)
+            sample = f.read(SAMPLE_SIZE)
+            raw += len(sample)
+            stored += len(zlib.compress(sample, 1))
+            if size <= SAMPLE_SIZE:
+                break
+    ratio = stored / raw
+    if ratio >= SKIP_RATIO:
+        return None
+    fast, default = LEVELS[codec]
+    return codec, default if ratio < GOOD_RATIO else fast
+
+class CompressingReader:
+    # file-like: read() returns the compressed form of `f`
+    def __init__(self, f, codec, level):
+        self._f = f
+        self._eof = False
+        self._buf = bytearray()
+        if codec == CODEC_ZSTD:
+            self._c = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            self._c = zlib.compressobj(level)
+        self.raw = 0
+        self.stored = 0
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buf) < size):
+            chunk = self._f.read(READ_SIZE)
+            start = time.perf_counter()
+            if chunk:
+                self.raw += len(chunk)
+                self._buf += self._c.compress(chunk)
+            else:
+                self._eof = True
+                self._buf += self._c.flush()
+            count("compress.seconds", time.perf_counter() - start)
+        if size < 0 or size >= len(self._buf):
+            out = bytes(self._buf)
+            self._buf.clear()
+        else:
+            out = bytes(self._buf[:size])
+            del self._buf[:size]
+        self.stored += len(out)
+        return out
+
+    def tell(self):
+        # input consumed so far, for progress reporting
+        return self._f.tell()
+
+class Decompressor:
+    # push-style inflater for decrypted segments. Output goes to write()
+    # in pieces of at most OUTPUT_SIZE, so a few KiB of input that inflate
+    # to gigabytes never sit in memory at once.
+    def __init__(self, codec, write):
+        self._write = write
+        self._zstd = None
+        if codec == CODEC_ZSTD:
+            self._zstd = zstandard.ZstdDecompressor().stream_writer(
+                _Sink(write), write_size=OUTPUT_SIZE, closefd=False)
+        else:
+            self._d = zlib.decompressobj()
+
+    def feed(self, data):
+        if not data:
+            return
+        try:
+            if self._zstd is not None:
+                self._zstd.write(data)
+            else:
+                for piece in _zlib_pieces(self._d, data):
+                    self._write(piece)
+        except _ERRORS as e:
+            raise ValueError(f"Corrupted compressed data: {e}")
+
+    def finish(self):
+        # a zlib stream that stops before its end marker was truncated;
+        # zstd's writer doesn't expose the frame end, but the container's
+        # final segment has already authenticated where the stream stops
+        if self._zstd is not None:
+            self._zstd.flush()
+        elif not self._d.eof:
+            raise ValueError("Corrupted or truncated file.")
+
+class _Sink:
+    def __init__(self, write):
+        self._write = write
+
+    def write(self, data):
+        self._write(bytes(data))
+        return len(data)
+
+class _BlockReader:
+    # file-like view of an iterable of blocks, for zstd's stream_reader
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._buf = b""
+
+    def read(self, size=-1):
+        while not self._buf:
+            self._buf = next(self._blocks, None)
+            if self._buf is None:
+                self._buf = b""
+                return b""
+        if size < 0 or size >= len(self._buf):
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+def _zlib_pieces(d, data):
+    # max_length caps each piece; what zlib didn't get to waits in
+    # unconsumed_tail, and a full piece may leave output pending
+    piece = d.decompress(data, OUTPUT_SIZE)
+    while True:
+        if piece:
+            yield piece
+        if not d.unconsumed_tail and len(piece) < OUTPUT_SIZE:
+            return
+        piece = d.decompress(d.unconsumed_tail, OUTPUT_SIZE)
+
+def inflate(blocks, codec):
+    # pull-style: decompresses an iterable of plaintext blocks, yielding
+    # pieces of at most OUTPUT_SIZE
+    try:
+        if codec == CODEC_ZSTD:
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                _BlockReader(blocks))
+            while True:
+                piece = reader.read(OUTPUT_SIZE)
+                if not piece:
+                    return
+                yield piece
+        d = zlib.decompressobj()
+        for block in blocks:
+            yield from _zlib_pieces(d, block)
+    except _ERRORS as e:
+        raise ValueError(f"Corrupted compressed data: {e}")
+    if not d.eof:
+        raise ValueError("Corrupted or truncated file.")
@@ -1,60 +1,938 @@
+import io
 import os
+import json
+import hmac
+import hashlib
+import struct
+import threading
+import time
+import shutil
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from metrics import timed, count
+from compressor import (CompressingReader, Decompressor, inflate, choose,
+                        pack_compression, unpack_compression, codec_name)
+
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:     # cryptography < 44
+    Argon2id = None
 
 SALT_SIZE = 16
 IV_SIZE = 12
 KEY_SIZE = 32
+TAG_SIZE = 16
 ITERATIONS = 200000
 MAGIC = b"CVLT1"
 
-def derive_key(password: str, salt: bytes) -> bytes:
-    kdf = PBKDF2HMAC(
+# CVLT2: chunked streaming container
+#   MAGIC_V2 | header length (u16) | header records
+#   record  = tag (u8) | length (u16) | value
+#   payload = segments of SEGMENT_SIZE plaintext, each sealed on its own
+# Segment i uses nonce = nonce prefix | i (u32) and associated data
+# i (u32) | final (u8), so segments can't be reordered, dropped or
+# truncated without the final segment failing to authenticate.
+MAGIC_V2 = b"CVLT2"
+SEGMENT_SIZE = 1024 * 1024
+NONCE_PREFIX_SIZE = IV_SIZE - 4
+MAX_SEGMENTS = 2 ** 32
+HEADER_PROBE = 4096     # first read of a ranged decrypt; covers any header
+
+# AES-GCM in `cryptography` releases the GIL, so a thread pool is enough
+# to spread segments over cores. Each worker may have this many segments
+# queued ahead of the writer before reading blocks (backpressure).
+INFLIGHT_PER_WORKER = 2
+
+HDR_SEGMENT_SIZE = 1
+HDR_SALT = 2
+HDR_NONCE_PREFIX = 3
+HDR_FILE_SALT = 4   # present => key = HKDF(master key, file salt)
+HDR_KDF = 5         # KDF parameters for HDR_SALT; absent => PBKDF2, ITERATIONS
+HDR_WRAPPED_KEY = 6 # random content key, sealed under the derived key
+HDR_KEK_ID = 7      # vault mode: HDR_WRAPPED_KEY is sealed under this KEK
+HDR_COMPRESSION = 8 # codec (u8) | level (u8); segments hold compressed data
+
+# Session master-key mode: PBKDF2 runs once per password per vault salt,
+# each file then gets a cheap HKDF subkey from its own salt.
+VAULT_SALT_FILE = "vault_salt.bin"
+FILE_KEY_INFO = b"CipherVault file key"
+KEY_CACHE_TTL = 15 * 60
+KEY_CACHE_SIZE = 8
+
+# KDF parameters travel in each file's header, so the cost can be raised
+# or the algorithm changed without touching what is already encrypted.
+# The vault's current choice (see calibrate_kdf) lives in VAULT_KDF_FILE.
+KDF_PBKDF2 = "pbkdf2-sha256"
+KDF_SCRYPT = "scrypt"
+KDF_ARGON2ID = "argon2id"
+VAULT_KDF_FILE = "vault_kdf.json"
+KEY_WRAP_AAD = b"CipherVault key wrap"
+CALIBRATE_TARGET = 1.0              # seconds per unlock
+CALIBRATE_MEMORY = 256 * 1024       # KiB ceiling for scrypt / Argon2id
+
+# Envelope keys: in vault mode each file's random content key is wrapped
+# by a vault key-encryption key (KEK) rather than a password-derived key.
+# The KEKs live in VAULT_KEY_FILE, each wrapped under the password, so a
+# password change rewrites that one file. Rotating to a new KEK re-wraps
+# a few bytes per object into a Drive sidecar and never the payloads.
+# Vault headers name a KEK but carry no salt, so the keyring is mirrored
+# off this machine too (see set_keyring_mirror): losing VAULT_KEY_FILE
+# must not lose the vault.
+VAULT_KEY_FILE = "vault_key.json"
+KEYRING_FORMAT = "cvault-keyring-1"
+KEK_ID_SIZE = 8
+DEDUP_ROOT = "dedup"    # keyring entry behind chunk ids and keys; not rotated
+_keyring_lock = threading.Lock()
+_keyring_mirror = None
+
+# header encoding: algorithm id (u8), then each field as u32
+_KDF_FIELDS = {
+    KDF_PBKDF2: (1, ("iterations",)),
+    KDF_SCRYPT: (2, ("n", "r", "p")),
+    KDF_ARGON2ID: (3, ("memory_kib", "iterations", "lanes")),
+}
+
+def default_kdf() -> dict:
+    return {"algorithm": KDF_PBKDF2, "iterations": ITERATIONS}
+
+def pack_kdf(params: dict) -> bytes:
+    if params["algorithm"] not in _KDF_FIELDS:
+        raise ValueError(f"Unknown KDF: {params['algorithm']}")
+    alg_id, fields = _KDF_FIELDS[params["algorithm"]]
+    return struct.pack(">B" + "I" * len(fields), alg_id,
+                       *(params[name] for name in fields))
+
+def unpack_kdf(raw: bytes) -> dict:
+    for algorithm, (alg_id, fields) in _KDF_FIELDS.items():
+        if raw[:1] == bytes([alg_id]) and len(raw) == 1 + 4 * len(fields):
+            values = struct.unpack(">" + "I" * len(fields), raw[1:])
+            return dict(zip(fields, values), algorithm=algorithm)
+    raise ValueError("Unsupported KDF in file header.")
+
+def _kdf(params: dict, salt: bytes):
+    algorithm = params["algorithm"]
+    if algorithm == KDF_PBKDF2:
+        return PBKDF2HMAC(algorithm=hashes.SHA256(), length=KEY_SIZE,
+                          salt=salt, iterations=params["iterations"])
+    if algorithm == KDF_SCRYPT:
+        return Scrypt(salt=salt, length=KEY_SIZE, n=params["n"],
+                      r=params["r"], p=params["p"])
+    if algorithm == KDF_ARGON2ID:
+        if Argon2id is None:
+            raise ValueError("Argon2id needs cryptography 44 or newer.")
+        return Argon2id(salt=salt, length=KEY_SIZE,
+                        iterations=params["iterations"],
+                        lanes=params["lanes"],
+                        memory_cost=params["memory_kib"])
+    raise ValueError(f"Unknown KDF: {algorithm}")
+
+def derive_key(password: str, salt: bytes, params: dict = None) -> bytes:
+    kdf = _kdf(params or default_kdf(), salt)
+    with timed("kdf"):
+        return kdf.derive(password.encode())
+
+def derive_subkey(master_key: bytes, info: bytes, salt: bytes = None) -> bytes:
+    hkdf = HKDF(
         algorithm=hashes.SHA256(),
         length=KEY_SIZE,
         salt=salt,
-        iterations=ITERATIONS,
+        info=info,
     )
-    return kdf.derive(password.encode())
+    return hkdf.derive(master_key)
 
-def encrypt_file(input_path: str, output_path: str, password: str):
-    if not os.path.exists(input_path):
-        raise FileNotFoundError("Input file does not exist.")
+def derive_file_key(master_key: bytes, file_salt: bytes) -> bytes:
+    return derive_subkey(master_key, FILE_KEY_INFO, file_salt)
 
-    with open(input_path, "rb") as f:
-        data = f.read()
+def load_vault_salt(path: str = None) -> bytes:
+    path = path or VAULT_SALT_FILE
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            salt = f.read()
+        if len(salt) == SALT_SIZE:
+            return salt
+        raise ValueError(f"Corrupted vault salt file: {path}")
 
     salt = os.urandom(SALT_SIZE)
-    iv = os.urandom(IV_SIZE)
-    key = derive_key(password, salt)
+    with open(path, "wb") as f:
+        f.write(salt)
+    return salt
 
-    aesgcm = AESGCM(key)
-    ciphertext = aesgcm.encrypt(iv, data, None)
+def load_kdf_params(path: str = None) -> dict:
+    path = path or VAULT_KDF_FILE
+    if not os.path.exists(path):
+        return default_kdf()
+    with open(path) as f:
+        params = json.load(f)
+    pack_kdf(params)    # rejects unknown algorithms and missing fields
+    return params
 
-    with open(output_path, "wb") as f:
-        f.write(MAGIC)
-        f.write(salt)
-        f.write(iv)
-        f.write(ciphertext)
+def save_kdf_params(params: dict, path: str = None):
+    pack_kdf(params)
+    path = path or VAULT_KDF_FILE
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(params, f)
+    os.replace(tmp, path)
 
-def decrypt_file(input_path: str, output_path: str, password: str):
-    with open(input_path, "rb") as f:
-        magic = f.read(len(MAGIC))
-        if magic != MAGIC:
+def _kdf_seconds(params: dict) -> float:
+    salt = os.urandom(SALT_SIZE)
+    start = time.perf_counter()
+    derive_key("calibration", salt, params)
+    return time.perf_counter() - start
+
+def calibrate_kdf(target: float = CALIBRATE_TARGET,
+                  algorithm: str = None,
+                  max_memory_kib: int = CALIBRATE_MEMORY) -> dict:
+    # picks parameters that take about `target` seconds here; the
+    # memory-hard KDFs use as much memory as allowed and scale time
+    algorithm = algorithm or (KDF_ARGON2ID if Argon2id else KDF_SCRYPT)
+    if algorithm == KDF_PBKDF2:
+        probe = {"algorithm": KDF_PBKDF2, "iterations": 50_000}
+        per_iteration = _kdf_seconds(probe) / probe["iterations"]
+        iterations = int(target / per_iteration) // 10_000 * 10_000
+        return {"algorithm": KDF_PBKDF2, "iterations": max(iterations, ITERATIONS)}
+
+    if algorithm == KDF_SCRYPT:
+        # memory is 128 * r * n bytes; r and p stay at the usual 8 and 1,
+        # so n is the only knob
+        params = {"algorithm": KDF_SCRYPT, "n": 2 ** 14, "r": 8, "p": 1}
+        while (128 * params["r"] * params["n"] * 2 <= max_memory_kib * 1024
+               and _kdf_seconds(params) < target / 2):
+            params["n"] *= 2
+        return params
+
+    if algorithm == KDF_ARGON2ID:
+        lanes = min(4, os.cpu_count() or 1)
+        params = {"algorithm": KDF_ARGON2ID,
+                  "memory_kib": min(64 * 1024, max_memory_kib),
+                  "iterations": 1, "lanes": lanes}
+        # grow memory first, then passes over it
+        while (params["memory_kib"] * 2 <= max_memory_kib
+               and _kdf_seconds(params) < target / 2):
+            params["memory_kib"] *= 2
+        elapsed = _kdf_seconds(params)
+        if elapsed < target:
+            params["iterations"] = max(1, round(target / elapsed))
+        return params
+
+    raise ValueError(f"Unknown KDF: {algorithm}")
+
+def wrap_key(kek: bytes, key: bytes) -> bytes:
+    nonce = os.urandom(IV_SIZE)
+    return nonce + AESGCM(kek).encrypt(nonce, key, KEY_WRAP_AAD)
+
+def unwrap_key(kek: bytes, wrapped: bytes) -> bytes:
+    try:
+        return AESGCM(kek).decrypt(wrapped[:IV_SIZE], wrapped[IV_SIZE:],
+                                   KEY_WRAP_AAD)
+    except InvalidTag:
+        raise ValueError("Wrong password or corrupted file.")
+
+class KeyRetired(ValueError):
+    # the KEK named by a header is not (or no longer) in the keyring; the
+    # object's current wrapped key is in its Drive sidecar
+    pass
+
+def _zeroize(buf: bytearray):
+    # best effort: only the cache's own copy can be wiped in Python
+    for i in range(len(buf)):
+        buf[i] = 0
+
+# ── key cache ─────────────────────────────────────────────────────────────────
+class KeyCache:
+    def __init__(self, ttl: float = KEY_CACHE_TTL,
+                 max_entries: int = KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # entry id -> (key bytearray, expiry)
+        self._lock = threading.Lock()
+        # entries are looked up by a keyed hash, never by the password itself
+        self._id_key = os.urandom(32)
+
+    def _entry_id(self, password: str, salt: bytes, params: dict) -> bytes:
+        return hmac.new(self._id_key,
+                        salt + pack_kdf(params) + password.encode(),
+                        hashlib.sha256).digest()
+
+    def _evict(self, entry_id):
+        key, _ = self._entries.pop(entry_id)
+        _zeroize(key)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for entry_id in [e for e, (_, exp) in self._entries.items() if exp <= now]:
+            self._evict(entry_id)
+
+    def master_key(self, password: str, salt: bytes,
+                   params: dict = None) -> bytes:
+        params = params or default_kdf()
+        entry_id = self._entry_id(password, salt, params)
+        with self._lock:
+            self._purge_expired()
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+                return bytes(self._entries[entry_id][0])
+
+        key = derive_key(password, salt, params)
+
+        with self._lock:
+            if entry_id in self._entries:
+                self._evict(entry_id)
+            self._entries[entry_id] = (bytearray(key),
+                                       time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+        return key
+
+    def vault_keys(self, password: str, create: bool = True):
+        # the unlocked keyring as {"current", "retired", "kdf", "salt",
+        # "keys": {name: key}}; created on first use unless create is
+        # False, in which case None means the vault has no keyring yet
+        ring = load_keyring()
+        if ring is None:
+            if not create:
+                return None
+            with _keyring_lock:
+                ring = load_keyring() or create_keyring(password, self)
+        salt = bytes.fromhex(ring["salt"])
+        unlock = self.master_key(password, salt, ring["kdf"])
+        return {"current": ring["current"], "retired": set(ring["retired"]),
+                "kdf": ring["kdf"], "salt": salt,
+                "keys": {name: unwrap_key(unlock, bytes.fromhex(wrapped))
+                         for name, wrapped in ring["keys"].items()}}
+
+    def clear(self):
+        with self._lock:
+            for entry_id in list(self._entries):
+                self._evict(entry_id)
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired()
+            return len(self._entries)
+
+# ── vault keyring ─────────────────────────────────────────────────────────────
+def _legacy_kek_id(salt: bytes, params: dict = None) -> str:
+    # keyring name for the master key (vault salt, KDF) gave before the
+    # keyring existed; files from then name only those two
+    return hashlib.sha256(b"CipherVault legacy master" + salt
+                          + pack_kdf(params or default_kdf())
+                          ).digest()[:KEK_ID_SIZE].hex()
+
+def set_keyring_mirror(mirror):
+    # mirror: fetch() -> sealed keyring or None, publish(ring), and
+    # ensure(ring), which publishes a keyring the mirror has never seen.
+    # The entry points install drive_manager.DriveKeyring; without a
+    # mirror the keyring is local only.
+    global _keyring_mirror
+    _keyring_mirror = mirror
+
+def load_keyring(path: str = None):
+    # the local keyring, else the mirrored copy (saved locally from then on)
+    path = path or VAULT_KEY_FILE
+    if not os.path.exists(path):
+        ring = _keyring_mirror.fetch() if _keyring_mirror else None
+        if ring is None:
+            return None
+        if ring.get("format") != KEYRING_FORMAT:
+            raise ValueError("Corrupted vault key copy on Drive.")
+        _write_keyring(ring, path)
+        return ring
+    with open(path) as f:
+        ring = json.load(f)
+    if ring.get("format") != KEYRING_FORMAT:
+        raise ValueError(f"Corrupted vault key file: {path}")
+    if _keyring_mirror:
+        _keyring_mirror.ensure(ring)    # e.g. made before there was a mirror
+    return ring
+
+def save_keyring(ring: dict, path: str = None):
+    _write_keyring(ring, path or VAULT_KEY_FILE)
+    if _keyring_mirror:
+        _keyring_mirror.publish(ring)
+
+def _write_keyring(ring: dict, path: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(ring, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def seal_keyring(keys: dict, current: str, retired, password: str,
+                 params: dict = None, key_cache=None, salt: bytes = None) -> dict:
+    # wraps every key under one derived from the password
+    params = params or load_kdf_params()
+    salt = salt or os.urandom(SALT_SIZE)
+    unlock = (key_cache if key_cache is not None else KeyCache()).master_key(password, salt, params)
+    return {"format": KEYRING_FORMAT, "salt": salt.hex(), "kdf": params,
+            "current": current, "retired": sorted(retired),
+            "keys": {name: wrap_key(unlock, key).hex()
+                     for name, key in keys.items()}}
+
+def create_keyring(password: str, key_cache=None, path: str = None) -> dict:
+    # The master key vault files were keyed from so far becomes the first
+    # KEK and the dedup root: everything written before keeps opening and
+    # backups keep deduplicating against chunks already on Drive.
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    salt, params = load_vault_salt(), load_kdf_params()
+    master = key_cache.master_key(password, salt, params)
+    kek_id = _legacy_kek_id(salt, params)
+    ring = seal_keyring({kek_id: master, DEDUP_ROOT: master}, kek_id, (),
+                        password, params, key_cache)
+    save_keyring(ring, path)
+    return ring
+
+def change_password(old_password: str, new_password: str,
+                    params: dict = None, key_cache=None) -> dict:
+    # only the keyring is rewritten; every file stays as it is
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    ring = key_cache.vault_keys(old_password)
+    sealed = seal_keyring(ring["keys"], ring["current"], ring["retired"],
+                          new_password, params, key_cache)
+    save_keyring(sealed)
+    return sealed
+
+def add_kek(password: str, key_cache=None) -> str:
+    # new files are wrapped under a fresh KEK from now on
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    ring = key_cache.vault_keys(password)
+    kek_id = os.urandom(KEK_ID_SIZE).hex()
+    keys = dict(ring["keys"], **{kek_id: os.urandom(KEY_SIZE)})
+    save_keyring(seal_keyring(keys, kek_id, ring["retired"], password,
+                              ring["kdf"], key_cache, ring["salt"]))
+    return kek_id
+
+def retire_keks(password: str, key_cache=None) -> list:
+    # drops every KEK but the current one; objects still wrapped under a
+    # retired KEK open through their sidecar only
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    ring = key_cache.vault_keys(password)
+    keep = {ring["current"], DEDUP_ROOT}
+    retired = [name for name in ring["keys"] if name not in keep]
+    keys = {name: key for name, key in ring["keys"].items() if name in keep}
+    save_keyring(seal_keyring(keys, ring["current"], ring["retired"] | set(retired),
+                              password, ring["kdf"], key_cache, ring["salt"]))
+    return retired
+
+def _vault_kek(password: str, kek_id: bytes, key_cache=None) -> bytes:
+    ring = (key_cache if key_cache is not None else KeyCache()).vault_keys(password, create=False)
+    if ring is None or kek_id.hex() not in ring["keys"]:
+        raise KeyRetired(f"Vault key {kek_id.hex()} is not in the keyring.")
+    return ring["keys"][kek_id.hex()]
+
+def _current_kek(password: str, key_cache=None):
+    ring = (key_cache if key_cache is not None else KeyCache()).vault_keys(password)
+    return bytes.fromhex(ring["current"]), ring["keys"][ring["current"]]
+
+def legacy_master_key(password: str, salt: bytes, params: dict = None,
+                      key_cache=None) -> bytes:
+    # session master key of files written before the keyring; kept in the
+    # keyring once there is one, so it survives password changes
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    ring = key_cache.vault_keys(password, create=False)
+    kek_id = _legacy_kek_id(salt, params)
+    if ring is not None:
+        if kek_id in ring["keys"]:
+            return ring["keys"][kek_id]
+        if kek_id in ring["retired"]:
+            raise KeyRetired(f"Vault key {kek_id} was retired.")
+    return key_cache.master_key(password, salt, params)
+
+# ── header ────────────────────────────────────────────────────────────────────
+def pack_header(records: dict) -> bytes:
+    body = b"".join(struct.pack(">BH", tag, len(value)) + value
+                    for tag, value in records.items())
+    return MAGIC_V2 + struct.pack(">H", len(body)) + body
+
+def read_header(f) -> dict:
+    raw = f.read(2)
+    if len(raw) != 2:
+        raise ValueError("Invalid file format.")
+    (length,) = struct.unpack(">H", raw)
+    body = f.read(length)
+    if len(body) != length:
+        raise ValueError("Invalid file format.")
+
+    records = {}
+    pos = 0
+    while pos < length:
+        if pos + 3 > length:
+            raise ValueError("Invalid file format.")
+        tag, size = struct.unpack_from(">BH", body, pos)
+        pos += 3
+        records[tag] = body[pos:pos + size]
+        pos += size
+    if pos != length:
+        raise ValueError("Invalid file format.")
+
+    for tag in (HDR_SEGMENT_SIZE, HDR_NONCE_PREFIX):
+        if tag not in records:
+            raise ValueError("Invalid file format.")
+    if HDR_SALT not in records and HDR_KEK_ID not in records:
+        raise ValueError("Invalid file format.")
+    return records
+
+def _segment_nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + struct.pack(">I", index)
+
+def _segment_aad(index: int, final: bool) -> bytes:
+    return struct.pack(">IB", index, 1 if final else 0)
+
+def _read_exact(f, size: int) -> bytes:
+    buf = f.read(size)
+    if len(buf) == size or not buf:
+        return buf
+    parts = [buf]
+    got = len(buf)
+    while got < size:
+        more = f.read(size - got)
+        if not more:
+            break
+        parts.append(more)
+        got += len(more)
+    return b"".join(parts)
+
+def _segments(f, size: int):
+    # yields (index, chunk, final) with one chunk of lookahead so the
+    # last segment is known before it is sealed/opened
+    index = 0
+    current = _read_exact(f, size)
+    while True:
+        nxt = _read_exact(f, size) if len(current) == size else b""
+        final = not nxt
+        if index >= MAX_SEGMENTS:
+            raise ValueError("File too large for container.")
+        yield index, current, final
+        if final:
+            return
+        index += 1
+        current = nxt
+
+def ordered_map(func, items, workers: int):
+    # like map(), but runs on a bounded pool and yields results in order
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    window = workers * INFLIGHT_PER_WORKER
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+def _wrapping_key(password: str, records: dict, key_cache=None) -> bytes:
+    salt = records[HDR_SALT]
+    params = unpack_kdf(records[HDR_KDF]) if HDR_KDF in records else None
+    if HDR_FILE_SALT not in records:
+        return derive_key(password, salt, params)
+    master = legacy_master_key(password, salt, params, key_cache)
+    return derive_file_key(master, records[HDR_FILE_SALT])
+
+def _file_key(password: str, records: dict, key_cache=None,
+              wrapped_key: bytes = None) -> bytes:
+    if wrapped_key is not None:
+        # Drive sidecar: KEK id | content key wrapped under that KEK
+        return unwrap_key(_vault_kek(password, wrapped_key[:KEK_ID_SIZE],
+                                     key_cache), wrapped_key[KEK_ID_SIZE:])
+    if HDR_KEK_ID in records:
+        return unwrap_key(_vault_kek(password, records[HDR_KEK_ID], key_cache),
+                          records[HDR_WRAPPED_KEY])
+    key = _wrapping_key(password, records, key_cache)
+    if HDR_WRAPPED_KEY not in records:
+        return key      # written before content keys were wrapped
+    return unwrap_key(key, records[HDR_WRAPPED_KEY])
+
+# ── streaming ─────────────────────────────────────────────────────────────────
+def _count_aes(start, nbytes):
+    # per-segment AES cost, summed across worker threads; the gap to the
+    # encrypt/decrypt stage time is disk and queueing
+    count("aes.seconds", time.perf_counter() - start)
+    count("aes.bytes", nbytes)
+
+def encrypt_stream(f, password: str, segment_size: int = SEGMENT_SIZE,
+                   workers: int = 1, key_cache=None, compression=None):
+    # compression: (codec, level) from compressor.choose(), or None
+    records = {
+        HDR_SEGMENT_SIZE: struct.pack(">I", segment_size),
+        HDR_NONCE_PREFIX: os.urandom(NONCE_PREFIX_SIZE),
+    }
+    if compression:
+        records[HDR_COMPRESSION] = pack_compression(*compression)
+        f = CompressingReader(f, *compression)
+    # the payload key is random and only ever wrapped, so re-keying and
+    # password changes rewrite headers or the keyring, never payloads
+    content_key = os.urandom(KEY_SIZE)
+    if key_cache is not None:
+        kek_id, kek = _current_kek(password, key_cache)
+        records[HDR_KEK_ID] = kek_id
+        records[HDR_WRAPPED_KEY] = wrap_key(kek, content_key)
+    else:
+        # standalone file: opens with the password alone
+        records[HDR_KDF] = pack_kdf(load_kdf_params())
+        records[HDR_SALT] = os.urandom(SALT_SIZE)
+        records[HDR_WRAPPED_KEY] = wrap_key(
+            _wrapping_key(password, records), content_key)
+    prefix = records[HDR_NONCE_PREFIX]
+    aesgcm = AESGCM(content_key)
+
+    yield pack_header(records)
+
+    def seal(segment):
+        index, chunk, final = segment
+        start = time.perf_counter()
+        sealed = aesgcm.encrypt(_segment_nonce(prefix, index), chunk,
+                                _segment_aad(index, final))
+        _count_aes(start, len(chunk))
+        return sealed
+
+    yield from ordered_map(seal, _segments(f, segment_size), workers)
+
+def segment_opener(records: dict, password: str, key_cache=None,
+                   wrapped_key: bytes = None):
+    # returns (segment size, open(segment)) for a parsed CVLT2 header;
+    # open() takes (index, ciphertext, final) and returns the plaintext.
+    # wrapped_key is an object's Drive sidecar, which overrides the header
+    (segment_size,) = struct.unpack(">I", records[HDR_SEGMENT_SIZE])
+    prefix = records[HDR_NONCE_PREFIX]
+    aesgcm = AESGCM(_file_key(password, records, key_cache, wrapped_key))
+
+    def open_(segment):
+        index, chunk, final = segment
+        start = time.perf_counter()
+        try:
+            plain = aesgcm.decrypt(_segment_nonce(prefix, index), chunk,
+                                   _segment_aad(index, final))
+            _count_aes(start, len(plain))
+            return plain
+        except InvalidTag:
+            if index == 0:
+                raise ValueError("Wrong password or corrupted file.")
+            raise ValueError(f"Corrupted or truncated file (segment {index}).")
+
+    return segment_size, open_
+
+def decrypt_stream(f, password: str, workers: int = 1, key_cache=None,
+                   wrapped_key: bytes = None):
+    magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        yield _decrypt_v1(f, password)
+        return
+    if magic != MAGIC_V2:
+        raise ValueError("Invalid file format.")
+
+    records = read_header(f)
+    segment_size, open_ = segment_opener(records, password, key_cache,
+                                         wrapped_key)
+    blocks = ordered_map(open_, _segments(f, segment_size + TAG_SIZE), workers)
+    if HDR_COMPRESSION in records:
+        codec, _ = unpack_compression(records[HDR_COMPRESSION])
+        blocks = inflate(blocks, codec)
+    yield from blocks
+
+class StreamDecryptor:
+    # Push-style counterpart of decrypt_stream for data that arrives in
+    # arbitrary pieces (e.g. straight off the network): update() writes
+    # whatever plaintext can be authenticated so far to `out`, finalize()
+    # the rest. A segment is only opened once more data follows it, since
+    # the last one must be opened with the final flag set. Compressed
+    # payloads reach `out` in bounded pieces as they inflate.
+    def __init__(self, out, password: str, key_cache=None,
+                 wrapped_key: bytes = None):
+        self._out = out
+        self._password = password
+        self._key_cache = key_cache
+        self._wrapped_key = wrapped_key
+        self._buf = bytearray()
+        self._open = None
+        self._inflate = None
+        self._step = 0
+        self._index = 0
+        self._v1 = False
+
+    def _start(self) -> bool:
+        if len(self._buf) < len(MAGIC_V2) + 2:
+            return False
+        magic = bytes(self._buf[:len(MAGIC)])
+        if magic == MAGIC:
+            self._v1 = True     # single-shot format: buffer until finalize()
+            return True
+        if magic != MAGIC_V2:
             raise ValueError("Invalid file format.")
+        (length,) = struct.unpack_from(">H", self._buf, len(MAGIC_V2))
+        end = len(MAGIC_V2) + 2 + length
+        if len(self._buf) < end:
+            return False
+        records = read_header(io.BytesIO(bytes(self._buf[len(MAGIC_V2):end])))
+        del self._buf[:end]
+        if HDR_COMPRESSION in records:
+            codec, _ = unpack_compression(records[HDR_COMPRESSION])
+            self._inflate = Decompressor(codec, self._out.write)
+        segment_size, self._open = segment_opener(records, self._password,
+                                                  self._key_cache,
+                                                  self._wrapped_key)
+        self._step = segment_size + TAG_SIZE
+        return True
+
+    def _emit(self, plain: bytes):
+        if self._inflate:
+            self._inflate.feed(plain)
+        elif plain:
+            self._out.write(plain)
+
+    def update(self, data: bytes):
+        self._buf += data
+        if self._open is None and (self._v1 or not self._start()):
+            return
+        if self._v1:
+            return
+
+        pos = 0
+        view = memoryview(self._buf)
+        try:
+            while len(self._buf) - pos > self._step:
+                self._emit(self._open((self._index,
+                                       bytes(view[pos:pos + self._step]), False)))
+                self._index += 1
+                pos += self._step
+        finally:
+            view.release()
+        del self._buf[:pos]
+
+    def finalize(self):
+        if self._v1:
+            self._out.write(_decrypt_v1(
+                io.BytesIO(bytes(self._buf[len(MAGIC):])), self._password))
+            return
+        if self._open is None:
+            raise ValueError("Invalid file format.")
+        chunk = bytes(self._buf)
+        self._buf.clear()
+        self._emit(self._open((self._index, chunk, True)))
+        if self._inflate:
+            self._inflate.finish()
+
+class RangedDecryptor:
+    # Random access into a CVLT2 object. read_range(first, last) must
+    # return ciphertext bytes first..last inclusive; only the header and
+    # the segments covering a requested range are ever fetched.
+    def __init__(self, read_range, total_size: int, password: str,
+                 key_cache=None, wrapped_key: bytes = None):
+        self.read_range = read_range
+        self.total_size = total_size
+        head = read_range(0, min(HEADER_PROBE, total_size) - 1)
+        if head[:len(MAGIC_V2)] != MAGIC_V2:
+            raise ValueError("Byte ranges need the chunked (CVLT2) format.")
+        (header_len,) = struct.unpack_from(">H", head, len(MAGIC_V2))
+        self.payload_at = len(MAGIC_V2) + 2 + header_len
+        if len(head) < self.payload_at:
+            head += read_range(len(head), self.payload_at - 1)
+        records = read_header(io.BytesIO(head[len(MAGIC_V2):self.payload_at]))
+        # segments of a compressed file still authenticate on their own,
+        # but plaintext offsets no longer map onto them
+        self.compressed = HDR_COMPRESSION in records
+        self.segment_size, self._open = segment_opener(records, password,
+                                                       key_cache, wrapped_key)
+
+        self.step = self.segment_size + TAG_SIZE
+        payload = total_size - self.payload_at
+        self.count = max(1, -(-payload // self.step))
+        self.plain_size = payload - self.count * TAG_SIZE
+        if self.plain_size < 0:
+            raise ValueError("Invalid file format.")
+
+    def ciphertext_span(self, first: int, last: int):
+        # inclusive ciphertext byte range holding segments first..last
+        return (self.payload_at + first * self.step,
+                min(self.total_size, self.payload_at + (last + 1) * self.step) - 1)
+
+    def open_segments(self, first: int, data: bytes) -> bytes:
+        # authenticates and decrypts consecutive segments starting at first
+        out = []
+        for pos in range(0, max(len(data), 1), self.step):
+            index = first + pos // self.step
+            out.append(self._open((index, data[pos:pos + self.step],
+                                   index == self.count - 1)))
+        return b"".join(out)
+
+    def check(self):
+        # authenticates segment 0, which a wrong password fails, even when
+        # the plaintext is empty and read() would open nothing
+        self.open_segments(0, self.read_range(*self.ciphertext_span(0, 0)))
+
+    def read(self, start: int, length: int) -> bytes:
+        if self.compressed:
+            raise ValueError("Byte ranges aren't available for compressed files.")
+        stop = min(start + length, self.plain_size)
+        if start < 0 or stop <= start:
+            return b""
+        first = start // self.segment_size
+        last = (stop - 1) // self.segment_size
+        plain = self.open_segments(first,
+                                   self.read_range(*self.ciphertext_span(first, last)))
+        offset = first * self.segment_size
+        return plain[start - offset:stop - offset]
 
-        salt = f.read(SALT_SIZE)
-        iv = f.read(IV_SIZE)
-        ciphertext = f.read()
+def decrypt_range(read_range, total_size: int, start: int, length: int,
+                  password: str, key_cache=None) -> bytes:
+    # plaintext bytes [start, start + length) of a CVLT2 object
+    return RangedDecryptor(read_range, total_size, password,
+                           key_cache).read(start, length)
+
+def _decrypt_v1(f, password: str) -> bytes:
+    salt = f.read(SALT_SIZE)
+    iv = f.read(IV_SIZE)
+    ciphertext = f.read()
 
     key = derive_key(password, salt)
     aesgcm = AESGCM(key)
 
     try:
-        plaintext = aesgcm.decrypt(iv, ciphertext, None)
+        return aesgcm.decrypt(iv, ciphertext, None)
     except Exception:
         raise ValueError("Wrong password or corrupted file.")
 
-    with open(output_path, "wb") as f:
-        f.write(plaintext)
\ No newline at end of file
+# ── files ─────────────────────────────────────────────────────────────────────
+# progress(done, total) is called with input bytes consumed after every
+# segment; an exception raised from it aborts the operation
+def encrypt_file(input_path: str, output_path: str, password: str,
+                 segment_size: int = SEGMENT_SIZE, workers: int = 1,
+                 key_cache=None, progress=None, compress=None):
+    # compress: None, "auto", "zlib" or "zstd" (see compressor.choose).
+    # Returns {"bytes", "stored", "codec"}: stored is the payload size
+    # after compression, codec None if the file went in as it was.
+    if not os.path.exists(input_path):
+        raise FileNotFoundError("Input file does not exist.")
+
+    total = os.path.getsize(input_path)
+    compression = choose(input_path, compress) if compress else None
+    stored = 0
+    with timed("encrypt", total), open(input_path, "rb") as fin, \
+            open(output_path, "wb") as fout:
+        blocks = encrypt_stream(fin, password, segment_size, workers,
+                                key_cache, compression)
+        fout.write(next(blocks))        # header
+        for block in blocks:
+            fout.write(block)
+            stored += len(block) - TAG_SIZE
+            if progress:
+                progress(fin.tell(), total)
+    if compression:
+        count("compress.bytes_in", total)
+        count("compress.bytes_out", stored)
+    return {"bytes": total, "stored": stored,
+            "codec": codec_name(compression[0]) if compression else None}
+
+def decrypt_file(input_path: str, output_path: str, password: str,
+                 workers: int = 1, key_cache=None, progress=None):
+    total = os.path.getsize(input_path)
+    with timed("decrypt", total), open(input_path, "rb") as fin:
+        try:
+            with open(output_path, "wb") as fout:
+                for block in decrypt_stream(fin, password, workers,
+                                            key_cache):
+                    fout.write(block)
+                    if progress:
+                        progress(fin.tell(), total)
+        except Exception:
+            # never leave a partially decrypted file behind
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+# ── re-keying ─────────────────────────────────────────────────────────────────
+def _vault_file(records: dict) -> bool:
+    # keyed from the vault keyring (or the master key before it)
+    return HDR_KEK_ID in records or HDR_FILE_SALT in records
+
+def rekey_records(records: dict, password: str, params: dict = None,
+                  key_cache=None, wrapped_key: bytes = None) -> dict:
+    # same content key and payload, wrapped anew: vault files under the
+    # current KEK, standalone files under a fresh salt and `params`
+    content_key = _file_key(password, records, key_cache, wrapped_key)
+    new = {tag: value for tag, value in records.items()
+           if tag not in (HDR_SALT, HDR_FILE_SALT, HDR_KDF, HDR_WRAPPED_KEY,
+                          HDR_KEK_ID)}
+    if _vault_file(records):
+        kek_id, kek = _current_kek(password, key_cache)
+        new[HDR_KEK_ID] = kek_id
+        new[HDR_WRAPPED_KEY] = wrap_key(kek, content_key)
+        return new
+    new[HDR_KDF] = pack_kdf(params or load_kdf_params())
+    new[HDR_SALT] = os.urandom(SALT_SIZE)
+    new[HDR_WRAPPED_KEY] = wrap_key(_wrapping_key(password, new), content_key)
+    return new
+
+def sidecar_key(records: dict, password: str, key_cache=None,
+                wrapped_key: bytes = None) -> bytes:
+    # an object's content key wrapped under the current KEK, in the form
+    # kept on Drive: KEK id | wrapped key. None if there is nothing to do:
+    # standalone files don't use the keyring, and a header under the
+    # current KEK needs no sidecar.
+    if not _vault_file(records) or (
+            wrapped_key is None and
+            records.get(HDR_KEK_ID) == _current_kek(password, key_cache)[0]):
+        return None
+    new = rekey_records(records, password, key_cache=key_cache,
+                        wrapped_key=wrapped_key)
+    return new[HDR_KEK_ID] + new[HDR_WRAPPED_KEY]
+
+def rekey_file(path: str, password: str, params: dict = None,
+               key_cache=None) -> bool:
+    # rewrites the header of a CVLT2 file in place, copying the payload
+    # as is; returns False if it is already current (vault files: under
+    # the current KEK, standalone files: under `params`)
+    params = params or load_kdf_params()
+    total = os.path.getsize(path)
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic == MAGIC:
+            raise ValueError("CVLT1 files must be re-encrypted to change their KDF.")
+        if magic != MAGIC_V2:
+            raise ValueError("Invalid file format.")
+        records = read_header(f)
+        if _vault_file(records):
+            if records.get(HDR_KEK_ID) == _current_kek(password, key_cache)[0]:
+                return False
+        elif (records.get(HDR_KDF) == pack_kdf(params)
+                and HDR_WRAPPED_KEY in records):
+            return False
+        new = rekey_records(records, password, params, key_cache)
+
+        # files from before key wrapping have nothing that checks the
+        # password, so open the first segment under the new header
+        # before anything is written
+        payload_at = f.tell()
+        segment_size, open_ = segment_opener(new, password, key_cache)
+        step = segment_size + TAG_SIZE
+        open_((0, f.read(step), total - payload_at <= step))
+        f.seek(payload_at)
+
+        tmp = path + ".rekey"
+        try:
+            with open(tmp, "wb") as out:
+                out.write(pack_header(new))
+                shutil.copyfileobj(f, out, SEGMENT_SIZE)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return True
@@ -0,0 +1,215 @@
+import io
+import os
+import hmac
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from crypto_engine import (KeyCache, legacy_master_key, derive_subkey,
+                           encrypt_stream, decrypt_stream, ordered_map,
+                           KeyRetired, IV_SIZE, DEDUP_ROOT)
+from drive_manager import get_client
+from catalog import Catalog
+
+# Incremental backups: files are cut into content-defined chunks, each chunk
+# is named by a keyed HMAC of its plaintext and uploaded only if the vault
+# has never seen it. An encrypted per-file manifest lists the chunks.
+CHUNK_MIN = 256 * 1024
+CHUNK_AVG = 1024 * 1024
+CHUNK_MAX = 4 * 1024 * 1024
+CHUNK_ID_INFO = b"CipherVault chunk id"
+CHUNK_KEY_INFO = b"CipherVault chunk key"
+MANIFEST_FORMAT = "cvault-manifest-1"
+TRANSFERS = 4
+
+# ── content-defined chunking ──────────────────────────────────────────────────
+# FastCDC: a gear hash rolls over the last 64 bytes (each byte shifts
+# the hash left and adds its 64-bit table entry, so a byte's influence
+# is gone 64 bytes later). A boundary falls where the masked bits are
+# all zero. The first CHUNK_MIN bytes of a chunk are skipped, MASK_S
+# (two bits more than the average asks for) applies up to CHUNK_AVG and
+# MASK_L (two fewer) after it, which keeps chunk sizes close to the
+# average. The table and masks are fixed: changing them re-chunks every
+# file and defeats dedup against older backups.
+GEAR_WINDOW = 64
+_HASH_MASK = (1 << GEAR_WINDOW) - 1
+
+def _gear(label):
+    return [int.from_bytes(hashlib.sha256(b"%s %d" % (label, i)).digest()[:8],
+                           "little") for i in range(256)]
+
+def _mask(bits):
+    # one bits spread over the upper 48, so every mask bit depends on
+    # at least the last 16 bytes
+    return sum(1 << (GEAR_WINDOW - 1 - i * 48 // bits) for i in range(bits))
+
+_GEAR = _gear(b"CipherVault CDC gear")
+MASK_S = _mask((CHUNK_AVG.bit_length() - 1) + 2)
+MASK_L = _mask((CHUNK_AVG.bit_length() - 1) - 2)
+
+def _find_cut(buf, start, end):
+    # returns the boundary after `start`
+    limit = min(end, start + CHUNK_MAX)
+    if limit - start <= CHUNK_MIN:
+        return limit
+    norm = min(start + CHUNK_AVG, limit)
+    gear, h = _GEAR, 0
+    pos = start + CHUNK_MIN
+    # prime the hash with the window before the first candidate
+    for c in buf[pos - GEAR_WINDOW:pos]:
+        h = ((h << 1) + gear[c]) & _HASH_MASK
+    for lo, hi, mask in ((pos, norm, MASK_S), (norm, limit, MASK_L)):
+        for i, c in enumerate(buf[lo:hi], lo + 1):
+            h = ((h << 1) + gear[c]) & _HASH_MASK
+            if not h & mask:
+                return i
+    return limit
+
+def chunk_stream(f):
+    buf = b""
+    pos = 0
+    eof = False
+    while True:
+        if not eof and len(buf) - pos < CHUNK_MAX:
+            more = f.read(CHUNK_MAX * 2)
+            if more:
+                buf = buf[pos:] + more
+                pos = 0
+            else:
+                eof = True
+            continue
+        if pos >= len(buf):
+            return
+        cut = _find_cut(buf, pos, len(buf))
+        yield buf[pos:cut]
+        pos = cut
+
+def _dedup_root(password, manifest, key_cache):
+    if "vault_salt" in manifest:
+        # written before the keyring: chunks hang off the master key
+        try:
+            return legacy_master_key(password,
+                                     bytes.fromhex(manifest["vault_salt"]),
+                                     manifest.get("kdf"), key_cache)
+        except KeyRetired:
+            # retired as a KEK by rotate --retire, but the keyring was
+            # created from that master key and keeps it as the dedup root
+            pass
+    return key_cache.vault_keys(password)["keys"][DEDUP_ROOT]
+
+def _chunk_keys(master):
+    return (derive_subkey(master, CHUNK_ID_INFO),
+            AESGCM(derive_subkey(master, CHUNK_KEY_INFO)))
+
+# ── backup / restore ──────────────────────────────────────────────────────────
+def backup_file(path, password, client=None, key_cache=None, catalog=None,
+                transfers=TRANSFERS, name=None):
+    # the catalog knows which chunks are already on Drive; the backup
+    # itself is recorded there too
+    client = client or get_client()
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    catalog = catalog if catalog is not None else Catalog()
+    id_key, aesgcm = _chunk_keys(
+        key_cache.vault_keys(password)["keys"][DEDUP_ROOT])
+    name = name or os.path.basename(path)
+
+    stats = {"name": name, "bytes": 0, "chunks": 0, "new_chunks": 0,
+             "uploaded_bytes": 0}
+    order = []
+    pending = {}
+    digest = hashlib.sha256()
+    start = time.perf_counter()
+
+    def upload(chunk_id, chunk):
+        nonce = os.urandom(IV_SIZE)
+        blob = nonce + aesgcm.encrypt(nonce, chunk, chunk_id.encode())
+        catalog.add_chunk(chunk_id,
+                          client.upload_bytes(blob, "chunk-" + chunk_id),
+                          len(blob))
+        return len(blob)
+
+    with ThreadPoolExecutor(max_workers=transfers) as pool, \
+            open(path, "rb") as f:
+        running = set()
+        for chunk in chunk_stream(f):
+            chunk_id = hmac.new(id_key, chunk, hashlib.sha256).hexdigest()
+            order.append((chunk_id, len(chunk)))
+            digest.update(chunk)
+            stats["bytes"] += len(chunk)
+            stats["chunks"] += 1
+            if chunk_id in pending or catalog.chunk(chunk_id):
+                continue
+            fut = pool.submit(upload, chunk_id, chunk)
+            pending[chunk_id] = fut
+            running.add(fut)
+            # bound the chunks held in memory while uploads catch up
+            if len(running) >= transfers * 2:
+                _, running = wait(running, return_when=FIRST_COMPLETED)
+        for fut in pending.values():
+            stats["uploaded_bytes"] += fut.result()
+    stats["new_chunks"] = len(pending)
+
+    manifest = json.dumps({
+        "format": MANIFEST_FORMAT,
+        "name": name,
+        "size": stats["bytes"],
+        "root": DEDUP_ROOT,
+        "chunks": [[cid, catalog.chunk(cid), size] for cid, size in order],
+    }).encode()
+    sealed = b"".join(encrypt_stream(io.BytesIO(manifest), password,
+                                     key_cache=key_cache))
+    stats["manifest_id"] = client.upload_bytes(sealed, name + ".manifest")
+    catalog.add_local(name, stats["manifest_id"], path,
+                      sha256=digest.hexdigest(), format=MANIFEST_FORMAT)
+    stats["uploaded_bytes"] += len(sealed)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+def read_manifest(manifest_id, password, client=None, key_cache=None):
+    client = client or get_client()
+    sealed = client.download_bytes(manifest_id)
+    try:
+        plain = b"".join(decrypt_stream(io.BytesIO(sealed), password,
+                                        key_cache=key_cache))
+    except KeyRetired:
+        wrapped = client.wrapped_key(manifest_id)
+        if wrapped is None:
+            raise
+        plain = b"".join(decrypt_stream(io.BytesIO(sealed), password,
+                                        key_cache=key_cache,
+                                        wrapped_key=wrapped))
+    manifest = json.loads(plain)
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise ValueError("Not a CipherVault backup manifest.")
+    return manifest
+
+def restore_file(manifest_id, output_path, password, client=None,
+                 key_cache=None, transfers=TRANSFERS):
+    client = client or get_client()
+    key_cache = key_cache if key_cache is not None else KeyCache()
+    manifest = read_manifest(manifest_id, password, client, key_cache)
+    id_key, aesgcm = _chunk_keys(_dedup_root(password, manifest, key_cache))
+
+    def fetch(entry):
+        chunk_id, file_id, size = entry
+        blob = client.download_bytes(file_id)
+        try:
+            chunk = aesgcm.decrypt(blob[:IV_SIZE], blob[IV_SIZE:],
+                                   chunk_id.encode())
+        except Exception:
+            raise ValueError(f"Corrupted chunk {chunk_id[:16]}.")
+        if (len(chunk) != size or not hmac.compare_digest(
+                hmac.new(id_key, chunk, hashlib.sha256).hexdigest(), chunk_id)):
+            raise ValueError(f"Chunk {chunk_id[:16]} does not match manifest.")
+        return chunk
+
+    try:
+        with open(output_path, "wb") as out:
+            for chunk in ordered_map(fetch, manifest["chunks"], transfers):
+                out.write(chunk)
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return manifest
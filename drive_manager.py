@@ -1,47 +1,379 @@
 import os
 import pickle
+import threading
+import datetime
+import time
+from contextlib import contextmanager
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 import io
+import json
+import base64
+from upload_engine import (UploadJournal, resumable_upload, UPLOAD_CHUNK_SIZE,
+                           MAX_RETRIES, TransientError, backoff_delay,
+                           is_retryable, request)
+from metrics import timed, count
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
+TOKEN_FILE = 'token.pkl'
+CREDENTIALS_FILE = 'credentials.json'
+DRIVE_ROOT_URL = 'https://www.googleapis.com/'
+DISCOVERY_PATH = 'discovery/v1/apis/{api}/{apiVersion}/rest'
 
-def authenticate():
+# refresh the access token this long before it actually expires, so no
+# request ever has to stall on a 401 + refresh round trip
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+HTTP_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_IDLE_TRANSPORTS = 8
+# wrapped content keys ride along as an appProperty, so re-wrapping one
+# is a metadata update rather than a new upload of the object
+SIDECAR_PROPERTY = 'cvk'
+BATCH_SIZE = 100        # Drive's limit on calls per batch request
+# the sealed vault keyring is kept on Drive as well, tagged so it can be
+# found from a machine that has nothing but the password
+KEYRING_PROPERTY = 'cvault'
+KEYRING_TAG = 'keyring'
+KEYRING_STAMP = 'cvkt'
+KEYRING_NAME = 'cvault-keyring.json'
+
+def load_credentials():
+    with timed("auth"):
+        return _load_credentials()
+
+def _load_credentials():
     creds = None
-    if os.path.exists('token.pkl'):
-        with open('token.pkl', 'rb') as token:
+    if os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE, 'rb') as token:
             creds = pickle.load(token)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
             creds = flow.run_local_server(port=0)
-        with open('token.pkl', 'wb') as token:
-            pickle.dump(creds, token)
-
-    return build('drive', 'v3', credentials=creds)
-
-def upload_file(file_path, drive_name=None):
-    service = authenticate()
-    if not drive_name:
-        drive_name = os.path.basename(file_path)
-    file_metadata = {'name': drive_name}
-    media = MediaFileUpload(file_path, resumable=True)
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-    print(f"Uploaded! File ID: {file.get('id')}")
-    return file.get('id')
-
-def download_file(file_id, destination_path):
-    service = authenticate()
-    request = service.files().get_media(fileId=file_id)
-    fh = io.FileIO(destination_path, 'wb')
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-        print(f"Downloading... {int(status.progress() * 100)}%")
-    print("Download complete!")
\ No newline at end of file
+        _save_credentials(creds)
+
+    return creds
+
+def _save_credentials(creds):
+    with open(TOKEN_FILE, 'wb') as token:
+        pickle.dump(creds, token)
+
+def authenticate():
+    return build('drive', 'v3', credentials=load_credentials())
+
+# ── long-lived client ─────────────────────────────────────────────────────────
+class DriveClient:
+    # One client per process: credentials are loaded once and refreshed
+    # ahead of expiry, the API surface is built once, and requests run over
+    # a pool of persistent httplib2 transports. httplib2 isn't thread-safe,
+    # so every concurrent operation checks out a transport of its own.
+    def __init__(self, credentials=None, root_url=None,
+                 timeout=HTTP_TIMEOUT, max_idle=MAX_IDLE_TRANSPORTS,
+                 journal=None, chunk_size=UPLOAD_CHUNK_SIZE,
+                 download_chunk_size=DOWNLOAD_CHUNK_SIZE):
+        # root_url points the client at another Drive-compatible endpoint,
+        # e.g. the local fake server in benchmarks/
+        self._creds = credentials
+        self._persist = credentials is None
+        self.root_url = root_url or DRIVE_ROOT_URL
+        self._discovery_url = root_url and root_url + DISCOVERY_PATH
+        self._timeout = timeout
+        self._max_idle = max_idle
+        self.journal = journal or UploadJournal()
+        self.chunk_size = chunk_size
+        self.download_chunk_size = download_chunk_size
+        self._service = None
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def credentials(self):
+        with self._lock:
+            if self._creds is None:
+                self._creds = load_credentials()
+            expiry = getattr(self._creds, 'expiry', None)
+            if (expiry is not None and self._creds.refresh_token
+                    and expiry - datetime.datetime.utcnow() < REFRESH_MARGIN):
+                with timed("auth.refresh"):
+                    self._creds.refresh(Request())
+                if self._persist:
+                    _save_credentials(self._creds)
+            return self._creds
+
+    def _new_transport(self):
+        http = httplib2.Http(timeout=self._timeout)
+        # resumable uploads answer 308 "Resume Incomplete", not a redirect
+        http.redirect_codes = http.redirect_codes - {308}
+        return AuthorizedHttp(self.credentials(), http=http)
+
+    @property
+    def service(self):
+        with self._lock:
+            if self._service is not None:
+                return self._service
+        http = self._new_transport()
+        with timed("discovery"):
+            if self._discovery_url:
+                service = build('drive', 'v3', http=http,
+                                discoveryServiceUrl=self._discovery_url,
+                                static_discovery=False, cache_discovery=False)
+            else:
+                service = build('drive', 'v3', http=http, cache_discovery=False)
+        with self._lock:
+            if self._service is None:
+                self._service = service
+                self._idle.append(http)
+            return self._service
+
+    @contextmanager
+    def transport(self):
+        self.credentials()   # proactive refresh before the request goes out
+        with self._lock:
+            http = self._idle.pop() if self._idle else None
+        if http is None:
+            http = self._new_transport()
+        try:
+            yield http
+        finally:
+            with self._lock:
+                if len(self._idle) < self._max_idle:
+                    self._idle.append(http)
+                    http = None
+            if http is not None:
+                http.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for http in idle:
+            http.close()
+
+    def upload_file(self, file_path, drive_name=None, progress=None):
+        with timed("upload", os.path.getsize(file_path)):
+            return resumable_upload(self, file_path, drive_name,
+                                    journal=self.journal,
+                                    chunk_size=self.chunk_size,
+                                    progress=progress)
+
+    def upload_bytes(self, data, drive_name, properties=None):
+        # one multipart request; for small objects a resumable session's
+        # extra round trip costs more than it could ever save
+        media = MediaIoBaseUpload(io.BytesIO(data),
+                                  mimetype='application/octet-stream',
+                                  resumable=False)
+        body = {'name': drive_name}
+        if properties:
+            body['appProperties'] = properties
+        request = self.service.files().create(
+            body=body, media_body=media, fields='id')
+        with timed("upload", len(data)), self.transport() as http:
+            file_id = request.execute(http=http, num_retries=MAX_RETRIES)['id']
+        count("bytes.up", len(data))
+        return file_id
+
+    def download_bytes(self, file_id):
+        request = self.service.files().get_media(fileId=file_id)
+        with timed("download") as span, self.transport() as http:
+            data = request.execute(http=http, num_retries=MAX_RETRIES)
+            span.bytes = len(data)
+        count("bytes.down", len(data))
+        return data
+
+    def download_to(self, file_id, sink, progress=None):
+        # streams the object into anything with a write() method
+        media = self.service.files().get_media(fileId=file_id)
+        sink = _MeteredSink(sink)
+        with timed("download") as span, self.transport() as http:
+            media.http = http
+            downloader = MediaIoBaseDownload(sink, media,
+                                             chunksize=self.download_chunk_size)
+            done = False
+            while not done:
+                status, done = downloader.next_chunk(num_retries=MAX_RETRIES)
+                span.bytes = sink.bytes
+                if progress:
+                    progress(status)
+
+    def download_file(self, file_id, destination_path, progress=None):
+        with io.FileIO(destination_path, 'wb') as fh:
+            self.download_to(file_id, fh, progress)
+
+    def delete(self, file_id):
+        request = self.service.files().delete(fileId=file_id)
+        with timed("metadata"), self.transport() as http:
+            request.execute(http=http, num_retries=MAX_RETRIES)
+
+    def find(self, key, value):
+        # [{"id", "appProperties"}] of the files tagged key=value; the
+        # drive.file scope only ever lists files this app created
+        request = self.service.files().list(
+            q=f"appProperties has {{ key='{key}' and value='{value}' }} "
+              f"and trashed = false",
+            spaces='drive', fields='files(id, appProperties)', pageSize=100)
+        with timed("metadata"), self.transport() as http:
+            return request.execute(http=http,
+                                   num_retries=MAX_RETRIES).get('files', [])
+
+    def wrapped_key(self, file_id):
+        # the object's sidecar (KEK id | wrapped content key), or None
+        request = self.service.files().get(fileId=file_id,
+                                           fields='appProperties')
+        with self.transport() as http:
+            meta = request.execute(http=http, num_retries=MAX_RETRIES)
+        value = (meta.get('appProperties') or {}).get(SIDECAR_PROPERTY)
+        return base64.b64decode(value) if value else None
+
+    def set_wrapped_keys(self, wrapped):
+        # {file id: sidecar bytes}, sent as metadata-only updates batched
+        # BATCH_SIZE to a request; returns {file id: error} for failures
+        errors = {}
+
+        def done(file_id, response, exception):
+            if exception is not None:
+                errors[file_id] = exception
+
+        items = list(wrapped.items())
+        for i in range(0, len(items), BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=done)
+            for file_id, value in items[i:i + BATCH_SIZE]:
+                props = {SIDECAR_PROPERTY: base64.b64encode(value).decode()}
+                batch.add(self.service.files().update(
+                    fileId=file_id, body={'appProperties': props}, fields='id'),
+                    request_id=file_id)
+            with timed("metadata"), self.transport() as http:
+                batch.execute(http=http)
+        return errors
+
+    def media_url(self, file_id):
+        return f"{self.root_url}drive/v3/files/{file_id}?alt=media"
+
+    def fetch_range(self, file_id, first, last):
+        # bytes first..last inclusive; returns (data, total object size)
+        with timed("range") as span:
+            data, total = self._fetch_range(file_id, first, last)
+            span.bytes = len(data)
+        count("bytes.down", len(data))
+        return data, total
+
+    def _fetch_range(self, file_id, first, last):
+        attempt = 0
+        with self.transport() as http:
+            while True:
+                try:
+                    resp, content = request(http, self.media_url(file_id), 'GET',
+                                            headers={'Range': f'bytes={first}-{last}'})
+                    if resp.status in (206, 416):
+                        total = int(resp['content-range'].rsplit('/', 1)[1])
+                        return (content if resp.status == 206 else b''), total
+                    if resp.status == 200:
+                        # server ignored the Range header
+                        return content[first:last + 1], len(content)
+                    if is_retryable(resp, content):
+                        raise TransientError(f"HTTP {resp.status}")
+                    raise RuntimeError(f"Download failed: HTTP {resp.status}")
+                except TransientError:
+                    if attempt >= MAX_RETRIES:
+                        raise
+                    count("download.retries")
+                    time.sleep(backoff_delay(attempt))
+                    attempt += 1
+
+class _MeteredSink:
+    # counts downloaded bytes on their way to the real sink
+    def __init__(self, sink):
+        self.sink = sink
+        self.bytes = 0
+
+    def write(self, data):
+        self.sink.write(data)
+        self.bytes += len(data)
+        count("bytes.down", len(data))
+        return len(data)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DriveClient()
+        return _client
+
+class DriveKeyring:
+    # keyring mirror for crypto_engine.set_keyring_mirror. Every save
+    # uploads a new copy and then deletes the older ones, so there is
+    # always at least one complete copy on Drive.
+    def __init__(self, client=None):
+        self._client = client
+        self._seen = False
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def _copies(self):
+        # newest first
+        return sorted(self.client.find(KEYRING_PROPERTY, KEYRING_TAG),
+                      key=lambda f: int((f.get('appProperties') or {})
+                                        .get(KEYRING_STAMP, 0)),
+                      reverse=True)
+
+    def fetch(self):
+        copies = self._copies()
+        if not copies:
+            return None
+        return json.loads(self.client.download_bytes(copies[0]['id']))
+
+    def publish(self, ring):
+        old = self._copies()
+        self.client.upload_bytes(
+            json.dumps(ring, indent=1).encode(), KEYRING_NAME,
+            properties={KEYRING_PROPERTY: KEYRING_TAG,
+                        KEYRING_STAMP: str(time.time_ns())})
+        self._seen = True
+        for f in old:
+            try:
+                self.client.delete(f['id'])
+            except Exception:
+                pass        # a stale copy is harmless; the newest one wins
+
+    def ensure(self, ring):
+        # once per process: a keyring from before the mirror, or from a
+        # machine that was offline when it was made, gets its first copy.
+        # Best effort, so local work goes on offline; the next run retries.
+        with self._lock:
+            if self._seen:
+                return
+            self._seen = True
+            try:
+                if not self._copies():
+                    self.publish(ring)
+            except Exception:
+                pass
+
+# ── simple API ────────────────────────────────────────────────────────────────
+def upload_file(file_path, drive_name=None, client=None, verbose=True):
+    client = client or get_client()
+    file_id = client.upload_file(file_path, drive_name)
+    if verbose:
+        print(f"Uploaded! File ID: {file_id}")
+    return file_id
+
+def download_file(file_id, destination_path, client=None, verbose=True):
+    client = client or get_client()
+
+    def progress(status):
+        if verbose:
+            print(f"Downloading... {int(status.progress() * 100)}%")
+
+    client.download_file(file_id, destination_path, progress)
+    if verbose:
+        print("Download complete!")
@@ -1,9 +1,12 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import threading
-import json
 import os
 import sys
+import queue
+import tempfile
+from bisect import bisect_left
+from jobs import JobScheduler, RUNNING, DONE, FAILED, CANCELLED
+from metrics import RateMeter
 
 BG        = "#0d0f14"
 PANEL     = "#13161e"
@@ -22,18 +25,14 @@ FONT_BODY   = ("Courier New", 10)
 FONT_SMALL  = ("Courier New", 9)
 FONT_MONO   = ("Courier New", 10, "bold")
 
-VAULT_FILE  = "vault_index.json"   # stores {filename: file_id}
-
-# ── vault index helpers ───────────────────────────────────────────────────────
-def load_vault():
-    if os.path.exists(VAULT_FILE):
-        with open(VAULT_FILE) as f:
-            return json.load(f)
-    return {}
-
-def save_vault(data):
-    with open(VAULT_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+ROW_HEIGHT  = 58     # file list rows are fixed-height so they can be recycled
+SEARCH_DELAY_MS = 150
+CATALOG_POLL_MS = 2000
+JOB_POLL_MS = 100
+JOB_WORKERS = 2      # transfers running at once; the rest wait in the queue
+MAX_JOB_ROWS = 5
+RATE_POLL_MS = 1000
+ASYNC_BATCH = 8      # this many files or more go to the async engine as one job
 
 # ── main app ──────────────────────────────────────────────────────────────────
 class CipherVaultApp(tk.Tk):
@@ -45,9 +44,34 @@ class CipherVaultApp(tk.Tk):
         self.configure(bg=BG)
         self.resizable(True, True)
 
-        self.vault = load_vault()
+        from crypto_engine import KeyCache, set_keyring_mirror
+        from drive_manager import DriveKeyring
+        # master keys are derived once per password and reused across clicks
+        self.key_cache = KeyCache()
+        # the sealed keyring is mirrored to Drive, so losing vault_key.json
+        # doesn't lose the vault
+        set_keyring_mirror(DriveKeyring())
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        from catalog import Catalog
+        # uploads are recorded in the shared SQLite catalog; an old
+        # vault_index.json is imported the first time it's opened
+        self.catalog = Catalog()
+        self._catalog_version = None
+        self._search_job = None
+        self._search_text = ""
+        # transfers run on a small worker pool; their results come back to
+        # the Tk thread through _pump_jobs, never from the workers directly
+        self.jobs = JobScheduler(JOB_WORKERS)
+        self._job_rows = {}
+        self._job_callbacks = {}
+        self._batch = []
         self._build_ui()
         self._refresh_file_list()
+        self._poll_catalog()
+        self._pump_jobs()
+        self._rates = RateMeter("bytes.up", "bytes.down", "aes.bytes")
+        self._show_rates()
 
     # ── layout ────────────────────────────────────────────────────────────────
     def _build_ui(self):
@@ -69,6 +93,11 @@ class CipherVaultApp(tk.Tk):
                                    font=FONT_SMALL, fg=ACCENT, bg=PANEL)
         self.status_lbl.pack(side="right", padx=20)
 
+        # live throughput, sampled from the metrics counters
+        self.rate_var = tk.StringVar()
+        tk.Label(hdr, textvariable=self.rate_var, font=FONT_SMALL,
+                 fg=MUTED, bg=PANEL).pack(side="right")
+
         # ── body split ────────────────────────────────────────────────────────
         body = tk.Frame(self, bg=BG)
         body.pack(fill="both", expand=True, padx=20, pady=16)
@@ -124,6 +153,15 @@ class CipherVaultApp(tk.Tk):
         toggle_btn.pack(anchor="e", padx=18)
         toggle_btn.bind("<Button-1>", lambda e: toggle_pw())
 
+        # compression: already-compressed files are stored as they are
+        self.compress_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(left, text="Compress before encrypting",
+                       variable=self.compress_var, font=FONT_SMALL,
+                       fg=MUTED, bg=CARD, activebackground=CARD,
+                       activeforeground=TEXT, selectcolor=BORDER,
+                       highlightthickness=0, bd=0,
+                       anchor="w").pack(fill="x", padx=14, pady=(4, 0))
+
         _divider(left)
 
         # ── action buttons ────────────────────────────────────────────────────
@@ -153,11 +191,25 @@ class CipherVaultApp(tk.Tk):
                  font=("Courier New", 8), fg=MUTED, bg=CARD,
                  wraplength=200, justify="left").pack(anchor="w", padx=18, pady=(4, 14))
 
+        _divider(left)
+
+        # ── transfer queue ────────────────────────────────────────────────────
+        jrow = tk.Frame(left, bg=CARD)
+        jrow.pack(fill="x", padx=18, pady=(12, 4))
+        tk.Label(jrow, text="TRANSFERS", font=FONT_SMALL, fg=ACCENT,
+                 bg=CARD).pack(side="left")
+        _btn(jrow, "cancel all", self.jobs.cancel_all,
+             bg=BORDER, fg=MUTED).pack(side="right")
+        self.jobs_frame = tk.Frame(left, bg=CARD)
+        self.jobs_frame.pack(fill="x", padx=18)
+        self.jobs_more = tk.Label(left, font=FONT_SMALL, fg=MUTED, bg=CARD)
+        self.jobs_more.pack(anchor="w", padx=18, pady=(2, 14))
+
     def _build_right(self, parent):
         right = tk.Frame(parent, bg=CARD, bd=0,
                          highlightthickness=1, highlightbackground=BORDER)
         right.grid(row=0, column=1, sticky="nsew")
-        right.rowconfigure(1, weight=1)
+        right.rowconfigure(3, weight=1)
         right.columnconfigure(0, weight=1)
 
         # header row
@@ -170,40 +222,51 @@ class CipherVaultApp(tk.Tk):
 
         _divider(right, row=True)
 
+        # ── search ────────────────────────────────────────────────────────────
+        srow = tk.Frame(right, bg=CARD)
+        srow.grid(row=2, column=0, sticky="ew", padx=18, pady=(8, 0))
+        tk.Label(srow, text="⌕", font=FONT_BODY, fg=MUTED,
+                 bg=CARD).pack(side="left", padx=(0, 6))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *a: self._schedule_search())
+        tk.Entry(srow, textvariable=self.search_var, font=FONT_SMALL,
+                 bg=BORDER, fg=TEXT, insertbackground=ACCENT,
+                 relief="flat", highlightthickness=1,
+                 highlightcolor=ACCENT,
+                 highlightbackground=BORDER).pack(side="left", fill="x",
+                                                  expand=True, ipady=4)
+        self.count_var = tk.StringVar()
+        tk.Label(srow, textvariable=self.count_var, font=FONT_SMALL,
+                 fg=MUTED, bg=CARD).pack(side="right", padx=(8, 0))
+
         # ── file list ─────────────────────────────────────────────────────────
-        list_frame = tk.Frame(right, bg=CARD)
-        list_frame.grid(row=1, column=0, sticky="nsew", padx=18, pady=8)
-        list_frame.rowconfigure(0, weight=1)
-        list_frame.columnconfigure(0, weight=1)
-
-        # scrollable canvas
-        canvas = tk.Canvas(list_frame, bg=CARD, highlightthickness=0)
-        scrollbar = tk.Scrollbar(list_frame, orient="vertical",
-                                 command=canvas.yview)
-        self.file_inner = tk.Frame(canvas, bg=CARD)
-        self.file_inner.bind("<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.create_window((0, 0), window=self.file_inner, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        canvas.grid(row=0, column=0, sticky="nsew")
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        self.file_list = VirtualFileList(right, self._select_entry,
+                                         self._delete_entry)
+        self.file_list.grid(row=3, column=0, sticky="nsew", padx=18, pady=8)
 
         # ── log console ───────────────────────────────────────────────────────
         tk.Label(right, text="ACTIVITY LOG", font=FONT_SMALL,
-                 fg=ACCENT, bg=CARD).grid(row=2, column=0, sticky="w",
+                 fg=ACCENT, bg=CARD).grid(row=4, column=0, sticky="w",
                                           padx=18, pady=(8, 2))
         self.log = tk.Text(right, height=6, bg="#0a0c10", fg=ACCENT,
                            font=FONT_SMALL, relief="flat",
                            insertbackground=ACCENT, state="disabled",
                            wrap="word")
-        self.log.grid(row=3, column=0, sticky="ew", padx=18, pady=(0, 18))
+        self.log.grid(row=5, column=0, sticky="ew", padx=18, pady=(0, 18))
 
     # ── helpers ───────────────────────────────────────────────────────────────
+    def _on_close(self):
+        self.jobs.shutdown()
+        self.key_cache.clear()
+        self.catalog.close()
+        self.destroy()
+
     def _browse_file(self):
-        path = filedialog.askopenfilename()
-        if path:
-            self.selected_file = path
-            self.file_var.set(os.path.basename(path))
+        paths = filedialog.askopenfilenames()
+        if paths:
+            self.selected_files = list(paths)
+            self.file_var.set(os.path.basename(paths[0]) if len(paths) == 1
+                              else f"{len(paths)} files selected")
 
     def _log(self, msg, color=TEXT):
         self.log.config(state="normal")
@@ -216,63 +279,66 @@ class CipherVaultApp(tk.Tk):
         self.status_lbl.config(fg=color)
 
     def _refresh_file_list(self):
-        self.vault = load_vault()
-        for w in self.file_inner.winfo_children():
-            w.destroy()
-
-        if not self.vault:
-            tk.Label(self.file_inner,
-                     text="No encrypted files yet.\nUpload your first file →",
-                     font=FONT_SMALL, fg=MUTED, bg=CARD,
-                     justify="center").pack(pady=40)
-            return
-
-        for name, fid in self.vault.items():
-            self._file_card(name, fid)
-
-    def _file_card(self, name, fid):
-        card = tk.Frame(self.file_inner, bg=PANEL,
-                        highlightthickness=1, highlightbackground=BORDER)
-        card.pack(fill="x", pady=4)
-
-        # icon + name
-        left = tk.Frame(card, bg=PANEL)
-        left.pack(side="left", fill="x", expand=True, padx=12, pady=10)
-
-        ext = os.path.splitext(name)[1].upper().lstrip(".") or "FILE"
-        icon_bg = ACCENT if ext in ("TXT","PDF","DOCX") else ACCENT2
-        tk.Label(left, text=ext, font=("Courier New", 8, "bold"),
-                 fg=BG, bg=icon_bg, width=5).pack(side="left", padx=(0, 10))
-
-        info = tk.Frame(left, bg=PANEL)
-        info.pack(side="left")
-        tk.Label(info, text=name, font=FONT_MONO,
-                 fg=TEXT, bg=PANEL).pack(anchor="w")
-        tk.Label(info, text=f"id: {fid[:28]}…", font=FONT_SMALL,
-                 fg=MUTED, bg=PANEL).pack(anchor="w")
-
-        # select button
-        def select(f=fid, n=name):
-            self.fid_var.set(f)
-            self._log(f"▸ selected: {n}")
-            self._set_status(f"● {n} selected")
-        _btn(card, "Select", select,
-             bg=BORDER, fg=MUTED).pack(side="right", padx=10, pady=10)
-
-        # delete button
-        def delete(n=name):
-            if messagebox.askyesno("Remove", f"Remove '{n}' from vault index?\n(File stays on Drive)"):
-                self.vault.pop(n, None)
-                save_vault(self.vault)
-                self._refresh_file_list()
-                self._log(f"✕ removed from index: {n}", DANGER)
-        _btn(card, "✕", delete,
-             bg=PANEL, fg=DANGER).pack(side="right", pady=10)
+        # brings the list in line with the catalog, touching only the rows
+        # that were added, changed or removed since the last sync
+        self._catalog_version = self.catalog.data_version()
+        versions = self.catalog.versions()
+        known = self.file_list.versions()
+        removed = known.keys() - versions.keys()
+        changed = [i for i, v in versions.items() if known.get(i) != v]
+        if not known:
+            self.file_list.apply_diff(self.catalog.files())
+            self._apply_search()
+        elif removed or changed:
+            self.file_list.apply_diff(self.catalog.rows(changed), removed)
+            self._apply_search()
+
+    def _poll_catalog(self):
+        # picks up uploads recorded by other processes, e.g. the CLI
+        if self.catalog.data_version() != self._catalog_version:
+            self._refresh_file_list()
+        self.after(CATALOG_POLL_MS, self._poll_catalog)
+
+    def _schedule_search(self):
+        if self._search_job:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DELAY_MS, self._apply_search)
+
+    def _apply_search(self):
+        self._search_job = None
+        text = self.search_var.get().strip()
+        rewind = text != self._search_text
+        self._search_text = text
+        self.file_list.filter(self.catalog.search(text) if text else None,
+                              rewind)
+        shown, total = self.file_list.counts()
+        self.count_var.set(f"{shown:,} of {total:,}" if text else f"{total:,} files")
+
+    def _select_entry(self, entry):
+        # "Select" toggles, so several files can be downloaded in one go
+        picked = self.file_list.toggle(entry["id"])
+        chosen = self.file_list.selected_entries()
+        self.fid_var.set(chosen[0]["drive_id"] if len(chosen) == 1 else "")
+        self._log(f"▸ {'selected' if picked else 'deselected'}: {entry['name']}")
+        if len(chosen) > 1:
+            self._set_status(f"● {len(chosen)} files selected")
+        elif chosen:
+            self._set_status(f"● {chosen[0]['name']} selected")
+        else:
+            self._set_status("● ready")
+
+    def _delete_entry(self, entry):
+        name = entry["name"]
+        if messagebox.askyesno("Remove", f"Remove '{name}' from vault index?\n(File stays on Drive)"):
+            self.catalog.remove(entry["drive_id"])
+            self.file_list.apply_diff(removed=[entry["id"]])
+            self._apply_search()
+            self._log(f"✕ removed from index: {name}", DANGER)
 
     # ── operations ────────────────────────────────────────────────────────────
     def _do_encrypt_upload(self):
-        path = getattr(self, "selected_file", None)
-        if not path:
+        paths = getattr(self, "selected_files", None)
+        if not paths:
             messagebox.showwarning("No file", "Please select a file first.")
             return
         pw = self.pw_var.get()
@@ -280,36 +346,23 @@ class CipherVaultApp(tk.Tk):
             messagebox.showwarning("No password", "Please enter a password.")
             return
 
-        def run():
-            try:
-                self._set_status("● encrypting…", ACCENT)
-                self._log(f"▸ encrypting: {os.path.basename(path)}")
-                from crypto_engine import encrypt_file
-                from drive_manager import upload_file
-                tmp = "temp_upload.cvault"
-                encrypt_file(path, tmp, pw)
-                self._log("▸ uploading to Google Drive…")
-                self._set_status("● uploading…", ACCENT2)
-                fid = upload_file(tmp)
-                os.remove(tmp)
-                name = os.path.basename(path)
-                self.vault[name] = fid
-                save_vault(self.vault)
-                self._refresh_file_list()
-                self._log(f"✔ done! id: {fid}", SUCCESS)
-                self._set_status("● upload complete", SUCCESS)
-                messagebox.showinfo("Success",
-                    f"'{name}' encrypted and uploaded!\n\nFile ID:\n{fid}")
-            except Exception as e:
-                self._log(f"✖ error: {e}", DANGER)
-                self._set_status("● error", DANGER)
-                messagebox.showerror("Error", str(e))
-
-        threading.Thread(target=run, daemon=True).start()
+        compress = "auto" if self.compress_var.get() else None
+        if _use_async(paths):
+            job = self.jobs.submit(f"upload {len(paths)} files",
+                                   self._upload_many_job(paths, pw, compress))
+            self._job_callbacks[job.id] = self._transfers_done
+            self._log(f"▸ queued {len(paths)} uploads (async engine)")
+            return
+        for path in paths:
+            job = self.jobs.submit(f"upload {os.path.basename(path)}",
+                                   self._upload_job(path, pw, compress))
+            self._job_callbacks[job.id] = self._upload_done
+        self._log(f"▸ queued {len(paths)} upload(s)")
 
     def _do_download_decrypt(self):
+        chosen = self.file_list.selected_entries()
         fid = self.fid_var.get().strip()
-        if not fid:
+        if len(chosen) < 2 and not fid:
             messagebox.showwarning("No File ID",
                 "Select a file from the list or paste a File ID.")
             return
@@ -317,35 +370,417 @@ class CipherVaultApp(tk.Tk):
         if not pw:
             messagebox.showwarning("No password", "Please enter a password.")
             return
-        save_path = filedialog.asksaveasfilename(
-            title="Save decrypted file as…",
-            defaultextension="",
-            filetypes=[("All files", "*.*")])
-        if not save_path:
-            return
 
-        def run():
+        if len(chosen) > 1:
+            folder = filedialog.askdirectory(title="Save decrypted files to…")
+            if not folder:
+                return
+            taken = set()
+            targets = [(e["drive_id"], _unique_path(folder, e["name"], taken))
+                       for e in chosen]
+        else:
+            save_path = filedialog.asksaveasfilename(
+                title="Save decrypted file as…",
+                defaultextension="",
+                filetypes=[("All files", "*.*")])
+            if not save_path:
+                return
+            targets = [(fid, save_path)]
+
+        if _use_async(targets):
+            job = self.jobs.submit(f"download {len(targets)} files",
+                                   self._download_many_job(targets, folder, pw))
+            self._job_callbacks[job.id] = self._transfers_done
+            self._log(f"▸ queued {len(targets)} downloads (async engine)")
+            return
+        for fid, save_path in targets:
+            job = self.jobs.submit(f"download {os.path.basename(save_path)}",
+                                   self._download_job(fid, save_path, pw))
+            self._job_callbacks[job.id] = (
+                lambda path: f"File decrypted and saved to:\n{path}")
+        self._log(f"▸ queued {len(targets)} download(s)")
+
+    # ── jobs (run on worker threads: no Tk calls in here) ─────────────────────
+    def _upload_job(self, path, pw, compress=None):
+        def run(job):
+            from crypto_engine import encrypt_file
+            from drive_manager import get_client
+            from catalog import CONTAINER_FORMAT
+            client = get_client()
+            name = os.path.basename(path)
+            # each job stages its ciphertext in a temp file of its own
+            fd, tmp = tempfile.mkstemp(prefix="cvault-", suffix=".cvault")
+            os.close(fd)
             try:
-                self._set_status("● downloading…", ACCENT2)
-                self._log(f"▸ downloading id: {fid[:28]}…")
-                from drive_manager import download_file
-                from crypto_engine import decrypt_file
-                tmp = "temp_download.cvault"
-                download_file(fid, tmp)
-                self._log("▸ decrypting…")
-                self._set_status("● decrypting…", ACCENT)
-                decrypt_file(tmp, save_path, pw)
+                job.progress(0, os.path.getsize(path), "encrypting")
+                stats = encrypt_file(path, tmp, pw, key_cache=self.key_cache,
+                                     progress=job.progress, compress=compress)
+                job.progress(0, os.path.getsize(tmp), "uploading")
+                fid = client.upload_file(tmp, name, progress=job.progress)
+            finally:
+                # nothing can resume from a random temp name later
+                client.journal.remove(client.journal.key(tmp))
                 os.remove(tmp)
-                self._log(f"✔ saved: {os.path.basename(save_path)}", SUCCESS)
-                self._set_status("● decrypt complete", SUCCESS)
-                messagebox.showinfo("Success",
-                    f"File decrypted and saved to:\n{save_path}")
-            except Exception as e:
-                self._log(f"✖ error: {e}", DANGER)
-                self._set_status("● error", DANGER)
-                messagebox.showerror("Error", str(e))
-
-        threading.Thread(target=run, daemon=True).start()
+            self.catalog.add_local(name, fid, path, format=CONTAINER_FORMAT)
+            return self.catalog.get(fid), stats
+        return run
+
+    def _download_job(self, fid, save_path, pw):
+        def run(job):
+            from transfer import download_decrypt
+            from pack import download_member, is_member
+            entry = self.catalog.get(fid)
+            if is_member(entry):
+                # a small file inside a pack: one ranged read of its bytes
+                job.progress(0, entry["pack_length"], "downloading")
+                download_member(entry, save_path, pw, key_cache=self.key_cache)
+                job.progress(entry["pack_length"], entry["pack_length"])
+                return save_path
+            job.progress(0, None, "downloading")
+            download_decrypt(fid, save_path, pw, key_cache=self.key_cache,
+                             progress=lambda st: job.progress(
+                                 st.resumable_progress, st.total_size))
+            return save_path
+        return run
+
+    def _upload_many_job(self, paths, pw, compress=None):
+        # one job for the whole selection; its progress counts files
+        def run(job):
+            import async_transfer
+            job.progress(0, len(paths), "uploading")
+            done = iter(range(1, len(paths) + 1))
+            return async_transfer.upload_many(
+                [(p, os.path.basename(p)) for p in paths], pw,
+                key_cache=self.key_cache, catalog=self.catalog,
+                compress=compress,
+                on_result=lambda r: job.progress(next(done), len(paths)))
+        return run
+
+    def _download_many_job(self, targets, folder, pw):
+        def run(job):
+            import async_transfer
+            job.progress(0, len(targets), "downloading")
+            done = iter(range(1, len(targets) + 1))
+            return async_transfer.download_many(
+                [(fid, os.path.basename(p)) for fid, p in targets], folder, pw,
+                key_cache=self.key_cache, catalog=self.catalog,
+                on_result=lambda r: job.progress(next(done), len(targets)))
+        return run
+
+    # ── job results (Tk thread) ───────────────────────────────────────────────
+    def _transfers_done(self, results):
+        failed = [r for r in results if "error" in r]
+        for r in failed:
+            self._log(f"✖ {r['name']}: {r['error']}", DANGER)
+        self._refresh_file_list()
+        return (f"{len(results) - len(failed)} of {len(results)} files "
+                f"transferred" + (f", {len(failed)} failed" if failed else "."))
+
+    def _upload_done(self, result):
+        from batch import format_compression
+        entry, stats = result
+        self.file_list.apply_diff([entry])
+        self._apply_search()
+        message = (f"'{entry['name']}' encrypted and uploaded!"
+                   f"\n\nFile ID:\n{entry['drive_id']}")
+        if stats["codec"]:
+            saved = format_compression(stats["bytes"], stats["stored"],
+                                       stats["codec"])
+            self._log(f"  {entry['name']}: {saved}", MUTED)
+            message += f"\n\nCompression: {saved}"
+        return message
+
+    def _pump_jobs(self):
+        try:
+            while True:
+                job, state = self.jobs.events.get_nowait()
+                if state == RUNNING:
+                    self._log(f"▸ {job.label}…")
+                elif state in (DONE, FAILED, CANCELLED):
+                    self._job_finished(job, state)
+        except queue.Empty:
+            pass
+        self._render_jobs()
+        self.after(JOB_POLL_MS, self._pump_jobs)
+
+    def _job_finished(self, job, state):
+        on_done = self._job_callbacks.pop(job.id, None)
+        message = None
+        if state == DONE:
+            message = on_done(job.result) if on_done else None
+            self._log(f"✔ {job.label}", SUCCESS)
+        elif state == FAILED:
+            self._log(f"✖ {job.label}: {job.error}", DANGER)
+        else:
+            self._log(f"✕ cancelled: {job.label}", MUTED)
+        self._batch.append((job, state, message))
+        if not self.jobs.active():
+            self._batch_finished()
+
+    def _batch_finished(self):
+        # one dialog per burst of work, not one per file
+        batch, self._batch = self._batch, []
+        failed = [j for j, state, _ in batch if state == FAILED]
+        done = [m for _, state, m in batch if state == DONE]
+        self._set_status("● error" if failed else "● transfers complete",
+                         DANGER if failed else SUCCESS)
+        if len(batch) == 1:
+            if failed:
+                messagebox.showerror("Error", str(failed[0].error))
+            elif done:
+                messagebox.showinfo("Success", done[0])
+        elif batch:
+            cancelled = len(batch) - len(failed) - len(done)
+            summary = f"{len(done)} done, {len(failed)} failed, {cancelled} cancelled"
+            (messagebox.showerror if failed else messagebox.showinfo)(
+                "Transfers finished", summary)
+
+    def _show_rates(self):
+        up, down, crypto = (r / 1e6 for r in self._rates.sample())
+        self.rate_var.set(f"↑ {up:.1f} MB/s  ↓ {down:.1f} MB/s  "
+                          f"⚙ {crypto:.1f} MB/s")
+        self.after(RATE_POLL_MS, self._show_rates)
+
+    def _render_jobs(self):
+        active = self.jobs.active()
+        shown = active[:MAX_JOB_ROWS]
+        ids = {job.id for job in shown}
+        for job_id in list(self._job_rows):
+            if job_id not in ids:
+                self._job_rows.pop(job_id).frame.destroy()
+        for job in shown:
+            if job.id not in self._job_rows:
+                self._job_rows[job.id] = _JobRow(self.jobs_frame, job)
+            self._job_rows[job.id].show(job)
+        more = len(active) - len(shown)
+        self.jobs_more.config(text=f"+{more} more queued" if more > 0 else
+                              "" if active else "idle")
+        if active:
+            running = sum(job.state == RUNNING for job in active)
+            self._set_status(f"● {running} running, {len(active) - running} queued",
+                             ACCENT2)
+
+class _JobRow:
+    def __init__(self, parent, job):
+        self.frame = tk.Frame(parent, bg=CARD)
+        self.frame.pack(fill="x", pady=2)
+        top = tk.Frame(self.frame, bg=CARD)
+        top.pack(fill="x")
+        self.label = tk.Label(top, font=FONT_SMALL, fg=TEXT, bg=CARD,
+                              anchor="w")
+        self.label.pack(side="left", fill="x", expand=True)
+        _btn(top, "✕", job.cancel, bg=CARD, fg=DANGER).pack(side="right")
+        self.bar = ttk.Progressbar(self.frame, maximum=100, mode="determinate")
+        self.bar.pack(fill="x")
+
+    def show(self, job):
+        if job.cancelled:
+            detail = "cancelling…"
+        elif job.state == RUNNING:
+            detail = f"{job.phase} {job.fraction:.0%}"
+        else:
+            detail = "queued"
+        self.label.config(text=f"{job.label[:26]}  {detail}")
+        self.bar["value"] = job.fraction * 100
+
+def _use_async(items):
+    # big selections go through one asyncio job when aiohttp is installed
+    if len(items) < ASYNC_BATCH:
+        return False
+    import async_transfer
+    return async_transfer.available()
+
+def _unique_path(folder, name, taken):
+    # catalog entries may share a name; never let one overwrite another
+    base, ext = os.path.splitext(os.path.basename(name) or "file")
+    candidate, n = base + ext, 1
+    while candidate in taken or os.path.exists(os.path.join(folder, candidate)):
+        n += 1
+        candidate = f"{base} ({n}){ext}"
+    taken.add(candidate)
+    return os.path.join(folder, candidate)
+
+# ── virtualized file list ─────────────────────────────────────────────────────
+def _sort_key(entry):
+    return (-entry["created"], -entry["id"])     # newest first, as the catalog
+
+class _FileRow:
+    # one recycled row; show() points it at a different catalog entry
+    def __init__(self, canvas, on_select, on_delete):
+        self.entry = None
+        self.selected = False
+        self.frame = tk.Frame(canvas, bg=PANEL, highlightthickness=1,
+                              highlightbackground=BORDER)
+        self.window = canvas.create_window(0, 0, window=self.frame,
+                                           anchor="nw", height=ROW_HEIGHT - 8)
+
+        self.ext = tk.Label(self.frame, font=("Courier New", 8, "bold"),
+                            fg=BG, width=5)
+        self.ext.pack(side="left", padx=(12, 10))
+        info = tk.Frame(self.frame, bg=PANEL)
+        info.pack(side="left", fill="x", expand=True)
+        self.name = tk.Label(info, font=FONT_MONO, fg=TEXT, bg=PANEL, anchor="w")
+        self.name.pack(anchor="w", fill="x")
+        self.fid = tk.Label(info, font=FONT_SMALL, fg=MUTED, bg=PANEL, anchor="w")
+        self.fid.pack(anchor="w", fill="x")
+
+        _btn(self.frame, "Select", lambda: on_select(self.entry),
+             bg=BORDER, fg=MUTED).pack(side="right", padx=10)
+        _btn(self.frame, "✕", lambda: on_delete(self.entry),
+             bg=PANEL, fg=DANGER).pack(side="right")
+
+    def show(self, entry, selected=False):
+        if entry is self.entry and selected == self.selected:
+            return
+        self.entry = entry
+        self.selected = selected
+        self.frame.config(highlightbackground=ACCENT if selected else BORDER)
+        name = entry["name"]
+        ext = os.path.splitext(name)[1].upper().lstrip(".")[:5] or "FILE"
+        self.ext.config(text=ext,
+                        bg=ACCENT if ext in ("TXT", "PDF", "DOCX") else ACCENT2)
+        self.name.config(text=name)
+        self.fid.config(text=f"id: {entry['drive_id'][:28]}…")
+
+class VirtualFileList(tk.Frame):
+    # Only the rows in view exist as widgets. Scrolling moves the same few
+    # rows to new positions and rebinds them, so the cost of the list is
+    # independent of how many files the vault holds.
+    def __init__(self, parent, on_select, on_delete):
+        super().__init__(parent, bg=CARD)
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self._on_select = on_select
+        self._on_delete = on_delete
+        self._entries = []          # every catalog entry, newest first
+        self._keys = []             # _sort_key of each, for bisect
+        self._by_id = {}
+        self._shown = self._entries
+        self._rows = []
+        self._selected = set()      # row ids picked with "Select"
+
+        self.canvas = tk.Canvas(self, bg=CARD, highlightthickness=0,
+                                yscrollincrement=ROW_HEIGHT)
+        self.scrollbar = tk.Scrollbar(self, orient="vertical",
+                                      command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.canvas.bind("<Configure>", lambda e: self._layout())
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind(seq, self._on_wheel)
+
+        self.empty = tk.Label(self, font=FONT_SMALL, fg=MUTED, bg=CARD,
+                              justify="center")
+
+    # ── model ─────────────────────────────────────────────────────────────────
+    def versions(self):
+        return {i: e["updated"] for i, e in self._by_id.items()}
+
+    def counts(self):
+        return len(self._shown), len(self._entries)
+
+    def toggle(self, row_id):
+        # returns whether the row is now selected
+        if row_id in self._selected:
+            self._selected.discard(row_id)
+        elif row_id in self._by_id:
+            self._selected.add(row_id)
+        self._render()
+        return row_id in self._selected
+
+    def selected_entries(self):
+        return [e for e in self._entries if e["id"] in self._selected]
+
+    def apply_diff(self, changed=(), removed=()):
+        # applies a catalog diff: changed/new entries and removed row ids
+        for row_id in removed:
+            self._drop(row_id)
+        changed = [e for e in changed if e is not None]
+        if len(changed) > 64:
+            # bulk load: one sort beats thousands of list inserts
+            for entry in changed:
+                self._by_id[entry["id"]] = entry
+            self._entries[:] = sorted(self._by_id.values(), key=_sort_key)
+            self._keys[:] = [_sort_key(e) for e in self._entries]
+        else:
+            for entry in changed:
+                self._drop(entry["id"])
+                key = _sort_key(entry)
+                i = bisect_left(self._keys, key)
+                self._keys.insert(i, key)
+                self._entries.insert(i, entry)
+                self._by_id[entry["id"]] = entry
+        self._layout()
+
+    def _drop(self, row_id):
+        entry = self._by_id.pop(row_id, None)
+        if entry is None:
+            return
+        self._selected.discard(row_id)
+        i = bisect_left(self._keys, _sort_key(entry))
+        del self._keys[i], self._entries[i]
+        if self._shown is not self._entries:
+            self._shown = [e for e in self._shown if e["id"] != row_id]
+
+    def filter(self, matches, rewind=False):
+        # matches: catalog rows to show, or None for everything
+        if matches is None:
+            self._shown = self._entries
+        else:
+            self._shown = [self._by_id.get(m["id"], m) for m in matches]
+        if rewind:
+            self.canvas.yview_moveto(0)
+        self._layout()
+
+    # ── view ──────────────────────────────────────────────────────────────────
+    def _layout(self):
+        width = self.canvas.winfo_width()
+        self.canvas.configure(scrollregion=(0, 0, width,
+                                            len(self._shown) * ROW_HEIGHT))
+        for row in self._rows:
+            self.canvas.itemconfigure(row.window, width=width)
+        if self._shown:
+            self.empty.place_forget()
+        else:
+            self.empty.config(text="No encrypted files yet.\nUpload your first file →"
+                              if not self._entries else "No matching files.")
+            self.empty.place(relx=0.5, rely=0.3, anchor="center")
+        self._render()
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._render()
+
+    def _on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, "units")
+        else:
+            self.canvas.yview_scroll(1, "units")
+
+    def _render(self):
+        top = int(self.canvas.canvasy(0))
+        first = top // ROW_HEIGHT
+        visible = self.canvas.winfo_height() // ROW_HEIGHT + 2
+        while len(self._rows) < min(visible, len(self._shown)):
+            row = _FileRow(self.canvas, self._on_select, self._on_delete)
+            self.canvas.itemconfigure(row.window, width=self.canvas.winfo_width())
+            for w in (row.frame,) + tuple(row.frame.winfo_children()):
+                for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+                    w.bind(seq, self._on_wheel)
+            self._rows.append(row)
+        for slot, row in enumerate(self._rows):
+            # each slot owns every len(rows)-th index, so a row that stays
+            # in view keeps its widget while scrolling
+            i = first + (slot - first) % len(self._rows)
+            if i < len(self._shown):
+                entry = self._shown[i]
+                row.show(entry, entry["id"] in self._selected)
+                self.canvas.coords(row.window, 0, i * ROW_HEIGHT + 4)
+                self.canvas.itemconfigure(row.window, state="normal")
+            else:
+                row.entry = None
+                self.canvas.itemconfigure(row.window, state="hidden")
 
 
 # ── widget helpers ────────────────────────────────────────────────────────────
@@ -0,0 +1,118 @@
+import itertools
+import queue
+import threading
+import time
+
+# Background jobs for the GUI. A fixed pool of worker threads takes jobs
+# off a queue in submission order. Workers never touch Tk: progress lives
+# in plain attributes on the Job, and every state change is posted to
+# `events` as (job, state), which the UI thread drains from its own loop
+# with after().
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = (
+    "queued", "running", "done", "failed", "cancelled")
+WORKERS = 2
+_STOP = object()
+
+class Cancelled(Exception):
+    pass
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, label, func):
+        self.id = next(Job._ids)
+        self.label = label
+        self.func = func            # func(job) runs on a worker thread
+        self.state = QUEUED
+        self.phase = ""
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.started = self.finished = None
+        self._cancel = threading.Event()
+
+    def progress(self, done, total=None, phase=None):
+        # fed from the crypto and Drive layers; raising here is how a
+        # cancel request reaches the code doing the work
+        self.check()
+        if phase is not None:
+            self.phase = phase
+        if total is not None:
+            self.total = total
+        self.done = done
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def fraction(self):
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+class JobScheduler:
+    def __init__(self, workers=WORKERS):
+        self._queue = queue.Queue()
+        self.events = queue.Queue()
+        self._lock = threading.Lock()
+        self._active = []           # queued and running, in order
+        self._threads = [threading.Thread(target=self._worker, daemon=True)
+                         for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, label, func):
+        job = Job(label, func)
+        with self._lock:
+            self._active.append(job)
+        self._queue.put(job)
+        self.events.put((job, QUEUED))
+        return job
+
+    def active(self):
+        with self._lock:
+            return list(self._active)
+
+    def cancel_all(self):
+        for job in self.active():
+            job.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        for _ in self._threads:
+            self._queue.put(_STOP)
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+        with self._lock:
+            self._active.remove(job)
+        self.events.put((job, state))
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            if job.cancelled:
+                self._finish(job, CANCELLED)
+                continue
+            job.state = RUNNING
+            job.started = time.time()
+            self.events.put((job, RUNNING))
+            try:
+                job.result = job.func(job)
+            except Cancelled:
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                self._finish(job, FAILED, e)
+            else:
+                self._finish(job, DONE)
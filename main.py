@@ -1,49 +1,339 @@
 import sys
 import os
 import getpass
-from crypto_engine import encrypt_file, decrypt_file
-from drive_manager import upload_file, download_file
+import time
+from crypto_engine import (encrypt_file, decrypt_file, KeyCache,
+                           calibrate_kdf, save_kdf_params, load_kdf_params,
+                           load_keyring, change_password, add_kek, retire_keks,
+                           set_keyring_mirror,
+                           CALIBRATE_TARGET, CALIBRATE_MEMORY, VAULT_KDF_FILE)
+from drive_manager import get_client, DriveKeyring
+from transfer import (download_decrypt, download_decrypt_range,
+                      parallel_download_decrypt)
+import batch
+import metrics
+from catalog import Catalog
+from compressor import MODES
+import dedup
+import pack
+import sync
+import async_transfer
+
+def _pop_option(args, name, default=None, cast=str):
+    # removes "--name value" from args and returns the value
+    if name not in args:
+        return default
+    i = args.index(name)
+    if i + 1 >= len(args):
+        raise SystemExit(f"Missing value for {name}")
+    value = args[i + 1]
+    del args[i:i + 2]
+    return cast(value)
+
+def _pop_flag(args, name):
+    if name not in args:
+        return False
+    args.remove(name)
+    return True
 
 def main():
-    if len(sys.argv) < 3:
+    args = sys.argv[1:]
+    jobs = _pop_option(args, "--jobs", os.cpu_count() or 1, int)
+    transfers = _pop_option(args, "--transfers", None, int)
+    chunk_mb = _pop_option(args, "--chunk-mb", None, int)
+    byte_range = _pop_option(args, "--range")
+    connections = _pop_option(args, "--connections", 1, int)
+    stats = _pop_flag(args, "--stats")
+    metrics_file = _pop_option(args, "--metrics-file")
+    metrics_port = _pop_option(args, "--metrics-port", None, int)
+    target_ms = _pop_option(args, "--target-ms", CALIBRATE_TARGET * 1000, float)
+    kdf_name = _pop_option(args, "--kdf")
+    max_memory_mb = _pop_option(args, "--max-memory-mb",
+                                CALIBRATE_MEMORY // 1024, int)
+    retire = _pop_flag(args, "--retire")
+    use_packs = _pop_flag(args, "--pack")
+    pack_mb = _pop_option(args, "--pack-mb", pack.PACK_SIZE // (1024 * 1024), int)
+    compress = _pop_option(args, "--compress")
+    watch = _pop_flag(args, "--watch")
+    versions = _pop_flag(args, "--versions")
+    interval = _pop_option(args, "--interval", sync.POLL_INTERVAL, float)
+    use_async = _pop_flag(args, "--async")
+    max_requests = _pop_option(args, "--requests", async_transfer.CONCURRENCY, int)
+    if transfers is None:
+        transfers = async_transfer.TRANSFERS if use_async else batch.TRANSFERS
+    if compress not in (None,) + MODES:
+        raise SystemExit(f"--compress must be one of: {', '.join(MODES)}")
+
+    if not args or (len(args) < 2
+                    and args[0] not in ("calibrate", "passwd", "rotate")):
         print("\nUsage:")
         print("  Encrypt only:      python main.py encrypt input_file output_file")
         print("  Decrypt only:      python main.py decrypt input_file output_file")
         print("  Encrypt + Upload:  python main.py encrypt_upload input_file")
         print("  Download + Decrypt:python main.py download_decrypt file_id output_file")
+        print("  Batch upload:      python main.py encrypt_upload_dir dir_or_manifest [manifest_out]")
+        print("  Batch download:    python main.py download_decrypt_many manifest output_dir")
+        print("  Sync a directory:  python main.py sync dir [--watch] [--versions]")
+        print("  Dedup backup:      python main.py backup input_file")
+        print("  Dedup restore:     python main.py restore manifest_id output_file")
+        print("  Tune KDF:          python main.py calibrate")
+        print("  Re-key files:      python main.py rekey file_or_dir [...]")
+        print("  Change password:   python main.py passwd")
+        print("  Rotate vault key:  python main.py rotate [--retire]")
+        print("\nOptions:")
+        print("  --jobs N           worker threads for encryption (default: all cores)")
+        print(f"  --transfers N      concurrent Drive transfers in batch modes (default: {batch.TRANSFERS}, {async_transfer.TRANSFERS} with --async)")
+        print("  --async            batch modes: asyncio engine, for many small files")
+        print(f"  --requests N       --async: Drive requests in flight (default: {max_requests})")
+        print("  --chunk-mb N       upload/download chunk size in MiB (default: 8)")
+        print("  --range OFF:LEN    download_decrypt only these plaintext bytes")
+        print("  --connections N    download_decrypt over N parallel ranged connections")
+        print("  --stats            print per-stage timings, bytes and retries at the end")
+        print("  --metrics-file F   append every stage timing to F as JSON lines")
+        print("  --metrics-port N   serve Prometheus metrics on 127.0.0.1:N while running")
+        print(f"  --target-ms N      calibrate: unlock time to aim for (default: {target_ms:.0f})")
+        print("  --kdf NAME         calibrate: argon2id, scrypt or pbkdf2-sha256")
+        print(f"  --max-memory-mb N  calibrate: memory ceiling (default: {max_memory_mb})")
+        print("  --retire           rotate: drop the old vault keys once every object is moved")
+        print(f"  --pack             encrypt_upload_dir: bundle files under {pack.SMALL_FILE // 1024} KiB into packs")
+        print(f"  --pack-mb N        size of each pack (default: {pack_mb})")
+        print("  --compress MODE    compress before encrypting: auto, zlib, zstd or none")
+        print("  --watch            sync: keep running and sync changes as they happen")
+        print("  --versions         sync: keep replaced files on Drive as older versions")
+        print(f"  --interval N       sync --watch without inotify: seconds between rescans (default: {interval:.0f})")
         return
 
-    mode = sys.argv[1]
+    mode = args[0]
+    if mode == "calibrate":
+        # no password needed: only measures this machine
+        print("Calibrating…")
+        params = calibrate_kdf(target_ms / 1000, kdf_name, max_memory_mb * 1024)
+        save_kdf_params(params)
+        print(f"KDF parameters saved to {VAULT_KDF_FILE}: {params}")
+        print("New files use them; run 'rekey' to move existing ones over.")
+        return
+    sinks = []
+    if metrics_file:
+        sinks.append(metrics.JsonLinesSink(metrics_file))
+        metrics.REGISTRY.add_sink(sinks[-1])
+    if metrics_port:
+        sinks.append(metrics.PrometheusExporter(metrics_port))
+        print(f"Metrics at {sinks[-1].url}")
     password = getpass.getpass("Enter password: ")
+    key_cache = KeyCache()
+    # a copy of the sealed keyring on Drive: the password alone recovers
+    # the vault if vault_key.json is lost
+    set_keyring_mirror(DriveKeyring())
+    catalog = Catalog()
+    if chunk_mb:
+        get_client().chunk_size = chunk_mb * 1024 * 1024
+        get_client().download_chunk_size = chunk_mb * 1024 * 1024
 
     try:
         if mode == "encrypt":
-            encrypt_file(sys.argv[2], sys.argv[3], password)
+            # standalone container, outside the vault: it carries its own
+            # salt and opens with the password alone, no keyring needed
+            result = encrypt_file(args[1], args[2], password, workers=jobs,
+                                  compress=compress)
             print("Encryption successful.")
+            if result["codec"]:
+                print("Compression: " + batch.format_compression(
+                    result["bytes"], result["stored"], result["codec"]))
 
         elif mode == "decrypt":
-            decrypt_file(sys.argv[2], sys.argv[3], password)
+            decrypt_file(args[1], args[2], password, workers=jobs,
+                         key_cache=key_cache)
             print("Decryption successful.")
 
         elif mode == "encrypt_upload":
-            temp = "temp_encrypted.cvault"
-            encrypt_file(sys.argv[2], temp, password)
-            file_id = upload_file(temp)
-            os.remove(temp)
-            print(f"Done! Save this File ID: {file_id}")
+            # goes through the batch pipeline so an interrupted upload
+            # resumes on the next run instead of starting over
+            if not os.path.isfile(args[1]):
+                raise FileNotFoundError("Input file does not exist.")
+            [result] = batch.encrypt_upload_many(
+                [(args[1], os.path.basename(args[1]))], password, jobs=jobs,
+                key_cache=key_cache, catalog=catalog, compress=compress)
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            if result.get("resumed"):
+                print("Resumed interrupted upload.")
+            if result.get("codec"):
+                print("Compression: " + batch.format_compression(
+                    result["bytes"], result["stored"], result["codec"]))
+            print(f"Done! Save this File ID: {result['file_id']}")
 
         elif mode == "download_decrypt":
-            temp = "temp_download.cvault"
-            download_file(sys.argv[2], temp)
-            decrypt_file(temp, sys.argv[3], password)
-            os.remove(temp)
+            if "#" in args[1]:
+                # "<pack id>#<n>": a small file inside a pack
+                [r] = batch.download_members(
+                    [(args[1], os.path.basename(args[2]))],
+                    os.path.dirname(os.path.abspath(args[2])), password,
+                    key_cache=key_cache, catalog=catalog)
+                if "error" in r:
+                    raise RuntimeError(r["error"])
+            elif byte_range:
+                start, length = (int(v) for v in byte_range.split(":"))
+                data = download_decrypt_range(args[1], start, length, password,
+                                              key_cache=key_cache)
+                with open(args[2], "wb") as f:
+                    f.write(data)
+            elif connections > 1:
+                parallel_download_decrypt(args[1], args[2], password,
+                                          connections=connections,
+                                          key_cache=key_cache)
+            else:
+                download_decrypt(args[1], args[2], password,
+                                 key_cache=key_cache)
             print("Download and decryption successful.")
 
+        elif mode == "encrypt_upload_dir":
+            start = time.perf_counter()
+            files = batch.collect_files(args[1])
+            results = []
+            if use_packs:
+                # small files ride in packs; the rest go up one by one
+                packs, files = pack.plan(files, pack_mb * 1024 * 1024)
+                results += batch.encrypt_upload_packs(
+                    packs, password, jobs=jobs, key_cache=key_cache,
+                    transfers=transfers, catalog=catalog,
+                    on_result=lambda r: print(batch.format_result(r)))
+            if use_async:
+                results += async_transfer.upload_many(
+                    files, password, key_cache=key_cache, catalog=catalog,
+                    compress=compress, transfers=transfers,
+                    client=async_transfer.AsyncDriveClient(
+                        concurrency=max_requests),
+                    on_result=lambda r: print(batch.format_result(r)))
+            else:
+                results += batch.encrypt_upload_many(
+                    files, password, jobs=jobs, compress=compress,
+                    key_cache=key_cache, transfers=transfers, catalog=catalog,
+                    on_result=lambda r: print(batch.format_result(r)))
+            print(batch.summarize(results, time.perf_counter() - start))
+            if len(args) > 2:
+                batch.write_upload_manifest(args[2], results)
+                print(f"Manifest written to {args[2]}")
+
+        elif mode == "download_decrypt_many":
+            start = time.perf_counter()
+            entries = batch.read_download_manifest(args[1])
+            if use_async:
+                results = async_transfer.download_many(
+                    entries, args[2], password, key_cache=key_cache,
+                    transfers=transfers, catalog=catalog,
+                    client=async_transfer.AsyncDriveClient(
+                        concurrency=max_requests),
+                    on_result=lambda r: print(batch.format_result(r)))
+            else:
+                results = batch.download_decrypt_many(
+                    entries, args[2], password,
+                    key_cache=key_cache, transfers=transfers, catalog=catalog,
+                    on_result=lambda r: print(batch.format_result(r)))
+            print(batch.summarize(results, time.perf_counter() - start))
+
+        elif mode == "sync":
+            if not os.path.isdir(args[1]):
+                raise NotADirectoryError(f"{args[1]} is not a directory.")
+
+            def report(r):
+                print(batch.format_result(r)
+                      + (f"  ({r['warning']})" if r.get("warning") else ""))
+
+            def run(paths=None):
+                summary = sync.sync_tree(
+                    args[1], password, key_cache=key_cache, catalog=catalog,
+                    versions=versions, compress=compress, jobs=jobs,
+                    transfers=transfers, paths=paths, on_result=report)
+                print(sync.format_summary(summary))
+
+            run()
+            if watch:
+                print(f"Watching {args[1]} (Ctrl-C to stop)…")
+                sync.watch(args[1], run, interval=interval)
+
+        elif mode == "backup":
+            backup = dedup.backup_file(args[1], password, key_cache=key_cache,
+                                       catalog=catalog, transfers=transfers)
+            print(f"Chunks:     {backup['chunks']} total, {backup['new_chunks']} new")
+            print(f"Uploaded:   {backup['uploaded_bytes']:,} of {backup['bytes']:,} B "
+                  f"in {backup['seconds']:.2f}s")
+            print(f"Done! Save this Manifest ID: {backup['manifest_id']}")
+
+        elif mode == "restore":
+            dedup.restore_file(args[1], args[2], password, key_cache=key_cache,
+                               transfers=transfers)
+            print("Restore successful.")
+
+        elif mode == "rekey":
+            params = load_kdf_params()
+            print(f"Re-keying to {params}")
+            ring = load_keyring()
+            if ring is not None and ring["kdf"] != params:
+                change_password(password, password, params, key_cache)
+                print("Vault keyring re-sealed.")
+            results = []
+            for source in args[1:]:
+                files = (batch.collect_files(source) if os.path.isdir(source)
+                         else [(source, source)])
+                results += batch.rekey_many(files, password, params,
+                                            key_cache=key_cache)
+            for r in results:
+                if "error" in r:
+                    print(f"  ✖ {r['name']}: {r['error']}")
+                elif r.get("rekeyed"):
+                    print(f"  ✔ {r['name']}")
+            done = sum(1 for r in results if r.get("rekeyed"))
+            failed = sum(1 for r in results if "error" in r)
+            print(f"Re-keyed {done}, already current "
+                  f"{sum(1 for r in results if r.get('rekeyed') is False)}, "
+                  f"failed {failed}")
+
+        elif mode == "passwd":
+            new_password = getpass.getpass("New password: ")
+            if new_password != getpass.getpass("Repeat new password: "):
+                raise ValueError("Passwords don't match.")
+            change_password(password, new_password, key_cache=key_cache)
+            print("Password changed. Files keep their keys; only the vault "
+                  "keyring was rewritten.")
+
+        elif mode == "rotate":
+            kek_id = add_kek(password, key_cache)
+            print(f"New vault key {kek_id}; re-wrapping file keys on Drive…")
+
+            def report(r):
+                if "error" in r:
+                    print(f"  ✖ {r['name']}: {r['error']}")
+
+            start = time.perf_counter()
+            results = batch.rewrap_many(
+                [(row["drive_id"], row["name"]) for row in catalog.files()
+                 if not row["pack"]]
+                + [(row["drive_id"], row["name"]) for row in catalog.packs()],
+                password, key_cache=key_cache, transfers=transfers,
+                on_result=report)
+            done = sum(1 for r in results if r.get("rewrapped"))
+            failed = sum(1 for r in results if "error" in r)
+            print(f"Re-wrapped {done}, skipped {len(results) - done - failed}, "
+                  f"failed {failed} in {time.perf_counter() - start:.2f}s")
+            if retire and not failed:
+                print(f"Retired vault keys: {', '.join(retire_keks(password, key_cache))}")
+            elif retire:
+                print("Old vault keys kept: some objects still depend on them.")
+
         else:
             print("Invalid mode.")
 
     except Exception as e:
         print("Error:", str(e))
 
+    finally:
+        key_cache.clear()
+        catalog.close()
+        if stats:
+            print()
+            print(metrics.REGISTRY.summary())
+        for sink in sinks:
+            sink.close()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
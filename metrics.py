@@ -0,0 +1,230 @@
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Timings for every stage a transfer goes through (KDF, AES, disk, Drive),
+# so a slow run can be pinned on one of them. Stages are recorded into the
+# process-wide REGISTRY, which keeps histograms and counters in memory and
+# forwards each observation to any attached sinks.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 300)
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)   # MB/s
+SAMPLES = 1024          # recent durations kept per stage for percentiles
+PROMETHEUS_PORT = 9464
+
+def _mbps(nbytes, seconds):
+    return nbytes / 1e6 / seconds if seconds > 0 else 0.0
+
+class _Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)    # last bucket is +Inf
+        self.sum = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class _Stage:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.throughput = _Histogram(THROUGHPUT_BUCKETS)
+        self.recent = deque(maxlen=SAMPLES)
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._sinks = []
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self._sinks.remove(sink)
+
+    def observe(self, stage, seconds, nbytes=0, ok=True):
+        with self._lock:
+            s = self._stages.setdefault(stage, _Stage())
+            s.count += 1
+            s.errors += not ok
+            s.seconds += seconds
+            s.bytes += nbytes
+            s.latency.add(seconds)
+            s.recent.append(seconds)
+            if nbytes:
+                s.throughput.add(_mbps(nbytes, seconds))
+        event = {"ts": time.time(), "stage": stage, "seconds": seconds,
+                 "bytes": nbytes, "ok": ok}
+        for sink in self._sinks:
+            sink.emit(event)
+
+    def count(self, name, value=1):
+        # plain counters: retries, live byte totals, ...
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for name, s in self._stages.items():
+                recent = sorted(s.recent)
+                stages[name] = {
+                    "count": s.count, "errors": s.errors,
+                    "seconds": s.seconds, "bytes": s.bytes,
+                    "mb_per_s": _mbps(s.bytes, s.seconds),
+                    "p50": recent[len(recent) // 2] if recent else 0.0,
+                    "p95": recent[int(len(recent) * 0.95)] if recent else 0.0,
+                }
+                for key, hist in (("latency", s.latency),
+                                  ("throughput", s.throughput)):
+                    stages[name][key] = list(zip(hist.bounds + (float("inf"),),
+                                                 hist.counts))
+                    stages[name][key + "_sum"] = hist.sum
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def prometheus(self):
+        snap = self.snapshot()
+        lines = []
+        for name, family in (("latency", "cvault_stage_seconds"),
+                             ("throughput", "cvault_stage_throughput_mbps")):
+            lines.append(f"# TYPE {family} histogram")
+            for stage, s in sorted(snap["stages"].items()):
+                total = 0
+                for bound, n in s[name]:
+                    total += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{family}_bucket{{stage="{stage}",le="{le}"}} {total}')
+                lines.append(f'{family}_sum{{stage="{stage}"}} {s[name + "_sum"]}')
+                lines.append(f'{family}_count{{stage="{stage}"}} {total}')
+        for metric, key in (("cvault_stage_bytes_total", "bytes"),
+                            ("cvault_stage_errors_total", "errors")):
+            lines.append(f"# TYPE {metric} counter")
+            for stage, s in sorted(snap["stages"].items()):
+                lines.append(f'{metric}{{stage="{stage}"}} {s[key]}')
+        lines.append("# TYPE cvault_events_total counter")
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f'cvault_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        # human-readable table for --stats
+        snap = self.snapshot()
+        lines = [f"{'stage':<14}{'calls':>7}{'errors':>8}{'total s':>10}"
+                 f"{'p50 s':>9}{'p95 s':>9}{'bytes':>15}{'MB/s':>9}"]
+        for stage, s in sorted(snap["stages"].items()):
+            lines.append(f"{stage:<14}{s['count']:>7}{s['errors']:>8}"
+                         f"{s['seconds']:>10.3f}{s['p50']:>9.3f}{s['p95']:>9.3f}"
+                         f"{s['bytes']:>15,}{s['mb_per_s']:>9.1f}")
+        for name, value in sorted(snap["counters"].items()):
+            shown = f"{value:,.3f}" if isinstance(value, float) else f"{value:,}"
+            lines.append(f"{name:<14}{shown:>24}")
+        return "\n".join(lines)
+
+REGISTRY = Registry()
+
+class _Span:
+    def __init__(self):
+        self.bytes = 0
+
+@contextmanager
+def timed(stage, nbytes=0, registry=None):
+    # times the block; set span.bytes inside it once the size is known
+    span = _Span()
+    span.bytes = nbytes
+    ok = False
+    start = time.perf_counter()
+    try:
+        yield span
+        ok = True
+    finally:
+        (registry or REGISTRY).observe(stage, time.perf_counter() - start,
+                                       span.bytes, ok)
+
+def count(name, value=1):
+    REGISTRY.count(name, value)
+
+# ── sinks ─────────────────────────────────────────────────────────────────────
+class JsonLinesSink:
+    # appends one JSON object per observation
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._f = open(path, "a", encoding="utf-8")
+
+    def emit(self, event):
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+class PrometheusExporter:
+    # serves the registry in Prometheus text format on localhost only
+    def __init__(self, port=PROMETHEUS_PORT, registry=None):
+        registry = registry or REGISTRY
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class RateMeter:
+    # turns monotonically growing counters into live rates (bytes/s)
+    def __init__(self, *names, registry=None):
+        self.names = names
+        self.registry = registry or REGISTRY
+        self._last = None
+
+    def sample(self):
+        now = time.perf_counter()
+        values = [self.registry.counter(n) for n in self.names]
+        last, self._last = self._last, (now, values)
+        if last is None or now <= last[0]:
+            return [0.0] * len(values)
+        return [(v - p) / (now - last[0]) for v, p in zip(values, last[1])]
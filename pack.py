@@ -0,0 +1,170 @@
+import os
+import json
+import struct
+import hashlib
+from collections import defaultdict
+from catalog import MEMBER_FORMAT, PACK_FORMAT
+from transfer import open_ranged
+from drive_manager import get_client
+
+# Small files travel in packs: one CVLT2 object whose plaintext is the
+# members back to back, then a JSON index of their offsets, then the
+# index length (u64). Segments authenticate on their own, so one member
+# comes back with a ranged read of the header and of the segments it
+# spans; the catalog keeps the offsets so the index is rarely needed.
+PACK_SIZE = 32 * 1024 * 1024    # plaintext per pack before it is closed
+SMALL_FILE = 1024 * 1024        # files below this are packed
+MERGE_GAP = 1024 * 1024         # members closer than this share one read
+MAX_READ = 16 * 1024 * 1024
+_TRAILER = struct.Struct(">Q")
+
+def plan(files, pack_size=PACK_SIZE, small=SMALL_FILE):
+    # splits (path, name) pairs into (packs, large files); each pack is a
+    # list of (path, name) adding up to about pack_size
+    packs, large = [], []
+    current, size = [], 0
+    for path, name in files:
+        length = os.path.getsize(path)
+        if length >= small:
+            large.append((path, name))
+            continue
+        if current and size + length > pack_size:
+            packs.append(current)
+            current, size = [], 0
+        current.append((path, name))
+        size += length
+    if current:
+        packs.append(current)
+    return packs, large
+
+class PackReader:
+    # file-like view of a pack's plaintext for encrypt_stream: members
+    # are read one after another, then the index and trailer follow.
+    # Files that can't be opened are left out and listed in `errors`.
+    def __init__(self, files, progress=None):
+        self._files = iter(files)
+        self._current = None
+        self._tail = None
+        self._hash = None
+        self.members = []
+        self.errors = []
+        self.offset = 0
+        self.progress = progress
+
+    def _next_member(self):
+        for path, name in self._files:
+            try:
+                f = open(path, "rb")
+                st = os.fstat(f.fileno())
+            except OSError as e:
+                self.errors.append({"path": path, "name": name, "error": str(e)})
+                continue
+            self.members.append({"name": name, "path": path,
+                                 "offset": self.offset, "length": 0,
+                                 "mtime": st.st_mtime})
+            self._hash = hashlib.sha256()
+            return f
+        return None
+
+    def _finish_member(self):
+        self._current.close()
+        self._current = None
+        self.members[-1]["sha256"] = self._hash.hexdigest()
+        if self.progress:
+            self.progress(len(self.members))
+
+    def _index(self):
+        index = json.dumps({"format": PACK_FORMAT, "members": [
+            [m["name"], m["offset"], m["length"], m["sha256"], m["mtime"]]
+            for m in self.members]}).encode()
+        return index + _TRAILER.pack(len(index))
+
+    def read(self, size=-1):
+        parts = []
+        want = size if size >= 0 else float("inf")
+        while want > 0:
+            if self._tail is not None:
+                part = self._tail[:want] if want != float("inf") else self._tail
+                self._tail = self._tail[len(part):]
+                if not part:
+                    break
+            else:
+                if self._current is None:
+                    self._current = self._next_member()
+                    if self._current is None:
+                        self._tail = self._index()
+                        continue
+                part = self._current.read(min(want, 1024 * 1024))
+                if not part:
+                    self._finish_member()
+                    continue
+                self._hash.update(part)
+                self.members[-1]["length"] += len(part)
+                self.offset += len(part)
+            parts.append(part)
+            want -= len(part)
+        return b"".join(parts)
+
+# ── reading ───────────────────────────────────────────────────────────────────
+def read_index(pack_id, password, client=None, key_cache=None):
+    # the member list stored inside the pack itself, for when the local
+    # catalog doesn't have it
+    reader = open_ranged(pack_id, password, client, key_cache)
+    (length,) = _TRAILER.unpack(reader.read(reader.plain_size - _TRAILER.size,
+                                            _TRAILER.size))
+    index = json.loads(reader.read(reader.plain_size - _TRAILER.size - length,
+                                   length))
+    if index.get("format") != PACK_FORMAT:
+        raise ValueError("Not a CipherVault pack.")
+    return [{"name": name, "drive_id": f"{pack_id}#{i}", "pack": pack_id,
+             "pack_offset": offset, "pack_length": length, "sha256": sha256,
+             "mtime": mtime}
+            for i, (name, offset, length, sha256, mtime)
+            in enumerate(index["members"])]
+
+def _runs(members):
+    # groups members sorted by offset into spans read with one request
+    run = []
+    for m in sorted(members, key=lambda m: m["pack_offset"]):
+        if run:
+            start = run[0]["pack_offset"]
+            end = run[-1]["pack_offset"] + run[-1]["pack_length"]
+            if (m["pack_offset"] - end > MERGE_GAP
+                    or m["pack_offset"] + m["pack_length"] - start > MAX_READ):
+                yield run
+                run = []
+        run.append(m)
+    if run:
+        yield run
+
+def read_members(members, password, client=None, key_cache=None):
+    # members: catalog rows (or read_index entries); yields (member, data)
+    # with each pack's header fetched once and neighbouring members
+    # fetched together
+    client = client or get_client()
+    by_pack = defaultdict(list)
+    for m in members:
+        if not m.get("pack"):
+            raise ValueError(f"{m['name']} is not in a pack.")
+        by_pack[m["pack"]].append(m)
+    for pack_id, group in by_pack.items():
+        reader = open_ranged(pack_id, password, client, key_cache)
+        for run in _runs(group):
+            start = run[0]["pack_offset"]
+            end = run[-1]["pack_offset"] + run[-1]["pack_length"]
+            span = reader.read(start, end - start)
+            for m in run:
+                data = span[m["pack_offset"] - start:
+                            m["pack_offset"] - start + m["pack_length"]]
+                if (len(data) != m["pack_length"] or m.get("sha256") and
+                        hashlib.sha256(data).hexdigest() != m["sha256"]):
+                    raise ValueError(f"Pack member {m['name']} is damaged.")
+                yield m, data
+
+def download_member(member, output_path, password, client=None, key_cache=None):
+    [(_, data)] = read_members([member], password, client, key_cache)
+    with open(output_path, "wb") as f:
+        f.write(data)
+
+def is_member(entry):
+    return bool(entry and entry.get("format") == MEMBER_FORMAT)
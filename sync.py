@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from catalog import Catalog, file_digest
+from drive_manager import get_client
+import batch
+
+# `sync` mirrors a directory into the vault and skips what is already
+# there. The catalog's sync_state table holds size, mtime, inode and
+# SHA-256 of every file as last uploaded. A file whose size, mtime and
+# inode all still match is not opened at all. One whose size matches
+# but mtime or inode moved is hashed, and only a changed hash means
+# an upload. A run over a large, unchanged tree is a directory walk
+# plus one catalog query.
+SETTLE = 2.0            # watch: quiet seconds before changes are synced
+POLL_INTERVAL = 60.0    # watch without inotify: seconds between rescans
+
+def scan(root):
+    # yields (path, name relative to root, stat) for every file under
+    # root; unreadable directories are skipped, like os.walk does
+    stack = [root]
+    while stack:
+        top = stack.pop()
+        try:
+            with os.scandir(top) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path, os.path.relpath(entry.path, root), entry.stat()
+            except OSError:
+                continue
+
+def _state(path, name, st):
+    return {"path": os.path.abspath(path), "name": name, "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+
+def _candidates(root, paths):
+    # the whole tree, or just the given paths (files or directories)
+    if paths is None:
+        yield from scan(root)
+        return
+    for path in sorted(set(paths)):
+        if os.path.isdir(path):
+            for p, _, st in scan(path):
+                yield p, os.path.relpath(p, root), st
+        elif os.path.isfile(path):
+            yield path, os.path.relpath(path, root), os.stat(path)
+
+def sync_tree(root, password, key_cache=None, client=None, catalog=None,
+              versions=False, compress=None, jobs=1,
+              transfers=batch.TRANSFERS, paths=None, on_result=None):
+    # uploads new and changed files under root. A changed file's previous
+    # Drive object is deleted, unless `versions` keeps it (and its catalog
+    # row) as an older version. paths limits the run to those files or
+    # directories, as reported by watch().
+    client = client or get_client()
+    catalog = catalog if catalog is not None else Catalog()
+    start = time.perf_counter()
+    states = catalog.sync_states(root)
+    summary = {"scanned": 0, "unchanged": 0, "touched": 0, "uploaded": 0,
+               "replaced": 0, "failed": 0, "missing": 0, "results": []}
+    touched, changed, seen = [], {}, set()
+
+    for path, name, st in _candidates(root, paths):
+        summary["scanned"] += 1
+        cur = _state(path, name, st)
+        seen.add(cur["path"])
+        prev = states.get(cur["path"])
+        if prev and all(prev[k] == cur[k] for k in ("size", "mtime_ns", "inode")):
+            summary["unchanged"] += 1
+            continue
+        if prev and prev["size"] == cur["size"]:
+            # same size: only the content hash can tell
+            try:
+                sha256 = file_digest(path)
+            except OSError:
+                continue        # gone or unreadable since the scan
+            if sha256 == prev["sha256"]:
+                touched.append(dict(cur, sha256=sha256,
+                                    drive_id=prev["drive_id"]))
+                continue
+        changed[cur["path"]] = (cur, prev)
+
+    if touched:
+        catalog.set_sync_states(touched)
+        summary["touched"] = len(touched)
+    if paths is None:
+        # deleted locally: forget the sync state so the catalog doesn't
+        # grow with every file that ever passed through. The Drive copy
+        # and its catalog row stay. A path that still exists was only
+        # unreadable during the scan and keeps its state.
+        gone = [p for p in states.keys() - seen if not os.path.lexists(p)]
+        if gone:
+            catalog.remove_sync_states(gone)
+        summary["missing"] = len(gone)
+
+    def uploaded(r):
+        summary["results"].append(r)
+        cur, prev = changed[os.path.abspath(r["path"])]
+        if "error" in r:
+            summary["failed"] += 1
+        else:
+            # the stat from before the upload: a file edited meanwhile
+            # looks changed next time and is hashed again
+            catalog.set_sync_states([dict(cur, sha256=r["sha256"],
+                                          drive_id=r["file_id"])])
+            summary["uploaded"] += 1
+            if prev and not versions and prev["drive_id"] != r["file_id"]:
+                try:
+                    client.delete(prev["drive_id"])
+                    catalog.remove(prev["drive_id"])
+                    summary["replaced"] += 1
+                except Exception as e:
+                    r["warning"] = f"old version kept: {e}"
+        if on_result:
+            on_result(r)
+
+    if changed:
+        batch.encrypt_upload_many(
+            [(cur["path"], cur["name"]) for cur, _ in changed.values()],
+            password, jobs=jobs, key_cache=key_cache, client=client,
+            on_result=uploaded, transfers=transfers, catalog=catalog,
+            compress=compress)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+def format_summary(s):
+    return (f"Scanned {s['scanned']:,} files in {s['seconds']:.2f}s: "
+            f"{s['uploaded']:,} uploaded ({s['replaced']:,} replaced), "
+            f"{s['unchanged'] + s['touched']:,} unchanged, "
+            f"{s['failed']:,} failed"
+            + (f", {s['missing']:,} gone locally" if s["missing"] else ""))
+
+# ── watching ──────────────────────────────────────────────────────────────────
+# inotify through libc, so watching needs no extra package on Linux;
+# elsewhere the tree is rescanned every POLL_INTERVAL seconds, which the
+# metadata check keeps cheap.
+_IN_MODIFY_MASK = (0x00000008       # IN_CLOSE_WRITE
+                   | 0x00000080     # IN_MOVED_TO
+                   | 0x00000100)    # IN_CREATE
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+
+class _Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+
+    def add_tree(self, root):
+        for top, dirnames, _ in os.walk(root):
+            wd = self._add(self.fd, os.fsencode(top), _IN_MODIFY_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise OSError(err, "inotify watch limit reached "
+                                       "(fs.inotify.max_user_watches)")
+                continue
+            self._dirs[wd] = top
+
+    def read(self):
+        # [(path, is_dir)]; None after a queue overflow (rescan everything)
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, pos = [], 0
+        while pos < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if wd in self._dirs and name:
+                events.append((os.path.join(self._dirs[wd], os.fsdecode(name)),
+                               bool(mask & _IN_ISDIR)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def watch(root, run, settle=SETTLE, interval=POLL_INTERVAL, stop=None):
+    # calls run(paths) with the files and directories that changed, once
+    # nothing has changed for `settle` seconds; run(None) means "rescan
+    # everything". Returns when stop() is true or on Ctrl-C.
+    stop = stop or (lambda: False)
+    try:
+        notify = _Inotify() if sys.platform.startswith("linux") else None
+        if notify:
+            notify.add_tree(root)
+    except OSError as e:
+        print(f"inotify unavailable ({e}); rescanning every {interval:.0f}s")
+        notify = None
+
+    try:
+        if notify is None:
+            while not stop():
+                time.sleep(interval)
+                run(None)
+            return
+        dirty, last = set(), 0.0
+        while not stop():
+            ready, _, _ = select.select([notify.fd], [], [], settle / 4)
+            if ready:
+                events = notify.read()
+                if events is None:
+                    dirty.add(root)
+                for path, is_dir in events or ():
+                    if is_dir:
+                        notify.add_tree(path)   # new directory: watch it too
+                    dirty.add(path)
+                last = time.monotonic()
+            elif dirty and time.monotonic() - last >= settle:
+                paths, dirty = dirty, set()
+                run(None if root in paths else paths)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if notify:
+            notify.close()
@@ -0,0 +1,27 @@
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+import crypto_engine
+import drive_manager
+from drive_manager import DriveClient
+from upload_engine import UploadJournal
+from benchmarks.fake_drive import FakeDrive
+
+@pytest.fixture
+def vault_dir(tmp_path, monkeypatch):
+    # keyring, salt and KDF files are looked up relative to the working
+    # directory; keep them out of the checkout and make the KDF cheap
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(crypto_engine, "ITERATIONS", 1000)
+    monkeypatch.setattr(crypto_engine, "_keyring_mirror", None)
+    return tmp_path
+
+@pytest.fixture
+def fake_drive(vault_dir, monkeypatch):
+    # (server, client); the client is also what get_client() returns
+    with FakeDrive() as fake:
+        client = DriveClient(AnonymousCredentials(), fake.url,
+                             journal=UploadJournal(str(vault_dir / "journal.json")))
+        monkeypatch.setattr(drive_manager, "_client", client)
+        yield fake, client
+        client.close()
@@ -0,0 +1,125 @@
+import os
+import asyncio
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+pytest.importorskip("aiohttp")
+
+import batch
+import drive_manager
+import async_transfer
+from catalog import Catalog
+from crypto_engine import KeyCache, encrypt_file
+from drive_manager import DriveClient
+from upload_engine import CHUNK_ALIGN
+from async_transfer import AsyncDriveClient, HostLimiter, READ_CHUNK
+from benchmarks.aio_drive import AioDrive
+
+@pytest.fixture
+def aio_drive(vault_dir):
+    # (server, a function running one AsyncDriveClient call against it)
+    with AioDrive() as stub:
+        drive = DriveClient(AnonymousCredentials(), stub.url)
+
+        def call(method, *args, **kwargs):
+            async def go():
+                async with AsyncDriveClient(drive, **kwargs) as client:
+                    return await getattr(client, method)(*args)
+            return asyncio.run(go())
+
+        yield stub, call
+        drive.close()
+
+def test_multipart_body_survives_crlf_framing(aio_drive):
+    stub, call = aio_drive
+    # media that itself starts and ends with line breaks
+    data = b"\r\n" + os.urandom(4096) + b"\n\r\n\r"
+    file_id = call("upload_bytes", data, "edge.bin")
+    assert stub.files[file_id]["name"] == "edge.bin"
+    assert stub.files[file_id]["data"] == data
+
+def test_resumable_retry_resumes_at_confirmed_offset(aio_drive, vault_dir,
+                                                     monkeypatch):
+    monkeypatch.setattr("async_transfer.MULTIPART_LIMIT", 0)
+    monkeypatch.setattr("async_transfer.backoff_delay", lambda attempt: 0)
+    stub, call = aio_drive
+    # every chunk is stored but its response is lost: the client must ask
+    # the session where it stands instead of resending the old range
+    stub.lost_rate = 1.0
+    src = vault_dir / "big.bin"
+    src.write_bytes(os.urandom(5 * CHUNK_ALIGN + 123))
+    file_id = call("upload_file", str(src), chunk_size=CHUNK_ALIGN)
+    assert stub.lost == 6
+    assert stub.files[file_id]["data"] == src.read_bytes()
+
+def test_resume_at_end_of_file_adds_nothing(aio_drive, monkeypatch):
+    monkeypatch.setattr("async_transfer.backoff_delay", lambda attempt: 0)
+    stub, call = aio_drive
+    # the connection drops after the last byte: the resume asks for a
+    # range past the end and gets a 416 with an error body
+    stub.cut_downloads = 1
+    data = os.urandom(READ_CHUNK)
+    file_id = stub._add({"name": "whole.bin"}, data)
+    got = bytearray()
+
+    async def write(chunk):
+        got.extend(chunk)
+
+    assert call("download_to", file_id, write) == len(data)
+    assert bytes(got) == data
+    assert stub.cut_downloads == 0 and stub.requests == 2
+
+def test_download_many_returns_results_in_input_order(aio_drive, vault_dir,
+                                                      monkeypatch):
+    stub, _ = aio_drive
+    drive = DriveClient(AnonymousCredentials(), stub.url)
+    monkeypatch.setattr(drive_manager, "_client", drive)
+    catalog = Catalog(str(vault_dir / "vault.db"))
+    names = [f"f{i}.bin" for i in range(6)]
+    for name in names:
+        (vault_dir / name).write_bytes(os.urandom(1000))
+    # f1 and f4 go into a pack; members are fetched ahead of the others
+    packed = ["f1.bin", "f4.bin"]
+    (pack,) = batch.encrypt_upload_packs(
+        [[(str(vault_dir / name), name) for name in packed]], "pw",
+        key_cache=KeyCache(), client=drive, catalog=catalog)
+    entries = []
+    for name in names:
+        if name in packed:
+            entries.append((f"{pack['file_id']}#{packed.index(name)}", name))
+            continue
+        encrypt_file(str(vault_dir / name), name + ".cvault", "pw",
+                     key_cache=KeyCache())
+        blob = (vault_dir / (name + ".cvault")).read_bytes()
+        entries.append((stub._add({"name": name}, blob), name))
+
+    results = async_transfer.download_many(
+        entries, str(vault_dir / "out"), "pw", key_cache=KeyCache(),
+        client=AsyncDriveClient(drive), catalog=catalog)
+    assert [(r["file_id"], r["name"]) for r in results] == entries
+    for name in names:
+        assert (vault_dir / "out" / name).read_bytes() == \
+            (vault_dir / name).read_bytes()
+    catalog.close()
+    drive.close()
+
+def test_client_and_limiter_survive_a_new_event_loop(aio_drive):
+    stub, _ = aio_drive
+    drive = DriveClient(AnonymousCredentials(), stub.url)
+    client = AsyncDriveClient(drive, host_rate=1000.0)
+    # a burst of one keeps callers queued on the host's lock
+    client._hosts[f"127.0.0.1:{stub.port}"] = limiter = HostLimiter(1000.0, 1)
+
+    async def burst(tag):
+        try:
+            return await asyncio.gather(*(client.upload_bytes(
+                tag + bytes([i]), f"{tag.decode()}{i}") for i in range(5)))
+        finally:
+            await client.close()
+
+    first = asyncio.run(burst(b"a"))
+    second = asyncio.run(burst(b"b"))
+    assert client._hosts == {f"127.0.0.1:{stub.port}": limiter}
+    assert len(set(first + second)) == 10 and len(stub.files) == 10
+    drive.close()
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from catalog import Catalog, LEGACY_INDEX, LEGACY_CHUNK_INDEX
+
+def test_legacy_indexes_are_imported_once(tmp_path):
+    legacy = tmp_path / LEGACY_INDEX
+    chunks = tmp_path / LEGACY_CHUNK_INDEX
+    legacy.write_text(json.dumps({"report.pdf": "id-1", "notes.txt": "id-2"}))
+    chunks.write_text(json.dumps({"id": "c1", "file_id": "d1", "size": 10})
+                      + "\n\n" + json.dumps({"id": "c2", "file_id": "d2"}) + "\n")
+
+    with Catalog(str(tmp_path / "vault.db")) as catalog:
+        assert {(r["name"], r["drive_id"]) for r in catalog.files()} == \
+            {("report.pdf", "id-1"), ("notes.txt", "id-2")}
+        assert catalog.chunk("c1") == "d1" and catalog.chunk("c2") == "d2"
+        # imported names are searchable like any other
+        assert [r["drive_id"] for r in catalog.search("report")] == ["id-1"]
+    assert not legacy.exists() and not chunks.exists()
+    assert json.loads((tmp_path / (LEGACY_INDEX + ".migrated")).read_text())
+    assert (tmp_path / (LEGACY_CHUNK_INDEX + ".migrated")).exists()
+
+    # a stray index showing up later is not imported again
+    legacy.write_text(json.dumps({"late.txt": "id-3"}))
+    with Catalog(str(tmp_path / "vault.db")) as catalog:
+        assert len(catalog) == 2
+        assert catalog.by_name("late.txt") == []
+    assert legacy.exists()
+
+def test_catalog_without_legacy_files(tmp_path):
+    with Catalog(str(tmp_path / "vault.db")) as catalog:
+        assert len(catalog) == 0
+    assert not list(tmp_path.glob("*.migrated"))
+
+@pytest.fixture(params=["fts", "like"])
+def named(request, tmp_path):
+    # a catalog holding a few awkward names, searched through the trigram
+    # index or through the LIKE scan used without FTS5
+    catalog = Catalog(str(tmp_path / "vault.db"))
+    if request.param == "like":
+        catalog._fts = False
+    elif not catalog._fts:
+        pytest.skip("SQLite without the FTS5 trigram tokenizer")
+    for i, name in enumerate(["50%_off.pdf", "500 offers.pdf", "a_b.txt",
+                              "axb.txt", "Report 2024.xlsx", "go.md"]):
+        catalog.add(name, f"id-{i}")
+    yield catalog
+    catalog.close()
+
+def _names(rows):
+    return sorted(r["name"] for r in rows)
+
+@pytest.mark.parametrize("text, expected", [
+    ("%_", ["50%_off.pdf"]),                    # wildcards are literal
+    ("0%_o", ["50%_off.pdf"]),
+    ("a_b", ["a_b.txt"]),
+    ("_", ["50%_off.pdf", "a_b.txt"]),
+    ("%", ["50%_off.pdf"]),
+    ("go", ["go.md"]),                          # shorter than a trigram
+    ("xB", ["axb.txt"]),
+    ("report", ["Report 2024.xlsx"]),           # case-insensitive
+    ('"', []),
+    ("", ["500 offers.pdf", "50%_off.pdf", "Report 2024.xlsx", "a_b.txt",
+          "axb.txt", "go.md"]),
+])
+def test_search(named, text, expected):
+    assert _names(named.search(text)) == sorted(expected)
+
+def test_search_forgets_removed_and_renamed_entries(named):
+    assert _names(named.search("offers")) == ["500 offers.pdf"]
+    named.remove("id-1")
+    assert named.search("offers") == []
+    named.add("renamed.pdf", "id-0")
+    assert named.search("50%") == []
+    assert _names(named.search("renamed")) == ["renamed.pdf"]
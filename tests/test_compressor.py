@@ -0,0 +1,71 @@
+import io
+import zlib
+import tracemalloc
+
+import pytest
+
+from compressor import Decompressor, inflate, CODEC_ZLIB, OUTPUT_SIZE
+from crypto_engine import encrypt_stream, decrypt_stream, StreamDecryptor
+
+BOMB = 64 * 1024 * 1024     # zeros; about 64 KiB once deflated
+
+class _Counter:
+    def __init__(self):
+        self.bytes = 0
+        self.largest = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.largest = max(self.largest, len(data))
+        return len(data)
+
+def _peak(run):
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_decompressor_writes_bounded_pieces():
+    bomb = zlib.compress(bytes(BOMB), 9)
+    assert len(bomb) < 128 * 1024
+    out = _Counter()
+    d = Decompressor(CODEC_ZLIB, out.write)
+    peak = _peak(lambda: (d.feed(bomb), d.finish()))
+    assert out.bytes == BOMB
+    assert out.largest <= OUTPUT_SIZE
+    assert peak < 4 * OUTPUT_SIZE
+
+def test_inflate_yields_bounded_pieces():
+    bomb = zlib.compress(bytes(BOMB), 9)
+    sizes = [len(p) for p in inflate([bomb[:1000], bomb[1000:]], CODEC_ZLIB)]
+    assert sum(sizes) == BOMB
+    assert max(sizes) <= OUTPUT_SIZE
+
+def test_truncated_stream_is_rejected():
+    data = zlib.compress(b"x" * 100000)
+    with pytest.raises(ValueError):
+        list(inflate([data[:len(data) // 2]], CODEC_ZLIB))
+
+def test_compressed_container_decrypts_in_bounded_memory(vault_dir):
+    container = b"".join(encrypt_stream(io.BytesIO(bytes(BOMB)), "pw",
+                                        compression=(CODEC_ZLIB, 9)))
+    assert len(container) < 256 * 1024
+
+    def pull():
+        for piece in decrypt_stream(io.BytesIO(container), "pw"):
+            assert len(piece) <= OUTPUT_SIZE
+
+    assert _peak(pull) < 8 * 1024 * 1024
+
+    out = _Counter()
+
+    def push():
+        decryptor = StreamDecryptor(out, "pw")
+        for pos in range(0, len(container), 8192):
+            decryptor.update(container[pos:pos + 8192])
+        decryptor.finalize()
+
+    assert _peak(push) < 8 * 1024 * 1024
+    assert out.bytes == BOMB and out.largest <= OUTPUT_SIZE
@@ -0,0 +1,79 @@
+import io
+import os
+
+import pytest
+
+from crypto_engine import (encrypt_file, decrypt_file, read_header, MAGIC,
+                           TAG_SIZE)
+
+SEGMENT = 1024
+
+def _encrypt(vault_dir, data, name="plain"):
+    src = vault_dir / f"{name}.bin"
+    src.write_bytes(data)
+    encrypt_file(str(src), f"{name}.cvault", "pw", segment_size=SEGMENT)
+    return (vault_dir / f"{name}.cvault").read_bytes()
+
+def _split(blob):
+    # (header bytes, [sealed segments])
+    f = io.BytesIO(blob)
+    f.read(len(MAGIC))
+    read_header(f)
+    head, body = blob[:f.tell()], blob[f.tell():]
+    step = SEGMENT + TAG_SIZE
+    return head, [body[i:i + step] for i in range(0, len(body), step)]
+
+def _decrypt_fails(vault_dir, blob, match):
+    (vault_dir / "bad.cvault").write_bytes(blob)
+    with pytest.raises(ValueError, match=match):
+        decrypt_file("bad.cvault", "bad.out", "pw")
+    # never a partial plaintext
+    assert not os.path.exists(vault_dir / "bad.out")
+
+@pytest.mark.parametrize("size", [0, 1, SEGMENT - 1, SEGMENT, 3 * SEGMENT,
+                                  3 * SEGMENT + 7])
+def test_round_trip(vault_dir, size):
+    data = os.urandom(size)
+    blob = _encrypt(vault_dir, data)
+    _, segments = _split(blob)
+    # an exact multiple still ends in its own final segment
+    assert len(segments) == max(1, -(-size // SEGMENT))
+    decrypt_file("plain.cvault", "plain.out", "pw")
+    assert (vault_dir / "plain.out").read_bytes() == data
+
+def test_wrong_password(vault_dir):
+    _encrypt(vault_dir, os.urandom(3000))
+    with pytest.raises(ValueError, match="Wrong password"):
+        decrypt_file("plain.cvault", "plain.out", "not pw")
+    assert not os.path.exists(vault_dir / "plain.out")
+
+@pytest.mark.parametrize("keep", [1, 2])
+def test_truncated_at_segment_boundary(vault_dir, keep):
+    head, segments = _split(_encrypt(vault_dir, os.urandom(3 * SEGMENT + 7)))
+    _decrypt_fails(vault_dir, head + b"".join(segments[:keep]),
+                   "Corrupted or truncated|Wrong password")
+
+def test_truncated_mid_segment(vault_dir):
+    blob = _encrypt(vault_dir, os.urandom(3 * SEGMENT + 7))
+    _decrypt_fails(vault_dir, blob[:-100], "Corrupted or truncated")
+
+def test_empty_file_truncated_to_header(vault_dir):
+    head, _ = _split(_encrypt(vault_dir, b""))
+    _decrypt_fails(vault_dir, head, "Wrong password or corrupted")
+
+def test_swapped_segments(vault_dir):
+    head, s = _split(_encrypt(vault_dir, os.urandom(4 * SEGMENT + 7)))
+    _decrypt_fails(vault_dir, head + s[0] + s[2] + s[1] + s[3] + s[4],
+                   "Corrupted or truncated")
+
+def test_segment_swapped_with_another_file(vault_dir):
+    head, a = _split(_encrypt(vault_dir, os.urandom(2 * SEGMENT + 7), "a"))
+    _, b = _split(_encrypt(vault_dir, os.urandom(2 * SEGMENT + 7), "b"))
+    _decrypt_fails(vault_dir, head + a[0] + b[1] + a[2],
+                   "Corrupted or truncated")
+
+def test_exact_multiple_truncated_at_segment_boundary(vault_dir):
+    # the first of two full segments was sealed as not final
+    head, s = _split(_encrypt(vault_dir, os.urandom(2 * SEGMENT)))
+    assert len(s) == 2
+    _decrypt_fails(vault_dir, head + s[0], "Wrong password or corrupted")
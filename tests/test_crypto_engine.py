@@ -0,0 +1,80 @@
+import os
+import time
+import random
+
+import pytest
+
+import crypto_engine
+from crypto_engine import KeyCache, encrypt_file, decrypt_file, ordered_map
+
+def _count_kdf(monkeypatch):
+    calls = []
+    derive = crypto_engine.derive_key
+
+    def counting(*args, **kwargs):
+        calls.append(args[1])
+        return derive(*args, **kwargs)
+
+    monkeypatch.setattr(crypto_engine, "derive_key", counting)
+    return calls
+
+def test_vault_mode_runs_kdf_once_per_session(vault_dir, monkeypatch):
+    crypto_engine.create_keyring("pw")
+    calls = _count_kdf(monkeypatch)
+    key_cache = KeyCache()
+    for i in range(5):
+        src = vault_dir / f"f{i}.txt"
+        src.write_bytes(os.urandom(1000 + i))
+        encrypt_file(str(src), f"{src}.cvault", "pw", key_cache=key_cache)
+    for i in range(5):
+        src = vault_dir / f"f{i}.txt"
+        decrypt_file(f"{src}.cvault", f"{src}.out", "pw", key_cache=key_cache)
+        assert (vault_dir / f"f{i}.txt.out").read_bytes() == src.read_bytes()
+    assert len(calls) == 1
+
+def test_empty_cache_is_used_not_replaced(vault_dir, monkeypatch):
+    crypto_engine.create_keyring("pw")
+    calls = _count_kdf(monkeypatch)
+    key_cache = KeyCache()
+    assert len(key_cache) == 0
+    crypto_engine.add_kek("pw", key_cache)
+    crypto_engine.add_kek("pw", key_cache)
+    assert len(calls) == 1
+    assert len(key_cache) == 1
+
+def test_standalone_files_open_without_keyring(vault_dir):
+    src = vault_dir / "plain.txt"
+    src.write_bytes(b"standalone" * 100)
+    encrypt_file(str(src), "plain.cvault", "pw")
+    assert not os.path.exists(crypto_engine.VAULT_KEY_FILE)
+    decrypt_file("plain.cvault", "plain.out", "pw")
+    assert (vault_dir / "plain.out").read_bytes() == src.read_bytes()
+
+def _seeded_urandom(monkeypatch):
+    # the same keys, salt and nonces on every run
+    rnd = random.Random(1)
+    monkeypatch.setattr(os, "urandom", rnd.randbytes)
+    return rnd
+
+@pytest.mark.parametrize("workers", [2, 8])
+def test_workers_produce_identical_output(vault_dir, monkeypatch, workers):
+    src = vault_dir / "big.bin"
+    src.write_bytes(random.Random(2).randbytes(37 * 4096 + 11))
+    rnd = _seeded_urandom(monkeypatch)
+    blobs = []
+    for n in (1, workers):
+        rnd.seed(1)
+        encrypt_file(str(src), f"w{n}.cvault", "pw", segment_size=4096,
+                     workers=n)
+        blobs.append((vault_dir / f"w{n}.cvault").read_bytes())
+    assert blobs[0] == blobs[1]
+    decrypt_file(f"w{workers}.cvault", "w.out", "pw", workers=workers)
+    assert (vault_dir / "w.out").read_bytes() == src.read_bytes()
+
+def test_ordered_map_keeps_input_order():
+    # later items finish first; results still come back in input order
+    def slow(i):
+        time.sleep((20 - i) * 0.002)
+        return i * i
+    assert list(ordered_map(slow, range(20), 4)) == [i * i for i in range(20)]
+    assert list(ordered_map(slow, iter(range(20)), 1)) == [i * i for i in range(20)]
@@ -0,0 +1,45 @@
+import io
+import os
+import random
+
+import pytest
+
+from dedup import chunk_stream, CHUNK_MAX
+
+def _text(size):
+    # a database dump: the same structure on every line
+    rnd = random.Random(7)
+    lines, total = [], 0
+    while total < size:
+        i = len(lines)
+        line = (b"INSERT INTO users VALUES (%d, 'user%d', 'user%d@example.com',"
+                b" %d);\n" % (i, i, i, rnd.randrange(10 ** 6)))
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)
+
+def _chunks(data):
+    return list(chunk_stream(io.BytesIO(data)))
+
+@pytest.mark.parametrize("data", [_text(6 << 20), os.urandom(6 << 20)],
+                         ids=["text", "random"])
+def test_small_insert_changes_one_or_two_chunks(data):
+    before = _chunks(data)
+    assert b"".join(before) == data
+    assert len(before) >= 3
+    assert all(len(c) < CHUNK_MAX for c in before[:-1])
+
+    at = len(data) // 2
+    after = _chunks(data[:at] + b"INSERT INTO users VALUES (0, 'x', 'y', 1);\n"
+                    + data[at:])
+    assert 1 <= len(set(after) - set(before)) <= 2
+
+def test_boundaries_do_not_depend_on_read_size():
+    data = os.urandom(5 << 20)
+    whole = _chunks(data)
+
+    class Trickle(io.BytesIO):
+        def read(self, n=-1):
+            return super().read(min(n, 700_001))
+
+    assert list(chunk_stream(Trickle(data))) == whole
@@ -0,0 +1,105 @@
+import os
+import time
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from catalog import Catalog
+from crypto_engine import KeyCache, encrypt_file
+from jobs import JobScheduler, QUEUED, RUNNING, DONE, CANCELLED
+
+gui = pytest.importorskip("gui")
+
+def _events(scheduler, job, timeout=10):
+    # the states `job` went through, up to a final one
+    seen, deadline = [], time.monotonic() + timeout
+    while not seen or seen[-1] in (QUEUED, RUNNING):
+        got, state = scheduler.events.get(timeout=deadline - time.monotonic())
+        if got is job:
+            seen.append(state)
+    return seen
+
+def _cancel_after_first_step(run):
+    # runs a job function, cancelling it once it has made some progress
+    def func(job):
+        progress = job.progress
+
+        def cancelling(done, total=None, phase=None):
+            if done:
+                job.cancel()
+            return progress(done, total, phase)
+
+        job.progress = cancelling
+        return run(job)
+    return func
+
+def test_cancel_stops_running_job_at_next_progress():
+    scheduler = JobScheduler(1)
+    started, steps = threading.Event(), []
+
+    def work(job):
+        started.set()
+        for i in range(1000):
+            job.progress(i, 1000)
+            steps.append(i)
+            time.sleep(0.01)
+        return "finished"
+
+    job = scheduler.submit("work", work)
+    started.wait(5)
+    job.cancel()
+    assert _events(scheduler, job) == [QUEUED, RUNNING, CANCELLED]
+    assert job.result is None and len(steps) < 1000
+    # a job cancelled while queued never starts
+    queued = scheduler.submit("never", lambda job: steps.append("ran"))
+    queued.cancel()
+    assert _events(scheduler, queued) == [QUEUED, CANCELLED]
+    assert "ran" not in steps
+    scheduler.shutdown()
+
+@pytest.fixture
+def app(fake_drive, vault_dir, monkeypatch):
+    # what the job functions use of the window, without a Tk root; temp
+    # files land in a directory of their own
+    tmp = vault_dir / "tmp"
+    tmp.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp))
+    catalog = Catalog(str(vault_dir / "vault.db"))
+    yield SimpleNamespace(key_cache=KeyCache(), catalog=catalog, tmp=tmp,
+                          fake=fake_drive[0])
+    catalog.close()
+
+def test_cancelled_upload_removes_its_staging_file(app, vault_dir):
+    src = vault_dir / "big.bin"
+    src.write_bytes(os.urandom(3 * 1024 * 1024 + 5))
+    scheduler = JobScheduler(1)
+    run = gui.CipherVaultApp._upload_job(app, str(src), "pw")
+    job = scheduler.submit("upload", _cancel_after_first_step(run))
+    assert _events(scheduler, job)[-1] == CANCELLED
+    assert list(app.tmp.iterdir()) == []
+    assert app.fake.files == {} and len(app.catalog) == 0
+
+    job = scheduler.submit("upload", run)
+    assert _events(scheduler, job)[-1] == DONE
+    assert list(app.tmp.iterdir()) == []
+    scheduler.shutdown()
+
+def test_cancelled_download_leaves_no_partial_file(app, vault_dir):
+    src = vault_dir / "big.bin"
+    src.write_bytes(os.urandom(3 * 1024 * 1024 + 5))
+    encrypt_file(str(src), "big.cvault", "pw", key_cache=app.key_cache)
+    fid = app.fake.add("big.cvault", (vault_dir / "big.cvault").read_bytes())
+    app.catalog.add("big.bin", fid)
+    out = vault_dir / "restored.bin"
+    scheduler = JobScheduler(1)
+    run = gui.CipherVaultApp._download_job(app, fid, str(out), "pw")
+    job = scheduler.submit("download", _cancel_after_first_step(run))
+    assert _events(scheduler, job)[-1] == CANCELLED
+    assert not out.exists()
+
+    job = scheduler.submit("download", run)
+    assert _events(scheduler, job)[-1] == DONE
+    assert out.read_bytes() == src.read_bytes()
+    scheduler.shutdown()
@@ -0,0 +1,56 @@
+import os
+
+import crypto_engine
+from crypto_engine import KeyCache, encrypt_file, decrypt_file
+from drive_manager import DriveKeyring, KEYRING_PROPERTY, KEYRING_TAG
+
+def _keyring_copies(client):
+    return client.find(KEYRING_PROPERTY, KEYRING_TAG)
+
+def test_vault_opens_with_password_alone_after_keyring_loss(fake_drive, vault_dir):
+    _, client = fake_drive
+    crypto_engine.set_keyring_mirror(DriveKeyring(client))
+    src = vault_dir / "notes.txt"
+    src.write_bytes(os.urandom(5000))
+    encrypt_file(str(src), "notes.cvault", "pw", key_cache=KeyCache())
+    assert len(_keyring_copies(client)) == 1
+
+    # the machine is gone: only the container and the password are left
+    for name in (crypto_engine.VAULT_KEY_FILE, crypto_engine.VAULT_SALT_FILE):
+        os.remove(name)
+    crypto_engine.set_keyring_mirror(DriveKeyring(client))
+    decrypt_file("notes.cvault", "notes.out", "pw", key_cache=KeyCache())
+    assert (vault_dir / "notes.out").read_bytes() == src.read_bytes()
+    assert os.path.exists(crypto_engine.VAULT_KEY_FILE)
+
+def test_password_change_replaces_the_drive_copy(fake_drive, vault_dir):
+    _, client = fake_drive
+    crypto_engine.set_keyring_mirror(DriveKeyring(client))
+    src = vault_dir / "a.txt"
+    src.write_bytes(b"a" * 100)
+    encrypt_file(str(src), "a.cvault", "old", key_cache=KeyCache())
+    crypto_engine.change_password("old", "new")
+    assert len(_keyring_copies(client)) == 1
+
+    os.remove(crypto_engine.VAULT_KEY_FILE)
+    crypto_engine.set_keyring_mirror(DriveKeyring(client))
+    decrypt_file("a.cvault", "a.out", "new", key_cache=KeyCache())
+    assert (vault_dir / "a.out").read_bytes() == src.read_bytes()
+
+def test_local_keyring_gets_its_first_copy(fake_drive, vault_dir):
+    # vaults from before the mirror are published on first use
+    _, client = fake_drive
+    crypto_engine.create_keyring("pw")
+    assert _keyring_copies(client) == []
+    crypto_engine.set_keyring_mirror(DriveKeyring(client))
+    KeyCache().vault_keys("pw")
+    assert len(_keyring_copies(client)) == 1
+
+def test_standalone_encrypt_leaves_keyring_alone(fake_drive, vault_dir):
+    _, client = fake_drive
+    crypto_engine.set_keyring_mirror(DriveKeyring(client))
+    src = vault_dir / "s.txt"
+    src.write_bytes(b"s" * 100)
+    encrypt_file(str(src), "s.cvault", "pw")
+    assert not os.path.exists(crypto_engine.VAULT_KEY_FILE)
+    assert _keyring_copies(client) == []
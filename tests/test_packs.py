@@ -0,0 +1,50 @@
+import os
+
+import batch
+import pack
+from catalog import Catalog
+from crypto_engine import KeyCache
+
+def test_member_downloads_alone_from_its_pack(fake_drive, vault_dir):
+    fake, client = fake_drive
+    files = []
+    for i, size in enumerate([0, 1, 5000, 70 * 1024, 300]):
+        path = vault_dir / f"f{i}.bin"
+        path.write_bytes(os.urandom(size))
+        files.append((str(path), f"dir/f{i}.bin"))
+    packs, large = pack.plan(files)
+    assert len(packs) == 1 and large == []
+
+    catalog = Catalog(str(vault_dir / "vault.db"))
+    (result,) = batch.encrypt_upload_packs(packs, "pw", key_cache=KeyCache(),
+                                           client=client, catalog=catalog)
+    pack_id = result["file_id"]
+    assert list(fake.files) == [pack_id]
+    assert result["errors"] == []
+
+    # members sit back to back, in the order they were planned
+    offset = 0
+    for i, (path, name) in enumerate(files):
+        row = catalog.get(f"{pack_id}#{i}")
+        assert (row["name"], row["pack"]) == (name, pack_id)
+        assert (row["pack_offset"], row["pack_length"]) == \
+            (offset, os.path.getsize(path))
+        offset += row["pack_length"]
+    assert result["bytes"] == offset
+    index = pack.read_index(pack_id, "pw", client=client, key_cache=KeyCache())
+    assert [(m["name"], m["pack_offset"], m["pack_length"]) for m in index] == \
+        [(r["name"], r["pack_offset"], r["pack_length"])
+         for r in (catalog.get(f"{pack_id}#{i}") for i in range(len(files)))]
+
+    # one member comes down by itself, through the catalog or, without
+    # one, through the pack's own index
+    for source in (catalog, None):
+        out = vault_dir / ("out" if source else "out-index")
+        (r,) = batch.download_members([(f"{pack_id}#3", "f3.bin")], str(out),
+                                      "pw", KeyCache(), client=client,
+                                      catalog=source)
+        assert "error" not in r
+        assert (out / "f3.bin").read_bytes() == \
+            (vault_dir / "f3.bin").read_bytes()
+        assert os.listdir(out) == ["f3.bin"]
+    catalog.close()
@@ -0,0 +1,80 @@
+import io
+import os
+
+import pytest
+
+import batch
+import crypto_engine
+from crypto_engine import (KeyCache, encrypt_file, decrypt_file, read_header,
+                           unpack_kdf, load_keyring, change_password,
+                           MAGIC, HDR_KDF, KDF_PBKDF2, KDF_SCRYPT, KDF_ARGON2ID)
+
+SCRYPT = {"algorithm": KDF_SCRYPT, "n": 2 ** 10, "r": 8, "p": 1}
+ARGON2ID = {"algorithm": KDF_ARGON2ID, "memory_kib": 1024, "iterations": 1,
+            "lanes": 1}
+NEW_KDFS = [SCRYPT, pytest.param(ARGON2ID, marks=pytest.mark.skipif(
+    crypto_engine.Argon2id is None, reason="needs cryptography 44+"))]
+
+def _header(path):
+    with open(path, "rb") as f:
+        f.read(len(MAGIC))
+        return read_header(f)
+
+def _payload(path):
+    with open(path, "rb") as f:
+        blob = f.read()
+    head = io.BytesIO(blob)
+    head.read(len(MAGIC))
+    read_header(head)
+    return blob[head.tell():]
+
+@pytest.mark.parametrize("params", NEW_KDFS, ids=lambda p: p["algorithm"])
+def test_standalone_file_moves_to_new_kdf(vault_dir, params):
+    src = vault_dir / "plain.bin"
+    src.write_bytes(os.urandom(3 * 4096 + 5))
+    encrypt_file(str(src), "plain.cvault", "pw", segment_size=4096)
+    assert unpack_kdf(_header("plain.cvault")[HDR_KDF])["algorithm"] == KDF_PBKDF2
+    payload = _payload("plain.cvault")
+
+    (r,) = batch.rekey_many([("plain.cvault", "plain")], "pw", params)
+    assert r["rekeyed"] is True
+    assert unpack_kdf(_header("plain.cvault")[HDR_KDF]) == params
+    assert _payload("plain.cvault") == payload      # only the header moved
+    decrypt_file("plain.cvault", "plain.out", "pw")
+    assert (vault_dir / "plain.out").read_bytes() == src.read_bytes()
+
+    (r,) = batch.rekey_many([("plain.cvault", "plain")], "pw", params)
+    assert r["rekeyed"] is False
+
+def test_wrong_password_rekeys_nothing(vault_dir):
+    src = vault_dir / "plain.bin"
+    src.write_bytes(os.urandom(5000))
+    encrypt_file(str(src), "plain.cvault", "pw")
+    before = (vault_dir / "plain.cvault").read_bytes()
+    (r,) = batch.rekey_many([("plain.cvault", "plain")], "nope", SCRYPT)
+    assert "Wrong password" in r["error"]
+    assert (vault_dir / "plain.cvault").read_bytes() == before
+    assert not os.path.exists("plain.cvault.rekey")
+
+@pytest.mark.parametrize("params", NEW_KDFS, ids=lambda p: p["algorithm"])
+def test_vault_rekey_with_new_password(vault_dir, params):
+    # `rekey` after `passwd`: the keyring is re-sealed under the new KDF
+    # and password, vault files are already current, the old password
+    # opens nothing
+    src = vault_dir / "doc.bin"
+    src.write_bytes(os.urandom(5000))
+    encrypt_file(str(src), "doc.cvault", "old", key_cache=KeyCache())
+    change_password("old", "new", params)
+    assert load_keyring()["kdf"] == params
+
+    (r,) = batch.rekey_many([("doc.cvault", "doc")], "new", params,
+                            key_cache=KeyCache())
+    assert r["rekeyed"] is False
+    decrypt_file("doc.cvault", "doc.out", "new", key_cache=KeyCache())
+    assert (vault_dir / "doc.out").read_bytes() == src.read_bytes()
+    with pytest.raises(ValueError):
+        decrypt_file("doc.cvault", "doc.out2", "old", key_cache=KeyCache())
+    assert not os.path.exists("doc.out2")
+    (r,) = batch.rekey_many([("doc.cvault", "doc")], "old", params,
+                            key_cache=KeyCache())
+    assert "error" in r
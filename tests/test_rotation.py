@@ -0,0 +1,138 @@
+import io
+import os
+import hmac
+import json
+import struct
+import hashlib
+
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import batch
+import dedup
+from catalog import Catalog
+from crypto_engine import (KeyCache, KeyRetired, encrypt_file, add_kek,
+                           retire_keks, create_keyring, load_keyring,
+                           load_vault_salt, load_kdf_params, derive_file_key,
+                           pack_header, pack_kdf, _segment_nonce, _segment_aad,
+                           SALT_SIZE, IV_SIZE, NONCE_PREFIX_SIZE,
+                           SEGMENT_SIZE, HDR_SEGMENT_SIZE, HDR_NONCE_PREFIX,
+                           HDR_SALT, HDR_KDF, HDR_FILE_SALT, DEDUP_ROOT)
+from drive_manager import SIDECAR_PROPERTY
+from transfer import download_decrypt
+
+def _rotate(fake_drive, password, retire=True):
+    # what `main.py rotate [--retire]` does
+    fake, client = fake_drive
+    add_kek(password, KeyCache())
+    entries = [(fid, f["name"]) for fid, f in fake.files.items()]
+    results = batch.rewrap_many(entries, password, KeyCache(), client)
+    assert not [r for r in results if "error" in r]
+    if retire:
+        retire_keks(password, KeyCache())
+    return results
+
+def _upload(fake, vault_dir, name, data):
+    (vault_dir / name).write_bytes(data)
+    encrypt_file(str(vault_dir / name), name + ".cvault", "pw",
+                 key_cache=KeyCache())
+    return fake.add(name, (vault_dir / (name + ".cvault")).read_bytes())
+
+def test_rotate_rewrap_retire_download_through_sidecar(fake_drive, vault_dir):
+    fake, client = fake_drive
+    data = os.urandom(3 * 1024 * 1024 + 1)
+    fid = _upload(fake, vault_dir, "a.bin", data)
+    old = load_keyring()["current"]
+
+    results = _rotate(fake_drive, "pw", retire=False)
+    assert [r.get("rewrapped") for r in results] == [True]
+    sidecar = fake.files[fid]["appProperties"][SIDECAR_PROPERTY]
+    assert sidecar
+    new = load_keyring()["current"]
+    assert new != old
+
+    # the header still names the old KEK; once it is retired only the
+    # sidecar opens the object
+    assert retire_keks("pw", KeyCache()) == [old]
+    assert old in load_keyring()["retired"]
+    download_decrypt(fid, "a.out", "pw", client=client, key_cache=KeyCache())
+    assert (vault_dir / "a.out").read_bytes() == data
+
+    # without its sidecar the object is unreadable
+    fake.files[fid]["appProperties"].pop(SIDECAR_PROPERTY)
+    with pytest.raises(KeyRetired):
+        download_decrypt(fid, "b.out", "pw", client=client, key_cache=KeyCache())
+    assert not os.path.exists(vault_dir / "b.out")
+
+def test_rewrap_is_idempotent_and_skips_current_files(fake_drive, vault_dir):
+    fake, client = fake_drive
+    _upload(fake, vault_dir, "a.bin", b"a" * 1000)
+    _rotate(fake_drive, "pw")
+    fid = _upload(fake, vault_dir, "b.bin", b"b" * 1000)     # new KEK
+    results = batch.rewrap_many([(fid, "b.bin")], "pw", KeyCache(), client)
+    assert results[0].get("skipped")
+    # a second rotation re-wraps from the sidecar of a retired header
+    results = _rotate(fake_drive, "pw")
+    assert all(r.get("rewrapped") for r in results)
+    for fid in fake.files:
+        download_decrypt(fid, "x.out", "pw", client=client, key_cache=KeyCache())
+
+def test_backup_restores_after_rotation(fake_drive, vault_dir):
+    fake, client = fake_drive
+    data = os.urandom(2 * 1024 * 1024)
+    (vault_dir / "disk.img").write_bytes(data)
+    catalog = Catalog(str(vault_dir / "vault.db"))
+    stats = dedup.backup_file(str(vault_dir / "disk.img"), "pw", client=client,
+                              key_cache=KeyCache(), catalog=catalog)
+    _rotate(fake_drive, "pw")
+    dedup.restore_file(stats["manifest_id"], "disk.out", "pw", client=client,
+                       key_cache=KeyCache())
+    assert (vault_dir / "disk.out").read_bytes() == data
+    # the dedup root is not rotated: the same data adds no chunks
+    again = dedup.backup_file(str(vault_dir / "disk.img"), "pw", client=client,
+                              key_cache=KeyCache(), catalog=catalog)
+    assert again["new_chunks"] == 0
+    catalog.close()
+
+def _legacy_container(plain, master, salt, params):
+    # a vault file from before the keyring: keyed from the master key and
+    # a per-file salt, with no wrapped content key
+    file_salt = os.urandom(SALT_SIZE)
+    records = {HDR_SEGMENT_SIZE: struct.pack(">I", SEGMENT_SIZE),
+               HDR_NONCE_PREFIX: os.urandom(NONCE_PREFIX_SIZE),
+               HDR_SALT: salt, HDR_KDF: pack_kdf(params),
+               HDR_FILE_SALT: file_salt}
+    sealed = AESGCM(derive_file_key(master, file_salt)).encrypt(
+        _segment_nonce(records[HDR_NONCE_PREFIX], 0), plain, _segment_aad(0, True))
+    return pack_header(records) + sealed
+
+def test_legacy_backup_restores_after_retire(fake_drive, vault_dir):
+    fake, client = fake_drive
+    # a backup made before the keyring existed: chunks keyed off the
+    # master key, the manifest naming the vault salt it came from
+    salt, params = load_vault_salt(), load_kdf_params()
+    master = KeyCache().master_key("pw", salt, params)
+    id_key, aesgcm = dedup._chunk_keys(master)
+    data = os.urandom(600 * 1024)
+    chunks = []
+    for chunk in dedup.chunk_stream(io.BytesIO(data)):
+        cid = hmac.new(id_key, chunk, hashlib.sha256).hexdigest()
+        nonce = os.urandom(IV_SIZE)
+        fid = fake.add("chunk-" + cid,
+                       nonce + aesgcm.encrypt(nonce, chunk, cid.encode()))
+        chunks.append([cid, fid, len(chunk)])
+    manifest = json.dumps({"format": dedup.MANIFEST_FORMAT, "name": "old.img",
+                           "size": len(data), "vault_salt": salt.hex(),
+                           "kdf": params, "chunks": chunks}).encode()
+    manifest_id = fake.add(
+        "old.img.manifest", _legacy_container(manifest, master, salt, params))
+
+    ring = create_keyring("pw")
+    assert ring["current"] in load_keyring()["keys"]
+    _rotate(fake_drive, "pw")
+    assert ring["current"] in load_keyring()["retired"]
+    assert DEDUP_ROOT in load_keyring()["keys"]
+
+    dedup.restore_file(manifest_id, "old.out", "pw", client=client,
+                       key_cache=KeyCache())
+    assert (vault_dir / "old.out").read_bytes() == data
@@ -0,0 +1,46 @@
+import os
+
+import sync
+from catalog import Catalog
+from crypto_engine import KeyCache
+from sync import sync_tree
+
+def _sync(root, client, catalog):
+    return sync_tree(str(root), "pw", key_cache=KeyCache(), client=client,
+                     catalog=catalog)
+
+def test_files_deleted_locally_are_forgotten(fake_drive, vault_dir):
+    _, client = fake_drive
+    root = vault_dir / "docs"
+    root.mkdir()
+    for name in ("keep.txt", "drop.txt"):
+        (root / name).write_bytes(os.urandom(1000))
+    catalog = Catalog(str(vault_dir / "vault.db"))
+    assert _sync(root, client, catalog)["uploaded"] == 2
+
+    (root / "drop.txt").unlink()
+    summary = _sync(root, client, catalog)
+    assert summary["missing"] == 1 and summary["uploaded"] == 0
+    assert list(catalog.sync_states(str(root))) == [str(root / "keep.txt")]
+    # the Drive copy stays, and so does its catalog row
+    assert catalog.by_name("drop.txt")
+    assert _sync(root, client, catalog)["missing"] == 0
+    catalog.close()
+
+def test_unreadable_files_keep_their_state(fake_drive, vault_dir, monkeypatch):
+    _, client = fake_drive
+    root = vault_dir / "docs"
+    (root / "locked").mkdir(parents=True)
+    (root / "locked" / "a.txt").write_bytes(b"a" * 100)
+    catalog = Catalog(str(vault_dir / "vault.db"))
+    _sync(root, client, catalog)
+
+    # a directory the scan can't list is skipped; its files still exist
+    # and must not be forgotten
+    scan = sync.scan
+    monkeypatch.setattr(sync, "scan", lambda top: (
+        e for e in scan(top) if os.sep + "locked" + os.sep not in e[0]))
+    summary = _sync(root, client, catalog)
+    assert summary["missing"] == 0 and summary["scanned"] == 0
+    assert len(catalog.sync_states(str(root))) == 1
+    catalog.close()
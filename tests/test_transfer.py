@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+import transfer
+from crypto_engine import encrypt_file, TAG_SIZE
+from transfer import (open_ranged, download_decrypt_range,
+                      parallel_download_decrypt)
+
+SEGMENT = 4096
+SIZE = 10 * SEGMENT + 123
+
+@pytest.fixture
+def stored(fake_drive, vault_dir):
+    # (client, Drive file id, plaintext) of a container on the fake Drive
+    fake, client = fake_drive
+    data = os.urandom(SIZE)
+    (vault_dir / "plain.bin").write_bytes(data)
+    encrypt_file(str(vault_dir / "plain.bin"), "plain.cvault", "pw",
+                 segment_size=SEGMENT)
+    file_id = fake.add("plain.cvault", (vault_dir / "plain.cvault").read_bytes())
+    return client, file_id, data
+
+def _recording(client, monkeypatch):
+    # the ciphertext ranges asked of Drive
+    ranges = []
+    fetch = client.fetch_range
+
+    def recording(file_id, first, last):
+        ranges.append((first, last))
+        return fetch(file_id, first, last)
+
+    monkeypatch.setattr(client, "fetch_range", recording)
+    return ranges
+
+@pytest.mark.parametrize("start, length", [
+    (0, SEGMENT),                       # exactly the first segment
+    (3 * SEGMENT, 2 * SEGMENT),         # starts and ends on boundaries
+    (SEGMENT - 1, 2),                   # straddles one boundary
+    (SEGMENT + 5, 6 * SEGMENT),         # spans several segments
+    (10 * SEGMENT, 123),                # the short final segment
+    (SIZE - 10, 1000),                  # runs past EOF
+    (0, SIZE),
+])
+def test_range_matches_plaintext(stored, start, length):
+    client, file_id, data = stored
+    got = download_decrypt_range(file_id, start, length, "pw", client=client)
+    assert got == data[start:start + length]
+
+@pytest.mark.parametrize("start", [SIZE, SIZE + SEGMENT])
+def test_range_starting_past_eof_is_empty(stored, start):
+    client, file_id, _ = stored
+    assert download_decrypt_range(file_id, start, 10, "pw", client=client) == b""
+
+def test_only_covering_segments_are_fetched(stored, monkeypatch):
+    client, file_id, data = stored
+    ranges = _recording(client, monkeypatch)
+    reader = open_ranged(file_id, "pw", client=client)
+    assert ranges == [(0, 4095)]        # the header probe
+    assert reader.read(2 * SEGMENT + 1, SEGMENT) == \
+        data[2 * SEGMENT + 1:3 * SEGMENT + 1]
+    first, last = ranges[-1]
+    assert last - first + 1 == 2 * (SEGMENT + TAG_SIZE)
+    assert reader.ciphertext_span(2, 3) == (first, last)
+
+def test_wrong_password_is_refused(stored):
+    client, file_id, _ = stored
+    with pytest.raises(ValueError, match="Wrong password"):
+        download_decrypt_range(file_id, 0, 10, "nope", client=client)
+
+def _parallel(client, file_id, password="pw"):
+    parallel_download_decrypt(file_id, "out.bin", password, connections=3,
+                              client=client)
+    with open("out.bin", "rb") as f:
+        return f.read()
+
+def test_parallel_download_retries_a_bad_range(stored, monkeypatch):
+    client, file_id, data = stored
+    monkeypatch.setattr(transfer, "RANGE_SIZE", 2 * (SEGMENT + TAG_SIZE))
+    ranges = _recording(client, monkeypatch)
+    fetch = client.fetch_range
+    corrupted = []
+
+    def flaky(file_id, first, last):
+        blob, total = fetch(file_id, first, last)
+        if first > 4096 and not corrupted:
+            # one range arrives damaged: only it is fetched again
+            corrupted.append((first, last))
+            blob = blob[:10] + bytes([blob[10] ^ 1]) + blob[11:]
+        return blob, total
+
+    monkeypatch.setattr(client, "fetch_range", flaky)
+    assert _parallel(client, file_id) == data
+    assert ranges.count(corrupted[0]) == 2
+    assert len(set(ranges)) == len(ranges) - 1
+
+@pytest.mark.parametrize("password, tamper", [("nope", False), ("pw", True)])
+def test_parallel_download_of_empty_file_fails_fast(fake_drive, vault_dir,
+                                                    monkeypatch, password,
+                                                    tamper):
+    fake, client = fake_drive
+    (vault_dir / "empty.bin").write_bytes(b"")
+    encrypt_file(str(vault_dir / "empty.bin"), "empty.cvault", "pw")
+    blob = (vault_dir / "empty.cvault").read_bytes()
+    if tamper:
+        blob = blob[:-1] + bytes([blob[-1] ^ 1])
+    file_id = fake.add("empty.cvault", blob)
+    ranges = _recording(client, monkeypatch)
+    with pytest.raises(ValueError, match="Wrong password or corrupted"):
+        _parallel(client, file_id, password)
+    # refused from the header probe, before any range was handed out
+    assert ranges == [(0, 4095)]
+    assert not os.path.exists(vault_dir / "out.bin")
+
+def test_parallel_download_of_empty_file(fake_drive, vault_dir):
+    fake, client = fake_drive
+    (vault_dir / "empty.bin").write_bytes(b"")
+    encrypt_file(str(vault_dir / "empty.bin"), "empty.cvault", "pw")
+    file_id = fake.add("empty.cvault", (vault_dir / "empty.cvault").read_bytes())
+    assert _parallel(client, file_id) == b""
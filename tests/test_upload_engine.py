@@ -0,0 +1,111 @@
+import os
+import random
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+import upload_engine
+from drive_manager import DriveClient
+from upload_engine import UploadJournal, resumable_upload, CHUNK_ALIGN
+
+SIZE = 10 * CHUNK_ALIGN + 1234      # 11 chunks, the last one short
+
+class Crash(Exception):
+    pass
+
+def crash_at(offset):
+    # progress callback standing in for the process dying once `offset`
+    # bytes are confirmed and journalled
+    def progress(done, total):
+        if done >= offset:
+            raise Crash()
+    return progress
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(upload_engine, "BACKOFF_BASE", 0.001)
+    random.seed(6)
+
+@pytest.fixture
+def source(vault_dir):
+    path = vault_dir / "payload.bin"
+    path.write_bytes(os.urandom(SIZE))
+    return str(path)
+
+def _stored(fake, file_id):
+    return fake.files[file_id]["data"]
+
+def test_retries_through_server_errors(fake_drive, source):
+    fake, client = fake_drive
+    fake.error_rate = 0.3
+    file_id = resumable_upload(client, source, journal=client.journal,
+                               chunk_size=CHUNK_ALIGN)
+    assert fake.errors > 0
+    assert _stored(fake, file_id) == open(source, "rb").read()
+    assert client.journal.get(client.journal.key(source)) is None
+
+def test_lost_responses_resume_from_the_server_offset(fake_drive, source, vault_dir):
+    # chunks that were stored but never acknowledged must not be sent
+    # twice: the retry asks the session how far it got
+    fake, _ = fake_drive
+    fake.timeout_rate = 0.3
+    fake.stall = 0.5
+    client = DriveClient(AnonymousCredentials(), fake.url, timeout=0.2,
+                         journal=UploadJournal(str(vault_dir / "j2.json")))
+    file_id = resumable_upload(client, source, journal=client.journal,
+                               chunk_size=CHUNK_ALIGN)
+    client.close()
+    assert fake.timeouts > 0
+    assert _stored(fake, file_id) == open(source, "rb").read()
+    assert fake.received == SIZE
+
+def test_crash_and_restart_resumes_from_the_journal(fake_drive, source):
+    fake, client = fake_drive
+    journal = client.journal
+    key = journal.key(source)
+
+    with pytest.raises(Crash):
+        resumable_upload(client, source, journal=journal,
+                         chunk_size=CHUNK_ALIGN, progress=crash_at(4 * CHUNK_ALIGN))
+    entry = journal.get(key)
+    assert entry["offset"] == 4 * CHUNK_ALIGN
+    assert fake.received == 4 * CHUNK_ALIGN
+
+    offsets = []
+    file_id = resumable_upload(client, source, journal=journal,
+                               chunk_size=CHUNK_ALIGN,
+                               progress=lambda done, total: offsets.append(done))
+    assert offsets[0] == 5 * CHUNK_ALIGN        # one chunk after the crash
+    assert fake.received == SIZE                # nothing sent twice
+    assert _stored(fake, file_id) == open(source, "rb").read()
+    assert journal.get(key) is None
+
+def test_restart_trusts_the_server_over_a_stale_journal(fake_drive, source):
+    # killed after the server took a chunk but before the journal was
+    # written: the session's own offset wins
+    fake, client = fake_drive
+    journal = client.journal
+    key = journal.key(source)
+
+    with pytest.raises(Crash):
+        resumable_upload(client, source, journal=journal,
+                         chunk_size=CHUNK_ALIGN, progress=crash_at(6 * CHUNK_ALIGN))
+    journal.put(key, offset=2 * CHUNK_ALIGN)
+
+    file_id = resumable_upload(client, source, journal=journal,
+                               chunk_size=CHUNK_ALIGN)
+    assert fake.received == SIZE
+    assert _stored(fake, file_id) == open(source, "rb").read()
+
+def test_expired_session_starts_over(fake_drive, source):
+    fake, client = fake_drive
+    journal = client.journal
+
+    with pytest.raises(Crash):
+        resumable_upload(client, source, journal=journal, chunk_size=CHUNK_ALIGN,
+                         progress=crash_at(CHUNK_ALIGN))
+    fake.sessions.clear()
+
+    file_id = resumable_upload(client, source, journal=journal,
+                               chunk_size=CHUNK_ALIGN)
+    assert _stored(fake, file_id) == open(source, "rb").read()
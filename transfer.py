@@ -0,0 +1,147 @@
+import os
+import mmap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from crypto_engine import (StreamDecryptor, RangedDecryptor, HEADER_PROBE,
+                           MAGIC_V2, KeyRetired)
+from drive_manager import get_client
+
+CONNECTIONS = 4
+RANGE_SIZE = 8 * 1024 * 1024    # ciphertext per work unit, in whole segments
+RANGE_RETRIES = 3
+
+# Download and decrypt in one pass: Drive chunks are fed straight into a
+# StreamDecryptor and plaintext is written as soon as each segment
+# authenticates, so no ciphertext ever touches the disk.
+
+class _DecryptingSink:
+    def __init__(self, decryptor):
+        self.decryptor = decryptor
+
+    def write(self, data):
+        self.decryptor.update(data)
+        return len(data)
+
+def _with_sidecar(client, file_id, call):
+    # call(wrapped_key); an object whose header names a retired vault key
+    # is opened again with the wrapped key from its Drive sidecar
+    try:
+        return call(None)
+    except KeyRetired:
+        wrapped = client.wrapped_key(file_id)
+        if wrapped is None:
+            raise
+        return call(wrapped)
+
+def download_decrypt(file_id, output_path, password, client=None,
+                     key_cache=None, progress=None):
+    client = client or get_client()
+    _with_sidecar(client, file_id, lambda wrapped: _download_decrypt(
+        file_id, output_path, password, client, key_cache, progress, wrapped))
+
+def _download_decrypt(file_id, output_path, password, client, key_cache,
+                      progress, wrapped_key):
+    try:
+        with open(output_path, "wb") as out:
+            decryptor = StreamDecryptor(out, password, key_cache, wrapped_key)
+            client.download_to(file_id, _DecryptingSink(decryptor), progress)
+            decryptor.finalize()
+    except Exception:
+        # never leave a partially decrypted file behind
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+def _ranged(client, file_id, password, key_cache):
+    head, total = client.fetch_range(file_id, 0, HEADER_PROBE - 1)
+
+    def read_range(first, last):
+        if last < len(head):
+            return head[first:last + 1]
+        return client.fetch_range(file_id, first, last)[0]
+
+    if head[:len(MAGIC_V2)] != MAGIC_V2:
+        return None
+    return _with_sidecar(client, file_id, lambda wrapped: RangedDecryptor(
+        read_range, total, password, key_cache, wrapped))
+
+def parallel_download_decrypt(file_id, output_path, password,
+                              connections=CONNECTIONS, client=None,
+                              key_cache=None, progress=None):
+    # Splits the object into segment-aligned byte ranges fetched over
+    # `connections` parallel connections. Each range is authenticated as it
+    # arrives and decrypted straight into its place in a preallocated,
+    # memory-mapped output file; a range that fails is refetched on its own.
+    client = client or get_client()
+    reader = _ranged(client, file_id, password, key_cache)
+    if reader is None or reader.compressed:
+        # CVLT1 is one AES-GCM message and can't be split; a compressed
+        # payload has to be inflated front to back
+        return download_decrypt(file_id, output_path, password, client,
+                                key_cache)
+
+    # fail fast on a wrong password before opening any connections
+    reader.check()
+
+    per_unit = max(1, RANGE_SIZE // reader.step)
+    units = [(first, min(first + per_unit, reader.count) - 1)
+             for first in range(0, reader.count, per_unit)]
+    done = [0]
+    lock = threading.Lock()
+
+    def fetch(unit, out):
+        first, last = unit
+        a, b = reader.ciphertext_span(first, last)
+        error = None
+        for _ in range(RANGE_RETRIES + 1):
+            data, _ = client.fetch_range(file_id, a, b)
+            if len(data) != b - a + 1:
+                error = ValueError(f"Short read for bytes {a}-{b}.")
+                continue
+            try:
+                plain = reader.open_segments(first, data)
+            except ValueError as e:
+                error = e
+                continue
+            if out is not None:
+                offset = first * reader.segment_size
+                out[offset:offset + len(plain)] = plain
+            with lock:
+                done[0] += len(data)
+                if progress:
+                    progress(done[0], reader.total_size)
+            return
+        raise error
+
+    try:
+        with open(output_path, "wb+") as f:
+            f.truncate(reader.plain_size)
+            out = mmap.mmap(f.fileno(), reader.plain_size) if reader.plain_size else None
+            try:
+                with ThreadPoolExecutor(max_workers=connections) as pool:
+                    for fut in [pool.submit(fetch, u, out) for u in units]:
+                        fut.result()
+                if out is not None:
+                    out.flush()
+            finally:
+                if out is not None:
+                    out.close()
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+def open_ranged(file_id, password, client=None, key_cache=None):
+    # a RangedDecryptor over a CVLT2 object on Drive; keep it around to
+    # read several ranges without fetching the header again
+    client = client or get_client()
+    reader = _ranged(client, file_id, password, key_cache)
+    if reader is None:
+        raise ValueError("Byte ranges need the chunked (CVLT2) format.")
+    return reader
+
+def download_decrypt_range(file_id, start, length, password, client=None,
+                           key_cache=None):
+    # plaintext bytes [start, start + length) of a CVLT2 object, fetched
+    # with HTTP Range requests for just the header and covering segments
+    return open_ranged(file_id, password, client, key_cache).read(start, length)
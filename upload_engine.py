@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import random
+import socket
+import threading
+import httplib2
+from metrics import count
+
+# Drive resumable upload protocol, driven chunk by chunk so that a dropped
+# connection only costs the chunk in flight. The session URI and confirmed
+# byte offset are journalled after every chunk; a later run over the same
+# file asks Drive how far it got and continues from there.
+UPLOAD_JOURNAL = "upload_journal.json"
+CHUNK_ALIGN = 256 * 1024                 # Drive requires multiples of this
+UPLOAD_CHUNK_SIZE = 32 * CHUNK_ALIGN     # 8 MiB
+MAX_RETRIES = 8
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+SESSION_LIFETIME = 6 * 24 * 3600         # Drive keeps sessions for about a week
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class TransientError(Exception):
+    pass
+
+class SessionExpired(Exception):
+    pass
+
+def backoff_delay(attempt):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def is_retryable(resp, content):
+    if resp.status in RETRY_STATUSES:
+        return True
+    return resp.status == 403 and (b"rateLimitExceeded" in content
+                                   or b"userRateLimitExceeded" in content)
+
+def _check(resp, content):
+    if is_retryable(resp, content):
+        raise TransientError(f"HTTP {resp.status}")
+    if resp.status in (404, 410):
+        raise SessionExpired()
+    if resp.status >= 400:
+        raise RuntimeError(f"Upload failed: HTTP {resp.status} {content[:200]!r}")
+
+def request(http, uri, method, body=None, headers=None):
+    try:
+        return http.request(uri, method, body=body, headers=headers or {})
+    except (OSError, socket.timeout, httplib2.HttpLib2Error) as e:
+        raise TransientError(str(e))
+
+# ── journal ───────────────────────────────────────────────────────────────────
+class UploadJournal:
+    def __init__(self, path=UPLOAD_JOURNAL):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(file_path):
+        st = os.stat(file_path)
+        return f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except ValueError:
+            return {}
+        now = time.time()
+        return {k: v for k, v in entries.items()
+                if now - v.get("started", 0) < SESSION_LIFETIME}
+
+    def _save(self, entries):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+    def get(self, key):
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key, **fields):
+        with self._lock:
+            entries = self._load()
+            entries.setdefault(key, {"started": time.time()}).update(fields)
+            self._save(entries)
+
+    def remove(self, key):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+    def has_session(self, file_path):
+        return os.path.exists(file_path) and self.get(self.key(file_path)) is not None
+
+# ── protocol ──────────────────────────────────────────────────────────────────
+def _start_session(http, upload_url, name, size):
+    body = json.dumps({"name": name})
+    resp, content = request(http, upload_url + "?uploadType=resumable&fields=id",
+                            "POST", body, {
+                                "Content-Type": "application/json; charset=UTF-8",
+                                "X-Upload-Content-Type": "application/octet-stream",
+                                "X-Upload-Content-Length": str(size),
+                            })
+    _check(resp, content)
+    if "location" not in resp:
+        raise RuntimeError("Upload failed: no resumable session URI returned")
+    return resp["location"]
+
+def _confirmed_offset(resp):
+    # 308 carries "Range: bytes=0-N" once the server holds any bytes
+    rng = resp.get("range")
+    return int(rng.rsplit("-", 1)[1]) + 1 if rng else 0
+
+def _file_id(content):
+    return json.loads(content)["id"]
+
+def _query_offset(http, uri, size):
+    resp, content = request(http, uri, "PUT", b"",
+                            {"Content-Range": f"bytes */{size}",
+                             "Content-Length": "0"})
+    if resp.status in (200, 201):
+        return size, _file_id(content)
+    if resp.status == 308:
+        return _confirmed_offset(resp), None
+    _check(resp, content)
+    raise RuntimeError(f"Upload failed: unexpected HTTP {resp.status}")
+
+def resumable_upload(client, file_path, drive_name=None, journal=None,
+                     chunk_size=UPLOAD_CHUNK_SIZE, max_retries=MAX_RETRIES,
+                     progress=None):
+    drive_name = drive_name or os.path.basename(file_path)
+    chunk_size = max(CHUNK_ALIGN, chunk_size // CHUNK_ALIGN * CHUNK_ALIGN)
+    upload_url = client.root_url + "upload/drive/v3/files"
+    size = os.path.getsize(file_path)
+    key = journal.key(file_path) if journal else None
+    entry = journal.get(key) if journal else None
+
+    attempt = 0
+    restarted = False
+    with client.transport() as http, open(file_path, "rb") as f:
+        uri = entry["uri"] if entry else None
+        offset = None       # unknown until the server confirms it
+        while True:
+            try:
+                if uri is None:
+                    uri = _start_session(http, upload_url, drive_name, size)
+                    offset = 0
+                    if journal:
+                        journal.put(key, uri=uri, offset=0, name=drive_name)
+                if offset is None:
+                    offset, file_id = _query_offset(http, uri, size)
+                    if file_id:
+                        break
+
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                last = offset + len(chunk) - 1
+                crange = (f"bytes {offset}-{last}/{size}" if chunk
+                          else f"bytes */{size}")
+                resp, content = request(http, uri, "PUT", chunk, {
+                    "Content-Range": crange,
+                    "Content-Length": str(len(chunk)),
+                })
+                if resp.status in (200, 201):
+                    file_id = _file_id(content)
+                    count("bytes.up", size - offset)
+                    break
+                if resp.status != 308:
+                    _check(resp, content)
+                    raise RuntimeError(f"Upload failed: unexpected HTTP {resp.status}")
+
+                confirmed = _confirmed_offset(resp)
+                count("bytes.up", confirmed - offset)
+                offset = confirmed
+                attempt = 0
+                if journal:
+                    journal.put(key, offset=offset)
+                if progress:
+                    progress(offset, size)
+
+            except SessionExpired:
+                # the session is gone server-side: start over from byte 0
+                if uri is None or restarted:
+                    raise RuntimeError("Upload failed: HTTP 404")
+                count("upload.restarts")
+                restarted = True
+                uri = None
+                if journal:
+                    journal.remove(key)
+            except TransientError:
+                if attempt >= max_retries:
+                    raise
+                count("upload.retries")
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                offset = None
+
+    if journal:
+        journal.remove(key)
+    if progress:
+        progress(size, size)
+    return file_id